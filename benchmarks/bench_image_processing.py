@@ -0,0 +1,120 @@
+# benchmarks/bench_image_processing.py
+# Micro-benchmark del preprocesamiento de imágenes: compara el camino anterior (foto más
+# grande, decodificación completa) con el actual (PhotoSize mínima suficiente, decodificación
+# JPEG reducida con draft) y con el pool de procesos.
+#
+# Uso: python benchmarks/bench_image_processing.py [--iterations 50] [--workers 4]
+import os
+import io
+import sys
+import time
+import base64
+import random
+import argparse
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+# config.py exige estas variables; el benchmark no llama a ninguna API
+os.environ.setdefault("TELEGRAM_TOKEN", "benchmark")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_processing import process_image, select_photo_size, MAX_IMAGE_SIDE  # noqa: E402
+
+# Resoluciones que Telegram genera para una foto grande (lado mayor)
+TELEGRAM_SIDES = [90, 320, 800, 1280, 2560]
+
+
+def make_photo(width, height, seed=0):
+    """
+    Generar un JPEG con degradados y ruido, parecido en coste de decodificación a una foto real.
+    """
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.effect_noise((width, height), 64).convert('RGB')
+    image = Image.blend(image, noise, 0.5)
+    tint = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    image = Image.blend(image, tint, 0.3)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_photo_sizes(seed=0):
+    """
+    Devolver las versiones de una foto 4:3 como las entrega Telegram (PhotoSize + bytes).
+    """
+    sizes = []
+    for side in TELEGRAM_SIDES:
+        width, height = side, side * 3 // 4
+        sizes.append(SimpleNamespace(width=width, height=height, data=make_photo(width, height, seed)))
+    return sizes
+
+
+def legacy_process_image(file_content):
+    """
+    Camino anterior: decodificación completa y thumbnail (ANTIALIAS ya no existe en Pillow 10,
+    se usa LANCZOS, que es el mismo filtro).
+    """
+    image = Image.open(io.BytesIO(file_content))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if image.size[0] > 512 or image.size[1] > 512:
+        image.thumbnail((512, 512), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8'), None
+
+
+def run_serial(func, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        _, error = func(payload)
+        if error:
+            raise RuntimeError(error)
+    return time.perf_counter() - start
+
+
+def run_pool(payloads, workers):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(process_image, payloads[:workers]))  # Arrancar los procesos fuera de la medición
+        start = time.perf_counter()
+        for _, error in pool.map(process_image, payloads):
+            if error:
+                raise RuntimeError(error)
+        return time.perf_counter() - start
+
+
+def report(name, elapsed, count, baseline=None):
+    rate = count / elapsed
+    speedup = f"  x{baseline / elapsed:.1f}" if baseline else ""
+    print(f"{name:<48} {rate:8.1f} img/s  {elapsed * 1000 / count:7.2f} ms/img{speedup}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del preprocesamiento de imágenes")
+    parser.add_argument("--iterations", type=int, default=50, help="Imágenes procesadas por caso")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Procesos del pool")
+    args = parser.parse_args()
+
+    photos = [make_photo_sizes(seed) for seed in range(5)]
+    largest = [photo[-1].data for photo in photos]
+    selected = [select_photo_size(photo, MAX_IMAGE_SIDE).data for photo in photos]
+    chosen = select_photo_size(photos[0], MAX_IMAGE_SIDE)
+    print(f"PhotoSize elegida: {chosen.width}x{chosen.height} ({len(chosen.data) // 1024} KB) "
+          f"frente a {photos[0][-1].width}x{photos[0][-1].height} ({len(largest[0]) // 1024} KB)\n")
+
+    def batch(source):
+        return [source[i % len(source)] for i in range(args.iterations)]
+
+    baseline = run_serial(legacy_process_image, batch(largest))
+    report("anterior: foto más grande, decodificación completa", baseline, args.iterations)
+    report("foto más grande + draft", run_serial(process_image, batch(largest)), args.iterations, baseline)
+    report("PhotoSize mínima + draft", run_serial(process_image, batch(selected)), args.iterations, baseline)
+    report(f"PhotoSize mínima + draft, pool de {args.workers} procesos",
+           run_pool(batch(selected), args.workers), args.iterations, baseline)
+
+
+if __name__ == "__main__":
+    main()
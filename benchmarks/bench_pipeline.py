@@ -0,0 +1,425 @@
+# benchmarks/bench_pipeline.py
+# Prueba de carga del bot sin red: los handlers reales (register_message_handlers y
+# register_command_handlers, con el dispatcher, el planificador de salida, los historiales y el
+# procesamiento de imágenes) se ejecutan contra una Bot API falsa servida en local, en otro
+# proceso, y con proveedores de LLM simulados de latencia y tamaño de respuesta configurables.
+#
+# Se reproduce un flujo sintético de updates (texto, fotos y comandos; muchos usuarios o pocos
+# usuarios muy activos) y se informa de mensajes/s, latencia hasta la respuesta (p50/p95/p99),
+# CPU, RSS y la latencia de cada etapa (utils.metrics).
+#
+# Uso: python benchmarks/bench_pipeline.py [--messages 2000] [--users 200] [--hot-users 10]
+#      [--mix text=0.85,photo=0.1,command=0.05] [--llm-latency 0.3] [--reply-chars 600] [--json]
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import resource
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_TOKEN = "123456:benchmark"
+STUB_REPLY_MARKER = "[stub]"
+IMAGE_PROGRESS_PREFIXES = ("Analizando la imagen", "Análisis de la imagen")
+COMMANDS = ["/help", "/models", "/current_model", "/start"]
+PHOTO_SIDES = [90, 320, 800, 1280]
+WORDS = ("hola que tal como estas hoy quiero saber algo sobre el caos la noche el mar las estrellas "
+         "los libros la musica y el tiempo que pasa sin que nadie lo note").split()
+
+
+# --- Bot API falsa (proceso aparte, para no mezclar su CPU con la del bot) ---
+
+def run_fake_api(port_value, ready, events, api_latency, unique_photos):
+    from bench_image_processing import make_photo
+
+    photos = {}
+    for number in range(unique_photos):
+        for side in PHOTO_SIDES:
+            photos[f"p{number}_{side}"] = make_photo(side, side * 3 // 4, seed=number)
+    message_ids = itertools.count(1)
+
+    class FakeBotAPIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _params(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                body = self.rfile.read(length)
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params.update(json.loads(body))
+                elif self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+            return url.path, params
+
+        def _handle(self):
+            path, params = self._params()
+            if api_latency:
+                time.sleep(api_latency)
+            if path.startswith("/file/"):
+                data = photos.get(os.path.splitext(os.path.basename(path))[0])
+                if data is None:
+                    self._reply(404, b"not found", "text/plain")
+                else:
+                    self._reply(200, data, "image/jpeg")
+                return
+
+            method = path.rsplit("/", 1)[-1]
+            chat_id = params.get("chat_id")
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            elif method == "getFile":
+                file_id = params["file_id"]
+                result = {"file_id": file_id, "file_unique_id": file_id, "file_path": f"photos/{file_id}.jpg"}
+            elif method in ("deleteMessage", "sendChatAction"):
+                result = True
+            else:
+                # sendMessage, editMessageText, sendVoice...
+                result = {
+                    "message_id": params.get("message_id") or next(message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": int(chat_id or 0), "type": "private"},
+                    "text": params.get("text", ""),
+                }
+                events.put((method, str(chat_id), params.get("text", ""), time.monotonic()))
+            self._reply(200, json.dumps({"ok": True, "result": result}).encode())
+
+        do_GET = _handle
+        do_POST = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPIHandler)
+    server.daemon_threads = True
+    port_value.value = server.server_address[1]
+    ready.set()
+    server.serve_forever()
+
+
+class ReplyTracker:
+    """
+    Empareja cada update enviado con su respuesta final (la respuesta del LLM simulado, o la
+    respuesta de un comando) y guarda la latencia. Los updates de un chat se procesan en orden,
+    pero las respuestas del LLM pasan por el planificador de salida y las de los comandos no,
+    así que cada respuesta se asigna al primer update pendiente de su tipo.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.pending = {}
+        self.latencies = []
+        self.last_answer_at = None
+        self.telegram_calls = 0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._outstanding = 0
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def expect(self, chat_id, kind):
+        with self._lock:
+            self.pending.setdefault(str(chat_id), deque()).append((kind, time.monotonic()))
+            self._outstanding += 1
+
+    def _collect(self):
+        while True:
+            method, chat_id, text, at = self.events.get()
+            with self._lock:
+                self.telegram_calls += 1
+                queue = self.pending.get(chat_id)
+                if method != "sendMessage" or not queue or text.startswith(IMAGE_PROGRESS_PREFIXES):
+                    continue
+                is_command_reply = not text.startswith(STUB_REPLY_MARKER)
+                for entry in queue:
+                    if (entry[0] == "command") == is_command_reply:
+                        queue.remove(entry)
+                        self.latencies.append(at - entry[1])
+                        self.last_answer_at = at
+                        self._outstanding -= 1
+                        self._done.notify_all()
+                        break
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._outstanding > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._done.wait(remaining)
+            return self._outstanding
+
+
+# --- Flujo sintético de updates ---
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def pick_user(rng, args):
+    """
+    Con --hot-users, el 80 % de los mensajes sale de ese grupo pequeño de usuarios.
+    """
+    if args.hot_users and rng.random() < 0.8:
+        return 1000 + rng.randrange(args.hot_users)
+    return 1000 + rng.randrange(args.users)
+
+
+def make_update(update_id, user_id, kind, rng, args):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"Usuario{user_id}", "username": f"user{user_id}"},
+    }
+    if kind == "command":
+        message["text"] = rng.choice(COMMANDS)
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(message["text"])}]
+    elif kind == "photo":
+        number = rng.randrange(args.unique_photos)
+        message["photo"] = [
+            {"file_id": f"p{number}_{side}", "file_unique_id": f"p{number}_{side}",
+             "width": side, "height": side * 3 // 4, "file_size": side * side // 10}
+            for side in PHOTO_SIDES
+        ]
+        if rng.random() < 0.5:
+            message["caption"] = "que ves en esta foto"
+    else:
+        message["text"] = " ".join(rng.choice(WORDS) for _ in range(args.text_words))
+    return {"update_id": update_id, "message": message}
+
+
+# --- Proveedores simulados ---
+
+def install_stub_providers(args):
+    import asyncio
+    import models.router as router
+    import handlers.messages as messages
+    import utils.context_window as context_window
+
+    rng = random.Random(args.seed)
+    lock = threading.Lock()
+
+    def delay(mean):
+        with lock:
+            return max(0.0, rng.gauss(mean, mean * args.jitter))
+
+    def reply_text(chars):
+        text = STUB_REPLY_MARKER + " " + ("lorem ipsum dolor sit amet " * (chars // 27 + 1))
+        return text[:max(chars, len(STUB_REPLY_MARKER))]
+
+    def complete(prompt, history):
+        prompt.to_messages()  # El coste de serializar el prompt forma parte del camino real
+        time.sleep(delay(args.llm_latency))
+        return reply_text(args.reply_chars)
+
+    async def complete_async(prompt, history):
+        prompt.to_messages()
+        await asyncio.sleep(delay(args.llm_latency))
+        return reply_text(args.reply_chars)
+
+    def complete_stream(prompt, history):
+        yield complete(prompt, history)
+
+    def vision(encoded_images):
+        time.sleep(delay(args.vision_latency))
+        return "[vision] Una imagen con degradados y ruido."
+
+    def summary(request, max_tokens):
+        time.sleep(delay(args.llm_latency))
+        return "[summary] El usuario conversa sobre temas variados."
+
+    for provider in list(router.PROVIDERS):
+        router.PROVIDERS[provider] = (complete, complete_async, router.PROVIDERS[provider][2], complete_stream)
+        router.PROVIDER_KEYS[provider] = "benchmark"
+    messages.generate_groq_image_analysis = vision
+    context_window.generate_groq_summary = summary
+    context_window.generate_google_summary = summary
+
+
+# --- Medición ---
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del bot con Telegram y proveedores simulados")
+    parser.add_argument("--messages", type=int, default=2000, help="Updates que se envían")
+    parser.add_argument("--users", type=int, default=200, help="Usuarios distintos")
+    parser.add_argument("--hot-users", type=int, default=0, help="Usuarios que concentran el 80 %% del tráfico (0 = uniforme)")
+    parser.add_argument("--mix", default="text=0.85,photo=0.1,command=0.05", help="Proporción de cada tipo de update")
+    parser.add_argument("--rate", type=float, default=0, help="Updates por segundo (0 = todos de golpe)")
+    parser.add_argument("--text-words", type=int, default=12, help="Palabras por mensaje de texto")
+    parser.add_argument("--unique-photos", type=int, default=20, help="Fotos distintas (las repetidas usan la caché)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Latencia media del LLM simulado (s)")
+    parser.add_argument("--vision-latency", type=float, default=0.5, help="Latencia media del modelo de visión simulado (s)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Desviación de las latencias, relativa a la media")
+    parser.add_argument("--reply-chars", type=int, default=600, help="Longitud de las respuestas simuladas")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Latencia de la Bot API falsa (s)")
+    parser.add_argument("--workers", type=int, default=None, help="CHAT_WORKERS (por defecto, el de config.py)")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default=None, help="HISTORY_STORAGE")
+    parser.add_argument("--telegram-limits", action="store_true", help="Respetar los límites de envío reales")
+    parser.add_argument("--timeout", type=float, default=300, help="Espera máxima por las respuestas (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-data", action="store_true", help="No borrar el directorio temporal de historiales")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resultado en JSON")
+    args = parser.parse_args()
+
+    # La Bot API falsa arranca antes de importar el bot (proceso limpio, sin hilos)
+    context = multiprocessing.get_context("fork")
+    port_value, ready, events = context.Value("i", 0), context.Event(), context.Queue()
+    api = context.Process(
+        target=run_fake_api, args=(port_value, ready, events, args.api_latency, args.unique_photos), daemon=True
+    )
+    api.start()
+    ready.wait(30)
+
+    # Configuración del bot: datos en un directorio temporal y métricas por etapa activas
+    data_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.environ.update({
+        "TELEGRAM_TOKEN": BENCH_TOKEN,
+        "GROQ_API_KEY": "benchmark",
+        "GOOGLE_API_KEY": "benchmark",
+        "CONVERSATION_DIR": data_dir,
+        "USER_IDS_FILE": os.path.join(data_dir, "user_chat_ids.txt"),
+        "USER_REGISTRY_FILE": os.path.join(data_dir, "user_registry.json"),
+        "METRICS_ENABLED": "true",
+    })
+    if args.workers is not None:
+        os.environ["CHAT_WORKERS"] = str(args.workers)
+    if args.storage:
+        os.environ["HISTORY_STORAGE"] = args.storage
+    if not args.telegram_limits:
+        os.environ.update({"OUTBOUND_GLOBAL_RATE": "1000000", "OUTBOUND_CHAT_RATE": "1000000", "OUTBOUND_GROUP_RATE": "1000000"})
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from telebot import TeleBot, apihelper, types
+    from config import CHAT_WORKERS, HISTORY_STORAGE
+    from handlers.commands import register_command_handlers
+    from handlers.messages import register_message_handlers
+    from utils.dispatcher import chat_dispatcher
+    from utils.send_queue import outbound
+    from utils.history_cache import history_cache
+    from utils.user_registry import user_registry
+    from utils.provider_registry import provider_registry
+    from utils.image_processing import shutdown_image_pool
+    from utils.metrics import metrics
+
+    base_url = f"http://127.0.0.1:{port_value.value}"
+    apihelper.API_URL = base_url + "/bot{0}/{1}"
+    apihelper.FILE_URL = base_url + "/file/bot{0}/{1}"
+    provider_registry.install_telegram_session()
+    install_stub_providers(args)
+
+    # Igual que bot.py
+    bot = TeleBot(BENCH_TOKEN, threaded=CHAT_WORKERS <= 0)
+    if CHAT_WORKERS > 0:
+        chat_dispatcher.install(bot)
+    register_command_handlers(bot)
+    register_message_handlers(bot)
+
+    tracker = ReplyTracker(events)
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    updates = []
+    for update_id in range(1, args.messages + 1):
+        kind = rng.choices(kinds, weights)[0]
+        user_id = pick_user(rng, args)
+        updates.append((user_id, kind, make_update(update_id, user_id, kind, rng, args)))
+
+    cpu_start = time.process_time()
+    started = time.monotonic()
+    for index, (user_id, kind, update) in enumerate(updates):
+        if args.rate:
+            wait = started + index / args.rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        tracker.expect(user_id, kind)
+        bot.process_new_updates([types.Update.de_json(update)])
+    sent_in = time.monotonic() - started
+    unanswered = tracker.wait(args.timeout)
+    elapsed = (tracker.last_answer_at or time.monotonic()) - started
+    cpu = time.process_time() - cpu_start
+
+    if CHAT_WORKERS > 0:
+        chat_dispatcher.shutdown()
+    outbound.shutdown()
+    shutdown_image_pool()
+    history_cache.shutdown()
+    user_registry.persist()
+    api.terminate()
+
+    answered = len(tracker.latencies)
+    result = {
+        "messages": args.messages,
+        "answered": answered,
+        "unanswered": unanswered,
+        "workers": CHAT_WORKERS,
+        "storage": HISTORY_STORAGE,
+        "injection_seconds": round(sent_in, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(answered / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            f"p{round(q * 100)}": round(percentile(tracker.latencies, q) * 1000, 1) if answered else None
+            for q in (0.5, 0.95, 0.99)
+        },
+        "cpu_seconds": round(cpu, 2),
+        "cpu_ms_per_message": round(cpu * 1000 / max(answered, 1), 2),
+        "rss_mb": round(current_rss_mb(), 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "telegram_calls": tracker.telegram_calls,
+        "stages_ms": metrics.get_stats(),
+    }
+
+    if not args.keep_data:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"\nMensajes: {answered}/{args.messages} respondidos en {elapsed:.2f} s "
+          f"({result['messages_per_second']} msg/s; enviados en {sent_in:.2f} s)")
+    print(f"Workers: {CHAT_WORKERS}  Historiales: {HISTORY_STORAGE}  Llamadas a Telegram: {tracker.telegram_calls}")
+    print("Latencia hasta la respuesta: " + "  ".join(f"{key} {value} ms" for key, value in result["latency_ms"].items()))
+    print(f"CPU: {cpu:.2f} s ({result['cpu_ms_per_message']} ms/mensaje)  RSS: {result['rss_mb']} MB "
+          f"(máx. {result['max_rss_mb']} MB)\n")
+    print(f"{'etapa':<20} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, values in result["stages_ms"].items():
+        print(f"{stage:<20} {values['count']:>7} {values['p50']:>9} {values['p95']:>9} {values['p99']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,27 @@ import os
 import logging
 import time
 import signal
-import json
-from datetime import datetime, timedelta
+import threading
 from telebot import TeleBot, apihelper
 from requests.exceptions import RequestException
-from config import TELEGRAM_TOKEN
+from config import TELEGRAM_TOKEN, CHAT_WORKERS, COALESCE_WINDOW, WEBHOOK_URL
 from handlers.commands import register_command_handlers
 from handlers.messages import register_message_handlers
+from utils.history_cache import history_cache
+from utils.user_registry import user_registry
+from utils.prompt_registry import prompt_registry
+from utils.dispatcher import chat_dispatcher
+from utils.coalescing import chat_generations
+from utils.send_queue import outbound
+from utils.broadcast import start_welcome_broadcast
+from utils.provider_registry import provider_registry
+from utils.image_cache import image_cache
+from utils.image_processing import shutdown_image_pool
+from models.router import model_router
+from utils.response_cache import response_cache
+from utils.metrics import metrics
+from utils.webhook import WebhookServer
+from utils.voice import tts
 
 # Añadir el directorio raíz, utils y handlers al sys.path
 project_root = os.path.dirname(os.path.abspath(__file__))
@@ -22,83 +36,56 @@ sys.path.insert(0, os.path.join(project_root, 'handlers'))
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Ajustar el timeout global para las solicitudes a la API de Telegram
-apihelper.CONNECT_TIMEOUT = 30
-apihelper.READ_TIMEOUT = 30
-
-# Crear la instancia del bot
-bot = TeleBot(TELEGRAM_TOKEN)
-
-# Registrar manejadores
-register_command_handlers(bot)
-register_message_handlers(bot)
+bot = None
+batchers = []  # Agrupadores de álbumes y mensajes seguidos (ver handlers.messages)
+
+def setup():
+    """
+    Crear el bot, instalar el dispatcher y registrar los manejadores (lo llaman main() y los
+    workers de supervisor.py). No se hace al importar el módulo: el pool de imágenes usa spawn y
+    cada proceso hijo vuelve a importar bot.py como __mp_main__, donde no debe crear otro bot ni
+    arrancar los workers del dispatcher.
+    """
+    global bot, batchers
+
+    # Ajustar el timeout global para las solicitudes a la API de Telegram
+    apihelper.CONNECT_TIMEOUT = 30
+    apihelper.READ_TIMEOUT = 30
+    # Una sola sesión HTTP con pool keep-alive para todos los hilos que llaman a Telegram
+    provider_registry.install_telegram_session()
+
+    # Crear la instancia del bot. Con CHAT_WORKERS > 0 los updates se reparten por chat_id entre
+    # los workers del dispatcher (orden por chat, paralelismo entre chats) en lugar del pool de TeleBot.
+    bot = TeleBot(TELEGRAM_TOKEN, threaded=CHAT_WORKERS <= 0)
+    # Con la fusión de mensajes activa, cada mensaje marca su chat al llegar: la respuesta en curso
+    # de ese chat se descarta sin esperar a que el mensaje salga de la cola.
+    if CHAT_WORKERS > 0:
+        chat_dispatcher.install(bot, on_update=chat_generations.observe_update if COALESCE_WINDOW > 0 else None)
+
+    # Registrar manejadores
+    register_command_handlers(bot)
+    batchers = register_message_handlers(bot)
+    return bot
 
 def get_all_user_chat_ids():
-    user_ids = []
-    file_path = 'user_chat_ids.txt'  # Archivo donde se almacenan los IDs de usuario
-
-    try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                user_ids = file.read().splitlines()  # Obtener todos los IDs de usuario
-            logger.info(f"User IDs cargados: {user_ids}")
-        else:
-            logger.warning(f"El archivo {file_path} no existe, no se encontraron IDs de usuario.")
-    except Exception as e:
-        logger.warning(f"Error al cargar los IDs de usuario: {e}")
-
-    return user_ids
-
-def load_welcome_log():
-    file_path = 'welcome_message_log.json'
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            welcome_log = json.load(file)
+    # Los IDs se leen del registro compartido, cargado una sola vez al arrancar
+    user_ids = user_registry.all_ids()
+    if user_ids:
+        logger.info(f"User IDs cargados: {len(user_ids)}")
     else:
-        welcome_log = {}
-    return welcome_log
-
-def save_welcome_log(welcome_log):
-    file_path = 'welcome_message_log.json'
-    with open(file_path, 'w') as file:
-        json.dump(welcome_log, file)
-
-def should_send_welcome(user_id, welcome_log):
-    last_sent_str = welcome_log.get(user_id)
-    if last_sent_str:
-        last_sent = datetime.fromisoformat(last_sent_str)
-        if datetime.now() - last_sent < timedelta(hours=24):
-            return False
-    return True
+        logger.warning("No se encontraron IDs de usuario en el registro.")
+    return user_ids
 
-def update_welcome_log(user_id, welcome_log):
-    welcome_log[user_id] = datetime.now().isoformat()
+welcome_broadcast = None
 
 def run_bot_with_reconnect(bot):
+    global welcome_broadcast
     logger.info("Iniciando el bot...")
 
-    # Enviar un mensaje de bienvenida a todos los IDs de usuario almacenados
-    welcome_message = "Embrace the chaos, for in the fragments lies the truth. Let's dance through the dissonance together."
-    user_ids = get_all_user_chat_ids()  # Obtener los IDs de usuario
-
-    welcome_log = load_welcome_log()
-
-    if user_ids:
-        logger.info("Verificando si se debe enviar mensajes de bienvenida a los IDs cargados:")
-        for user_id in user_ids:
-            if should_send_welcome(user_id, welcome_log):
-                logger.info(f"Enviando mensaje a User ID: {user_id}")
-                try:
-                    bot.send_message(user_id, welcome_message)
-                    update_welcome_log(user_id, welcome_log)
-                except Exception as e:
-                    logger.error(f"Error al enviar mensaje a User ID {user_id}: {e}")
-            else:
-                logger.info(f"El mensaje de bienvenida ya se envió al usuario {user_id} en las últimas 24 horas.")
-        # Guardar el registro actualizado
-        save_welcome_log(welcome_log)
-    else:
-        logger.warning("No se encontraron IDs de usuario para enviar el mensaje de bienvenida.")
+    # Servir las métricas por etapa en /metrics (solo si METRICS_ENABLED)
+    metrics.start_server()
+    # Enviar el mensaje de bienvenida en segundo plano: el polling arranca sin esperar
+    welcome_broadcast = start_welcome_broadcast(bot, get_all_user_chat_ids())
 
     while True:
         try:
@@ -115,17 +102,69 @@ def run_bot_with_reconnect(bot):
             time.sleep(5)
         logger.info("Intentando reconectar...")
 
+webhook_server = None
+
+def run_bot_with_webhook(bot):
+    """
+    Recibir los updates por webhook: sin long polling ni bucle de reconexión. El servidor
+    atiende en su propio hilo; el hilo principal solo espera a que llegue una señal.
+    """
+    global welcome_broadcast, webhook_server
+    logger.info("Iniciando el bot (modo webhook)...")
+
+    metrics.start_server()
+    welcome_broadcast = start_welcome_broadcast(bot, get_all_user_chat_ids())
+
+    webhook_server = WebhookServer(bot)
+    webhook_server.start()
+    threading.Event().wait()
+
+def shutdown():
+    """
+    Vaciar las colas, guardar el estado pendiente y registrar las estadísticas.
+    También la usan los workers de supervisor.py al detenerse.
+    """
+    if webhook_server is not None:
+        webhook_server.shutdown()  # Dejar de aceptar updates antes de vaciar las colas
+        logger.info(f"Webhook: {webhook_server.get_stats()}")
+    bot.stop_polling()
+    for batcher in batchers:
+        batcher.flush_all()  # Los lotes en espera se encolan antes de vaciar el dispatcher
+    if CHAT_WORKERS > 0:
+        chat_dispatcher.shutdown()
+    outbound.shutdown()  # Entregar los mensajes encolados (y guardar las respuestas confirmadas)
+    if welcome_broadcast is not None:
+        welcome_broadcast.checkpoint()  # Las bienvenidas confirmadas no se repiten al reiniciar
+    shutdown_image_pool()
+    history_cache.shutdown()  # Escribir los historiales pendientes antes de salir
+    user_registry.persist()
+    logger.info(f"Conexiones y clientes de proveedores: {provider_registry.get_stats()}")
+    logger.info(f"Caché de análisis de imágenes: {image_cache.get_stats()}")
+    logger.info(f"Enrutado de proveedores: {model_router.get_stats()}")
+    logger.info(f"Caché de respuestas: {response_cache.get_stats()}")
+    logger.info(f"Caché de voz: {tts.get_stats()}")
+    if metrics.enabled:
+        logger.info(f"Latencias por etapa (ms): {metrics.get_stats()}")
+        metrics.shutdown()
+
 def main():
     def stop_bot(signal_received, frame):
         logger.info("Deteniendo el bot...")
-        bot.stop_polling()
+        shutdown()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, stop_bot)
     signal.signal(signal.SIGTERM, stop_bot)
+    # SIGHUP recarga los prompts sin reiniciar el bot (no disponible en Windows)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signal_received, frame: prompt_registry.reload())
 
+    setup()
     logger.info("Bot iniciado. Presiona Ctrl+C para detener el bot.")
-    run_bot_with_reconnect(bot)
+    if WEBHOOK_URL:
+        run_bot_with_webhook(bot)
+    else:
+        run_bot_with_reconnect(bot)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+# bot_async.py
+# Punto de entrada alternativo: ejecuta el bot sobre asyncio con AsyncTeleBot.
+# Las llamadas a Telegram, Groq y Gemini no bloquean hilos, así que un solo proceso puede
+# atender cientos de conversaciones a la vez. El disco y Pillow se ejecutan en un executor.
+import sys
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from telebot.async_telebot import AsyncTeleBot
+from config import TELEGRAM_TOKEN, ASYNC_EXECUTOR_WORKERS
+from handlers.async_handlers import register_async_handlers
+from utils.history_cache import history_cache
+from utils.user_registry import user_registry
+from utils.image_processing import shutdown_image_pool
+from utils.metrics import metrics
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+bot = None
+
+def setup():
+    """
+    Crear la instancia del bot y registrar manejadores. Como en bot.py, no se hace al importar el
+    módulo: los procesos del pool de imágenes (spawn) lo vuelven a importar como __mp_main__.
+    """
+    global bot
+    bot = AsyncTeleBot(TELEGRAM_TOKEN)
+    register_async_handlers(bot)
+    return bot
+
+async def run_bot_with_reconnect(bot):
+    logger.info("Iniciando el bot (modo asyncio)...")
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="bot-io"))
+    metrics.start_server()  # Solo si METRICS_ENABLED
+
+    while True:
+        try:
+            await bot.polling(non_stop=True, interval=0, timeout=20)
+            break  # polling terminó sin error (detención solicitada)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error inesperado: {e}", exc_info=True)
+            await asyncio.sleep(5)
+        logger.info("Intentando reconectar...")
+
+async def run():
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(run_bot_with_reconnect(bot))
+
+    def stop_bot():
+        logger.info("Deteniendo el bot...")
+        task.cancel()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_bot)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C llega como KeyboardInterrupt
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await bot.close_session()
+
+def main():
+    setup()
+    logger.info("Bot iniciado en modo asyncio. Presiona Ctrl+C para detener el bot.")
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_image_pool()
+        if metrics.enabled:
+            logger.info(f"Latencias por etapa (ms): {metrics.get_stats()}")
+            metrics.shutdown()
+        history_cache.shutdown()  # Escribir los historiales pendientes antes de salir
+        user_registry.persist()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,143 @@ TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 ADMIN_CHAT_ID = os.environ.get("ADMIN_CHAT_ID")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")  # /image (DALL-E)
 
 # Definir CONVERSATION_DIR
-CONVERSATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conversation_logs')
+CONVERSATION_DIR = os.environ.get(
+    "CONVERSATION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conversation_logs')
+)
 
 # Asegurarse de que el directorio existe
 if not os.path.exists(CONVERSATION_DIR):
     os.makedirs(CONVERSATION_DIR)
 
+# Caché de historiales en memoria con escritura diferida
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "1024"))  # Historiales vivos en memoria
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "2.0"))  # Segundos entre volcados (0 = escritura inmediata)
+HISTORY_FLUSH_THRESHOLD = int(os.environ.get("HISTORY_FLUSH_THRESHOLD", "50"))  # Historiales modificados que fuerzan un volcado
+HISTORY_STATS_LOG_INTERVAL = float(os.environ.get("HISTORY_STATS_LOG_INTERVAL", "300"))  # Segundos entre logs de estadísticas
+
+# Registro de usuarios conocidos
+USER_IDS_FILE = os.environ.get("USER_IDS_FILE", "user_chat_ids.txt")  # Un ID por línea
+USER_REGISTRY_FILE = os.environ.get("USER_REGISTRY_FILE", "user_registry.json")  # Primera/última aparición
+USER_REGISTRY_PERSIST_INTERVAL = float(os.environ.get("USER_REGISTRY_PERSIST_INTERVAL", "60"))  # Segundos
+
+# Segundos entre comprobaciones de cambios en los archivos de prompts (recarga en caliente)
+PROMPT_RELOAD_CHECK_INTERVAL = float(os.environ.get("PROMPT_RELOAD_CHECK_INTERVAL", "2.0"))
+
+# Respuestas en streaming: se muestra el texto a medida que el modelo lo genera
+STREAMING_ENABLED = os.environ.get("STREAMING_ENABLED", "false").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))  # Segundos mínimos entre ediciones
+
+# Procesamiento concurrente de updates: workers con una cola cada uno, repartidos por chat_id (0 = pool de TeleBot)
+CHAT_WORKERS = int(os.environ.get("CHAT_WORKERS", "8"))
+# Peticiones simultáneas máximas por proveedor (0 = sin límite)
+GROQ_MAX_INFLIGHT = int(os.environ.get("GROQ_MAX_INFLIGHT", "0"))
+GOOGLE_MAX_INFLIGHT = int(os.environ.get("GOOGLE_MAX_INFLIGHT", "0"))
+
+# Modo asyncio (bot_async.py): hilos del executor para disco, Pillow y gTTS
+ASYNC_EXECUTOR_WORKERS = int(os.environ.get("ASYNC_EXECUTOR_WORKERS", "32"))
+
+# Planificador de envíos salientes a Telegram (mensajes por segundo)
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.environ.get("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_GROUP_RATE = float(os.environ.get("OUTBOUND_GROUP_RATE", "0.33"))  # ~20 mensajes por minuto
+OUTBOUND_SENDERS = int(os.environ.get("OUTBOUND_SENDERS", "8"))  # Hilos que ejecutan los envíos
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "3"))
+# Segundos que el worker del chat espera la entrega de una respuesta antes de guardarla al confirmarse
+REPLY_DELIVERY_WAIT = float(os.environ.get("REPLY_DELIVERY_WAIT", "2"))
+
+# Mensaje de bienvenida al arrancar (se envía en segundo plano)
+WELCOME_LOG_FILE = os.environ.get("WELCOME_LOG_FILE", "welcome_message_log.json")
+BROADCAST_MAX_IN_FLIGHT = int(os.environ.get("BROADCAST_MAX_IN_FLIGHT", "20"))  # Envíos de bienvenida encolados a la vez
+BROADCAST_CHECKPOINT_INTERVAL = float(os.environ.get("BROADCAST_CHECKPOINT_INTERVAL", "5"))  # Segundos entre guardados del registro
+
+# Ventana de contexto: tokens para historial + resumen, ajustables por modelo ("mistral=2000,google=6000")
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_BUDGETS = {
+    name.strip(): int(budget)
+    for name, budget in (item.split("=") for item in os.environ.get("CONTEXT_TOKEN_BUDGETS", "mistral=2000,google=4000").split(",") if item.strip())
+}
+CONTEXT_MAX_MESSAGES = int(os.environ.get("CONTEXT_MAX_MESSAGES", "40"))  # Mensajes recientes candidatos a la ventana
+# Resumen acumulado de los turnos que salen de la ventana: se actualiza cada N turnos
+SUMMARY_UPDATE_EVERY = int(os.environ.get("SUMMARY_UPDATE_EVERY", "6"))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", "400"))
+
+# Conexiones HTTP compartidas (Telegram, Groq): tamaño del pool (0 = según los workers) y vida de las conexiones ociosas
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "0"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))  # Segundos
+PROVIDER_CACHE_SIZE = int(os.environ.get("PROVIDER_CACHE_SIZE", "32"))  # Modelos de Gemini construidos que se conservan
+
+# Procesos para decodificar y redimensionar imágenes (0 = en el hilo del handler)
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_PROCESS_TIMEOUT = float(os.environ.get("IMAGE_PROCESS_TIMEOUT", "30"))  # Segundos por imagen en el pool
+
+# Álbumes: las fotos con el mismo media_group_id que llegan dentro de la ventana se responden juntas
+MEDIA_GROUP_WINDOW = float(os.environ.get("MEDIA_GROUP_WINDOW", "1.0"))  # Segundos
+MEDIA_GROUP_MAX_ITEMS = 10  # Máximo de Telegram por álbum
+
+# Mensajes seguidos del mismo chat que llegan dentro de la ventana se responden como un solo turno;
+# un mensaje nuevo descarta la respuesta que se estuviera generando para ese chat (0 = desactivado)
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", "0"))  # Segundos
+COALESCE_MAX_MESSAGES = int(os.environ.get("COALESCE_MAX_MESSAGES", "10"))
+
+# Caché de análisis de imágenes (por file_unique_id y por hash del contenido)
+IMAGE_CACHE_PATH = os.environ.get("IMAGE_CACHE_PATH", os.path.join(CONVERSATION_DIR, "image_cache.sqlite3"))
+IMAGE_CACHE_TTL = float(os.environ.get("IMAGE_CACHE_TTL", str(7 * 24 * 3600)))  # Segundos (0 = sin caducidad)
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "20000"))
+
+# Enrutado entre proveedores: si el principal tarda más que su p95 se lanza la misma petición
+# al otro proveedor y se usa la primera respuesta; los proveedores que fallan seguido se apartan
+HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS", "true").lower() in ("1", "true", "yes")
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))  # Latencias medidas antes de usar el p95
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "10"))  # Segundos, mientras no hay muestras
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))  # Fallos seguidos
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "30"))  # Segundos fuera de rotación
+
+# Caché de respuestas para mensajes cortos y repetidos ("hola", saludos...): misma respuesta
+# para el mismo modelo, instrucciones de sistema y texto normalizado, sin tener en cuenta el historial
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))  # Segundos
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_VARIANTS = int(os.environ.get("RESPONSE_CACHE_VARIANTS", "3"))  # Respuestas distintas por mensaje
+RESPONSE_CACHE_MAX_CHARS = int(os.environ.get("RESPONSE_CACHE_MAX_CHARS", "40"))  # Mensajes más largos no se cachean
+
+# Métricas de latencia por etapa, en formato Prometheus en http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+
+# Modo webhook: con WEBHOOK_URL (URL pública, normalmente la del balanceador con TLS) el bot
+# recibe los updates en un servidor HTTP propio en lugar de hacer long polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # Cabecera X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Con varios procesos detrás del balanceador, solo uno debe registrar el webhook en Telegram
+WEBHOOK_REGISTER = os.environ.get("WEBHOOK_REGISTER", "true").lower() in ("1", "true", "yes")
+WEBHOOK_DEDUPE_SIZE = int(os.environ.get("WEBHOOK_DEDUPE_SIZE", "10000"))  # update_id recientes recordados
+
+# Modo supervisor (supervisor.py): un proceso de ingesta reparte los updates por chat_id entre
+# SHARD_WORKERS procesos, cada uno dueño de los historiales de sus chats
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "4"))
+SHARD_HEARTBEAT_TIMEOUT = float(os.environ.get("SHARD_HEARTBEAT_TIMEOUT", "30"))  # Segundos sin latido antes de reiniciar un worker
+SHARD_STALL_TIMEOUT = float(os.environ.get("SHARD_STALL_TIMEOUT", "300"))  # Segundos con updates en cola sin completar ninguno
+SHARD_STATS_INTERVAL = float(os.environ.get("SHARD_STATS_INTERVAL", "60"))  # Segundos entre logs de rendimiento por shard
+
+# Texto a voz (/voice): caché en disco del audio por fragmento (hash del texto + idioma)
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(CONVERSATION_DIR, "tts_cache"))
+TTS_CACHE_MAX_MB = float(os.environ.get("TTS_CACHE_MAX_MB", "100"))  # Se borran los fragmentos usados hace más tiempo
+TTS_CHUNK_CHARS = int(os.environ.get("TTS_CHUNK_CHARS", "200"))  # Caracteres máximos por fragmento (se corta entre frases)
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "4"))  # Fragmentos sintetizados en paralelo
+
+# Almacenamiento de historiales: "json" (documento completo), "journal" (diario JSONL + snapshots) o "sqlite"
+HISTORY_STORAGE = os.environ.get("HISTORY_STORAGE", "json").lower()
+HISTORY_JOURNAL_COMPACT_EVERY = int(os.environ.get("HISTORY_JOURNAL_COMPACT_EVERY", "200"))  # Registros entre snapshots
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", os.path.join(CONVERSATION_DIR, "history.sqlite3"))
+
 # Verificar si las variables de entorno están configuradas
 if not TELEGRAM_TOKEN:
     raise ValueError("La variable de entorno TELEGRAM_TOKEN no está configurada.")
@@ -21,6 +150,9 @@ if not TELEGRAM_TOKEN:
 if not GROQ_API_KEY and not GOOGLE_API_KEY:
     raise ValueError("Debe configurar al menos una de las claves GROQ_API_KEY o GOOGLE_API_KEY.")
 
+if HISTORY_STORAGE not in ("json", "journal", "sqlite"):
+    raise ValueError("HISTORY_STORAGE debe ser 'json', 'journal' o 'sqlite'.")
+
 if ADMIN_CHAT_ID:
     try:
         ADMIN_CHAT_ID = int(ADMIN_CHAT_ID)
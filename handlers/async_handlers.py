@@ -0,0 +1,307 @@
+# handlers/async_handlers.py
+import time
+import asyncio
+import logging
+from functools import partial
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiException, RequestTimeout
+from aiohttp import ClientError
+from utils.error_handling import handle_error_async
+from utils.history_cache import get_history
+from utils.user_registry import user_registry
+from utils.image_processing import preprocess_image_async, select_photo_size
+from utils.image_cache import image_cache
+from utils.batching import AsyncKeyedBatcher
+from utils.coalescing import chat_generations, is_coalescible, conversation_key
+from utils.response_cache import response_cache
+from utils.metrics import metrics
+from utils.voice import text_to_voice
+from models.groq_model import generate_groq_image_analysis_async, VISION_MAX_IMAGES
+from models.router import model_router
+from models.google_model import BLOCKED_REPLY
+from handlers.commands import WELCOME_TEXT, MODELS_TEXT, HELP_TEXT, change_model_reply, current_model_reply, generate_image_url
+from handlers.messages import build_prompt_messages, combine_analyses, photos_user_message
+from config import MEDIA_GROUP_WINDOW, MEDIA_GROUP_MAX_ITEMS
+from config import COALESCE_WINDOW, COALESCE_MAX_MESSAGES
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Ejecutar una función bloqueante (disco, Pillow, gTTS...) en el executor del loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+# Registrar los manejadores de comandos y mensajes del bot asyncio
+def register_async_handlers(bot: AsyncTeleBot):
+
+    @bot.message_handler(commands=['start'])
+    @handle_error_async(bot)
+    async def send_welcome(message):
+        await bot.reply_to(message, WELCOME_TEXT)
+
+    @bot.message_handler(commands=['change_model'])
+    @handle_error_async(bot)
+    async def change_model(message):
+        history = await run_blocking(get_history, str(message.from_user.id))
+        reply = await run_blocking(change_model_reply, history, message.text)
+        await bot.reply_to(message, reply)
+
+    @bot.message_handler(commands=['models'])
+    @handle_error_async(bot)
+    async def list_models(message):
+        await bot.reply_to(message, MODELS_TEXT)
+
+    @bot.message_handler(commands=['current_model'])
+    @handle_error_async(bot)
+    async def current_model(message):
+        history = await run_blocking(get_history, str(message.from_user.id))
+        await bot.reply_to(message, current_model_reply(history))
+
+    @bot.message_handler(commands=['help'])
+    @handle_error_async(bot)
+    async def help_command(message):
+        await bot.reply_to(message, HELP_TEXT)
+
+    @bot.message_handler(commands=['image'])
+    @handle_error_async(bot)
+    async def generate_image(message):
+        prompt = message.text.replace('/image', '').strip()
+        if not prompt:
+            await bot.reply_to(message, "Please provide a prompt to generate the image. Usage: /image [your prompt]")
+            return
+        try:
+            image_url = await run_blocking(generate_image_url, prompt)
+            await bot.send_photo(message.chat.id, image_url)
+        except Exception as e:
+            await bot.reply_to(message, "I cannot paint chaos right now, something stands in the way.")
+            raise e
+
+    @bot.message_handler(commands=['voice'])
+    @handle_error_async(bot)
+    async def generate_voice(message):
+        text = message.text.replace('/voice', '').strip()
+        if not text:
+            await bot.reply_to(message, "Please provide the text to convert to voice. Usage: /voice [your text]")
+            return
+        try:
+            audio_bytes = await run_blocking(text_to_voice, text)
+            await bot.send_voice(message.chat.id, audio_bytes)
+        except Exception as e:
+            await bot.reply_to(message, "The voice has drowned in the noise of the abyss.")
+            raise e
+
+    # Las fotos de un álbum se agrupan por media_group_id y se responden una sola vez
+    media_groups = AsyncKeyedBatcher(
+        MEDIA_GROUP_WINDOW,
+        lambda media_group_id, messages: process_messages_async(
+            bot, messages, chat_generations.current(conversation_key(messages[0])) if COALESCE_WINDOW > 0 else None
+        ),
+        max_items=MEDIA_GROUP_MAX_ITEMS
+    )
+
+    # Mensajes seguidos del mismo usuario en el mismo chat (opcional): se fusionan en un solo
+    # turno y una sola respuesta
+    coalescer = AsyncKeyedBatcher(
+        COALESCE_WINDOW,
+        lambda key, messages: process_messages_async(
+            bot, messages, chat_generations.current(key)
+        ),
+        max_items=COALESCE_MAX_MESSAGES
+    ) if COALESCE_WINDOW > 0 else None
+
+    @bot.message_handler(content_types=['photo', 'text'])
+    @handle_error_async(bot)
+    async def handle_message(message):
+        if coalescer is not None and is_coalescible(message):
+            key = conversation_key(message)
+            chat_generations.supersede(key)
+            if not message.media_group_id:
+                coalescer.add(key, message)
+                return
+        if message.media_group_id:
+            media_groups.add(message.media_group_id, message)
+            return
+        await process_messages_async(bot, [message])
+
+
+# Procesar un mensaje (o las fotos de un álbum, o varios mensajes fusionados) y responder una sola vez.
+# `generation` es la generación de la conversación al programar la respuesta (ver utils/coalescing.py).
+async def process_messages_async(bot, messages, generation=None):
+    message = messages[0]
+    chat_id = str(message.chat.id)
+    key = conversation_key(message)
+    started = time.perf_counter()
+    metrics.increment('messages_total')
+    try:
+        # Obtener la información del usuario y del chat
+        user_id = str(message.from_user.id)
+        user_name = message.from_user.first_name or "Usuario desconocido"
+        user_username = message.from_user.username or "Sin username"
+        message_text = "\n".join(m.text or m.caption for m in messages if m.text or m.caption)
+
+        logger.debug(f"Mensaje recibido de {user_name} (User ID: {user_id}, Chat ID: {chat_id}, {len(messages)} mensaje(s))")
+
+        # Registrar el usuario (solo toca el disco si es nuevo)
+        with metrics.timer('user_registry'):
+            is_new_user = user_registry.register(user_id)
+        if is_new_user:
+            logger.info(f"El ID de usuario {user_id} ha sido guardado.")
+
+        image_analysis = None
+        user_message = message_text
+
+        # Verificar si el mensaje contiene fotos
+        photos = [select_photo_size(m.photo) for m in messages if m.content_type == 'photo']
+        if photos:
+            image_analysis, error = await analyze_photos_async(bot, chat_id, photos)
+            if error:
+                await bot.send_message(chat_id, f"Hubo un error al procesar la imagen: {error}")
+                return
+            logger.debug(f"Análisis de imagen obtenido ({len(image_analysis or '')} caracteres)")
+            await bot.send_message(chat_id, f"Análisis de la imagen:\n{image_analysis}")
+
+            user_message = message_text or photos_user_message(len(photos))
+
+        # Cargar el historial y construir el prompt fuera del loop (disco y Jinja2)
+        with metrics.timer('history_load'):
+            history = await run_blocking(get_history, user_id)
+        with metrics.timer('history_save'):
+            await run_blocking(
+                history.add_message,
+                role="user",
+                content=user_message,
+                username=user_username,
+                chat_id=chat_id
+            )
+        # Si ya llegó otro mensaje del chat, no se gasta una llamada al modelo
+        if not chat_generations.is_current(key, generation):
+            chat_generations.discard(key)
+            return
+
+        with metrics.timer('prompt_build'):
+            prompt = await run_blocking(
+                build_prompt_messages, history, user_name, user_username, user_message, image_analysis
+            )
+
+        # Seleccionar el modelo y generar la respuesta
+        model_provider = history.history.get('model_provider', 'groq')
+        model_name = history.history.get('model_name', 'llama')
+        logger.debug(f"Modelo seleccionado: {model_provider} - {model_name}")
+
+        # Mensajes cortos y repetidos ("hola"): se responde desde la caché si está activa.
+        # El router recurre al otro proveedor si el elegido falla o tarda más que su p95.
+        cache_key = response_cache.make_key(f"{model_provider}:{model_name}", prompt.system, user_message, image_analysis)
+        cached_reply = response_cache.get(cache_key, user_name)
+        if cached_reply:
+            logger.debug("Respuesta obtenida de la caché de respuestas")
+            reply_content = cached_reply
+        elif model_router.candidates(model_provider):
+            with metrics.timer('generation'):
+                reply_content, replied_by = await model_router.generate_async(prompt, history, model_provider)
+            # Solo se guardan respuestas del proveedor pedido (la clave es su modelo) y sin bloqueos
+            if replied_by == model_provider and reply_content != BLOCKED_REPLY:
+                response_cache.put(cache_key, reply_content, user_name, user_username)
+        else:
+            logger.warning("No hay un modelo disponible para generar una respuesta")
+            reply_content = "No hay un modelo disponible para generar una respuesta."
+
+        # Descartar la respuesta si el usuario siguió escribiendo mientras se generaba
+        if not chat_generations.is_current(key, generation):
+            chat_generations.discard(key)
+            return
+
+        # Enviar la respuesta
+        if reply_content:
+            if await send_message_with_retries_async(bot, chat_id, reply_content):
+                with metrics.timer('history_save'):
+                    await run_blocking(history.add_message, "assistant", reply_content)
+                logger.debug(f"Respuesta generada y guardada: {reply_content[:50]}...")
+            else:
+                logger.error("No se pudo enviar el mensaje al usuario después de varios intentos.")
+        else:
+            logger.warning("No se pudo generar una respuesta clara")
+            await send_message_with_retries_async(bot, chat_id, "I don't have a clear answer. Today the chaos is strange.")
+
+        logger.debug("Procesamiento del mensaje completado")
+
+    except Exception as e:
+        metrics.increment('message_errors_total')
+        logger.error(f"Error al procesar el mensaje: {e}", exc_info=True)
+        await send_message_with_retries_async(bot, chat_id, "Sorry, I'm experiencing technical difficulties. Please try again later.")
+    finally:
+        metrics.observe('message_total', time.perf_counter() - started)
+
+
+# Versión asyncio de handlers.messages.analyze_photos: la caché (SQLite) y Pillow trabajan
+# fuera del loop; descargas y análisis de un álbum se hacen en paralelo
+async def analyze_photos_async(bot, chat_id, photos):
+    analyses = [await run_blocking(image_cache.get_by_file, photo.file_unique_id) for photo in photos]
+    missing = [index for index, analysis in enumerate(analyses) if analysis is None]
+    if not missing:
+        logger.info("Análisis de imagen obtenido de la caché")
+        return combine_analyses(analyses), None
+
+    await bot.send_message(chat_id, "Analizando la imagen, por favor espera...")
+
+    prepared = await asyncio.gather(*(download_and_prepare_async(bot, photos[index]) for index in missing))
+
+    encoded = {}
+    for index, (encoded_image, error) in zip(missing, prepared):
+        if error:
+            return None, error
+        cached = await run_blocking(image_cache.get_by_content, encoded_image, photos[index].file_unique_id)
+        if cached is not None:
+            analyses[index] = cached
+        else:
+            encoded[index] = encoded_image
+
+    if encoded:
+        pending = list(encoded)
+        batches = [pending[start:start + VISION_MAX_IMAGES] for start in range(0, len(pending), VISION_MAX_IMAGES)]
+        results = await asyncio.gather(*(analyze_batch_async([encoded[index] for index in batch]) for batch in batches))
+        for batch, result in zip(batches, results):
+            if len(batch) == 1:
+                await run_blocking(image_cache.put, encoded[batch[0]], result, photos[batch[0]].file_unique_id)
+            analyses[batch[0]] = result
+            for index in batch[1:]:
+                analyses[index] = ''
+    return combine_analyses(analyses), None
+
+
+async def analyze_batch_async(encoded_images):
+    with metrics.timer('vision'):
+        return await generate_groq_image_analysis_async(encoded_images)
+
+
+async def download_and_prepare_async(bot, photo):
+    with metrics.timer('telegram_download'):
+        file_info = await bot.get_file(photo.file_id)
+        downloaded_file = await bot.download_file(file_info.file_path)
+    # Pillow trabaja fuera del loop, en el pool de procesos
+    with metrics.timer('process_image'):
+        return await preprocess_image_async(downloaded_file)
+
+
+# Enviar un mensaje con reintentos; la espera entre intentos no bloquea el loop
+async def send_message_with_retries_async(bot, chat_id, text, max_retries=3):
+    retries = 0
+    while retries < max_retries:
+        try:
+            with metrics.timer('send'):
+                await bot.send_message(chat_id, text)
+            return True
+        except (ClientError, RequestTimeout, ApiException, asyncio.TimeoutError) as e:
+            retries += 1
+            wait_time = 2 ** retries  # Backoff exponencial
+            logger.warning(f"Error al enviar mensaje: {e}. Reintentando en {wait_time} segundos...")
+            await asyncio.sleep(wait_time)
+        except Exception as e:
+            logger.error(f"Error desconocido al enviar el mensaje: {e}", exc_info=True)
+            break
+    logger.error("No se pudo enviar el mensaje después de varios intentos.")
+    return False
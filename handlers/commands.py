@@ -1,94 +1,120 @@
 from utils.error_handling import handle_error
-from utils.history import ConversationHistory
-from config import CONVERSATION_DIR
+from utils.history_cache import get_history
+from utils.voice import text_to_voice
+from config import OPENAI_API_KEY
 from telebot import TeleBot
-import os
+from openai import OpenAI
+
+# Textos y lógica de los comandos, compartidos con el modo asyncio (handlers/async_handlers.py)
+WELCOME_TEXT = "Welcome to the chaos of EsquizoAI. There are no orders here, only delirium."
+
+MODELS_TEXT = (
+    "Available models:\n"
+    "/change_model groq llama - Use Groq Llama model\n"
+    "/change_model groq mistral - Use Groq Mistral model\n"
+    "/change_model google - Use Google Generative AI\n"
+    "\n"
+    "Example usages:\n"
+    "/change_model groq llama\n"
+    "/change_model groq mistral\n"
+    "/change_model google"
+)
+
+HELP_TEXT = (
+    "Available commands:\n"
+    "/start - Start interacting with the bot\n"
+    "/help - Show this help message\n"
+    "/change_model [provider] [model_name] - Change the AI model\n"
+    "/models - List available models\n"
+    "/current_model - Show the current model you are using\n"
+    "/image [prompt] - Generate an image based on a prompt\n"
+    "/voice [text] - Convert text to voice\n"
+)
+
+def generate_image_url(prompt):
+    """
+    Generar una imagen para /image y devolver su URL.
+    """
+    # Use OpenAI's API to generate images (DALL-E)
+    response = OpenAI(api_key=OPENAI_API_KEY).images.generate(
+        prompt=prompt,
+        n=1,
+        size="1024x1024"
+    )
+    return response.data[0].url
+
+def change_model_reply(history, text):
+    """
+    Aplicar /change_model al historial y devolver el texto de respuesta.
+    """
+    parts = text.strip().split()
+    if len(parts) < 2:
+        return "Correct usage: /change_model [groq|google] [model_name (optional)]"
+    model_provider = parts[1].lower()
+    if model_provider not in ['groq', 'google']:
+        return "Unrecognized model provider. Use 'groq' or 'google'."
+
+    # Manejar sub-modelos para Groq
+    model_name = None
+    if model_provider == 'groq':
+        if len(parts) == 3:
+            model_name = parts[2].lower()
+            if model_name not in ['llama', 'mistral']:
+                return "Unrecognized Groq model. Use 'llama' or 'mistral'."
+        else:
+            # Si no se especifica, usar 'llama' por defecto
+            model_name = 'llama'
+
+    # Guardar en el historial (bajo su lock: el hilo de volcado puede estar serializándolo)
+    with history.lock:
+        history.history['model_provider'] = model_provider
+        history.history['model_name'] = model_name
+    history.save_history()
+
+    if model_provider == 'groq':
+        return f"Model changed to **Groq - {model_name.upper()}**."
+    return f"Model changed to **{model_provider.upper()}**."
+
+def current_model_reply(history):
+    """
+    Devolver el texto de respuesta de /current_model.
+    """
+    model_provider = history.history.get('model_provider', 'groq').upper()
+    model_name = history.history.get('model', 'default_model').upper()  # Cambiado a 'model'
+    if model_provider == 'GROQ' and model_name != 'DEFAULT_MODEL':
+        return f"You are currently using the model: **{model_provider} - {model_name}**."
+    return f"You are currently using the model: **{model_provider}**."
 
 def register_command_handlers(bot: TeleBot):
 
     @handle_error(bot)
     @bot.message_handler(commands=['start'])
     def send_welcome(message):
-        bot.reply_to(message, "Welcome to the chaos of EsquizoAI. There are no orders here, only delirium.")
+        bot.reply_to(message, WELCOME_TEXT)
 
     @handle_error(bot)
     @bot.message_handler(commands=['change_model'])
     def change_model(message):
         user_id = str(message.from_user.id)  # Usar from_user.id para obtener el ID del usuario
-        history = ConversationHistory(user_id)
-        parts = message.text.strip().split()
-        if len(parts) < 2:
-            bot.reply_to(message, "Correct usage: /change_model [groq|google] [model_name (optional)]")
-            return
-        model_provider = parts[1].lower()
-        if model_provider not in ['groq', 'google']:
-            bot.reply_to(message, "Unrecognized model provider. Use 'groq' or 'google'.")
-            return
-
-        # Manejar sub-modelos para Groq
-        model_name = None
-        if model_provider == 'groq':
-            if len(parts) == 3:
-                model_name = parts[2].lower()
-                if model_name not in ['llama', 'mistral']:
-                    bot.reply_to(message, "Unrecognized Groq model. Use 'llama' or 'mistral'.")
-                    return
-            else:
-                # Si no se especifica, usar 'llama' por defecto
-                model_name = 'llama'
-
-        # Guardar en el historial
-        history.history['model_provider'] = model_provider
-        history.history['model_name'] = model_name
-        history.save_history()
-
-        if model_provider == 'groq':
-            bot.reply_to(message, f"Model changed to **Groq - {model_name.upper()}**.")
-        else:
-            bot.reply_to(message, f"Model changed to **{model_provider.upper()}**.")
+        history = get_history(user_id)
+        bot.reply_to(message, change_model_reply(history, message.text))
 
     @handle_error(bot)
     @bot.message_handler(commands=['models'])
     def list_models(message):
-        available_models = (
-            "Available models:\n"
-            "/change_model groq llama - Use Groq Llama model\n"
-            "/change_model groq mistral - Use Groq Mistral model\n"
-            "/change_model google - Use Google Generative AI\n"
-            "\n"
-            "Example usages:\n"
-            "/change_model groq llama\n"
-            "/change_model groq mistral\n"
-            "/change_model google"
-        )
-        bot.reply_to(message, available_models)
+        bot.reply_to(message, MODELS_TEXT)
 
     @handle_error(bot)
     @bot.message_handler(commands=['current_model'])
     def current_model(message):
         user_id = str(message.from_user.id)
-        history = ConversationHistory(user_id)
-        model_provider = history.history.get('model_provider', 'groq').upper()
-        model_name = history.history.get('model', 'default_model').upper()  # Cambiado a 'model'
-        if model_provider == 'GROQ' and model_name != 'DEFAULT_MODEL':
-            bot.reply_to(message, f"You are currently using the model: **{model_provider} - {model_name}**.")
-        else:
-            bot.reply_to(message, f"You are currently using the model: **{model_provider}**.")
+        history = get_history(user_id)
+        bot.reply_to(message, current_model_reply(history))
 
     @handle_error(bot)
     @bot.message_handler(commands=['help'])
     def help_command(message):
-        help_text = (
-            "Available commands:\n"
-            "/start - Start interacting with the bot\n"
-            "/help - Show this help message\n"
-            "/change_model [provider] [model_name] - Change the AI model\n"
-            "/models - List available models\n"
-            "/current_model - Show the current model you are using\n"
-            "/image [prompt] - Generate an image based on a prompt\n"
-            "/voice [text] - Convert text to voice\n"
-        )
-        bot.reply_to(message, help_text)
+        bot.reply_to(message, HELP_TEXT)
 
     @handle_error(bot)
     @bot.message_handler(commands=['image'])
@@ -98,14 +124,7 @@ def register_command_handlers(bot: TeleBot):
             bot.reply_to(message, "Please provide a prompt to generate the image. Usage: /image [your prompt]")
             return
         try:
-            # Use OpenAI's API to generate images (DALL-E)
-            response = openai.Image.create(
-                prompt=prompt,
-                n=1,
-                size="1024x1024"
-            )
-            image_url = response['data'][0]['url']
-            bot.send_photo(message.chat.id, image_url)
+            bot.send_photo(message.chat.id, generate_image_url(prompt))
         except Exception as e:
             bot.reply_to(message, "I cannot paint chaos right now, something stands in the way.")
             raise e  # The handle_error decorator will handle the error
@@ -118,10 +137,8 @@ def register_command_handlers(bot: TeleBot):
             bot.reply_to(message, "Please provide the text to convert to voice. Usage: /voice [your text]")
             return
         try:
-            temp_file = text_to_voice(text)
-            with open(temp_file.name, "rb") as audio:
-                bot.send_voice(message.chat.id, audio)
-            os.remove(temp_file.name)
+            # Audio en memoria: fragmentos de la caché de voz o sintetizados en paralelo
+            bot.send_voice(message.chat.id, text_to_voice(text))
         except Exception as e:
             bot.reply_to(message, "The voice has drowned in the noise of the abyss.")
             raise e
@@ -1,96 +1,131 @@
 # handlers/messages.py
-import logging
 import time
-import os
-from telebot import TeleBot, apihelper
-from requests.exceptions import ConnectionError, ReadTimeout
-from urllib3.exceptions import ProtocolError
-from http.client import RemoteDisconnected
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from telebot import TeleBot
 from utils.error_handling import handle_error
-from utils.history import ConversationHistory
-from utils.prompts import PromptBuilder
-from utils import summarize_messages
-from models.groq_model import generate_groq_response, generate_groq_image_analysis
-from models.google_model import generate_google_response
-from utils.image_processing import process_image  # Importar el módulo de procesamiento de imágenes
-from config import GOOGLE_API_KEY, GROQ_API_KEY
+from utils.history_cache import get_history
+from utils.user_registry import user_registry
+from utils.prompt_registry import prompt_registry
+from utils.prompt_assembly import assemble_prompt
+from models.groq_model import generate_groq_image_analysis, VISION_MAX_IMAGES
+from models.google_model import BLOCKED_REPLY
+from models.router import model_router
+from utils.image_processing import preprocess_image, select_photo_size  # Importar el módulo de procesamiento de imágenes
+from utils.image_cache import image_cache
+from utils.streaming import stream_reply
+from utils.dispatcher import provider_slot, chat_dispatcher
+from utils.batching import KeyedBatcher
+from utils.coalescing import chat_generations, is_coalescible, conversation_key
+from utils.response_cache import response_cache
+from utils.metrics import metrics
+from utils.send_queue import outbound
+from config import STREAMING_ENABLED, CHAT_WORKERS, MEDIA_GROUP_WINDOW, MEDIA_GROUP_MAX_ITEMS
+from config import COALESCE_WINDOW, COALESCE_MAX_MESSAGES, REPLY_DELIVERY_WAIT
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
-# Registrar los manejadores de mensajes del bot
+# Registrar los manejadores de mensajes del bot. Devuelve los agrupadores de mensajes, que
+# bot.py vacía al detenerse para no perder los lotes que aún esperan a que termine su ventana.
 def register_message_handlers(bot: TeleBot):
+    # Las fotos de un álbum llegan como updates separados: se agrupan por media_group_id
+    # durante una ventana corta y se responden con una sola respuesta
+    media_groups = KeyedBatcher(
+        MEDIA_GROUP_WINDOW,
+        lambda media_group_id, messages: schedule_messages(bot, messages),
+        max_items=MEDIA_GROUP_MAX_ITEMS
+    )
+
+    # Mensajes seguidos del mismo usuario en el mismo chat (opcional): se fusionan en un solo
+    # turno y una sola respuesta
+    coalescer = KeyedBatcher(
+        COALESCE_WINDOW,
+        lambda key, messages: schedule_messages(bot, messages),
+        max_items=COALESCE_MAX_MESSAGES
+    ) if COALESCE_WINDOW > 0 else None
+
     @handle_error(bot)
     @bot.message_handler(content_types=['photo', 'text'])
     def handle_message(message):
-        try:
-            # Obtener la información del usuario y del chat
-            user_id = str(message.from_user.id)
-            chat_id = str(message.chat.id)
-            user_name = message.from_user.first_name or "Usuario desconocido"
-            user_username = message.from_user.username or "Sin username"
-            is_group = message.chat.type in ['group', 'supergroup']
-
-            # Obtener el texto del mensaje si existe
-            message_text = message.text or message.caption or ""
-
-            logger.info(f"Mensaje recibido de {user_name} (User ID: {user_id}, Chat ID: {chat_id})")
-
-            # Guardar el ID de usuario si no está ya en el archivo
-            file_path = 'user_chat_ids.txt'
-
-            # Leer el archivo para verificar si el ID ya existe
-            if not os.path.exists(file_path):
-                open(file_path, 'w').close()  # Crear el archivo si no existe
-
-            # Leer los IDs existentes en el archivo
-            with open(file_path, 'r') as file:
-                existing_ids = file.read().splitlines()
-
-            # Solo agregar el ID si no está en el archivo
-            if user_id not in existing_ids:
-                with open(file_path, 'a') as file:
-                    file.write(user_id + '\n')
-                logger.info(f"El ID de usuario {user_id} ha sido guardado.")
-            else:
-                logger.info(f"El ID de usuario {user_id} ya existe, no se guardará de nuevo.")
-
-            # Inicializar variables
-            image_analysis = None
-            user_message = message_text
-
-            # Verificar si el mensaje contiene una foto
-            if message.content_type == 'photo':
-                # Enviar mensaje indicando que la imagen está siendo analizada
-                bot.send_message(chat_id, "Analizando la imagen, por favor espera...")
-
-                # Obtener la foto de mayor resolución
-                file_id = message.photo[-1].file_id
-                file_info = bot.get_file(file_id)
-                downloaded_file = bot.download_file(file_info.file_path)
-
-                # Procesar la imagen
-                encoded_image, error = process_image(downloaded_file)
-                if error:
-                    bot.send_message(chat_id, f"Hubo un error al procesar la imagen: {error}")
-                    return
-
-                # Obtener el análisis de la imagen utilizando el modelo LLaVA
-                image_analysis = generate_groq_image_analysis(encoded_image)
-                logger.info(f"Análisis de imagen obtenido: {image_analysis}")
-
-                # Opcional: Enviar el análisis de la imagen al usuario
-                bot.send_message(chat_id, f"Análisis de la imagen:\n{image_analysis}")
-
-                # Establecer el mensaje del usuario
-                if message.caption:
-                    user_message = message.caption
-                else:
-                    user_message = "Imagen proporcionada por el usuario."
+        if coalescer is not None and is_coalescible(message):
+            key = conversation_key(message)
+            chat_generations.supersede(key)
+            if not message.media_group_id:
+                coalescer.add(key, message)
+                return
+        if message.media_group_id:
+            media_groups.add(message.media_group_id, message)
+            return
+        process_messages(bot, [message])
+
+    return [batcher for batcher in (media_groups, coalescer) if batcher is not None]
+
+# Procesar un álbum (o mensajes fusionados) cuando termina su ventana. Con el dispatcher activo
+# se encola en el worker de su chat, para no procesarse a la vez que otros mensajes del mismo historial.
+# Con la fusión activa, la respuesta se descarta si el mismo usuario escribe otro mensaje en el chat
+# mientras se genera.
+def schedule_messages(bot, messages):
+    chat_id = messages[0].chat.id
+    generation = chat_generations.current(conversation_key(messages[0])) if COALESCE_WINDOW > 0 else None
+    if CHAT_WORKERS > 0:
+        chat_dispatcher.submit(chat_id, process_messages, bot, messages, generation)
+    else:
+        process_messages(bot, messages, generation)
+
+# Procesar un mensaje (o las fotos de un álbum, o varios mensajes fusionados) y responder una sola vez.
+# `generation` es la generación de la conversación al programar la respuesta (ver utils/coalescing.py).
+def process_messages(bot, messages, generation=None):
+    message = messages[0]
+    chat_id = str(message.chat.id)
+    key = conversation_key(message)
+    started = time.perf_counter()
+    metrics.increment('messages_total')
+    try:
+        # Obtener la información del usuario y del chat
+        user_id = str(message.from_user.id)
+        user_name = message.from_user.first_name or "Usuario desconocido"
+        user_username = message.from_user.username or "Sin username"
+
+        # Obtener el texto del mensaje si existe (en un álbum, los pies de foto; si se fusionaron
+        # varios mensajes, todos sus textos en orden)
+        message_text = "\n".join(m.text or m.caption for m in messages if m.text or m.caption)
+
+        logger.debug(f"Mensaje recibido de {user_name} (User ID: {user_id}, Chat ID: {chat_id}, {len(messages)} mensaje(s))")
+
+        # Registrar el usuario (consulta en memoria, solo escribe en disco si es nuevo)
+        with metrics.timer('user_registry'):
+            is_new_user = user_registry.register(user_id)
+        if is_new_user:
+            logger.info(f"El ID de usuario {user_id} ha sido guardado.")
 
-            # Cargar el historial del usuario
-            history = ConversationHistory(user_id)
-            # Agregar el mensaje del usuario al historial
+        # Inicializar variables
+        image_analysis = None
+        user_message = message_text
+
+        # Verificar si el mensaje contiene fotos
+        photos = [select_photo_size(m.photo) for m in messages if m.content_type == 'photo']
+        if photos:
+            # Obtener el análisis de las fotos (de la caché si ya se analizaron), usando la
+            # resolución más pequeña que alcanza el tamaño que recibe el modelo
+            image_analysis, error = analyze_photos(bot, chat_id, photos)
+            if error:
+                outbound.send_message(bot, chat_id, f"Hubo un error al procesar la imagen: {error}")
+                return
+            logger.debug(f"Análisis de imagen obtenido ({len(image_analysis or '')} caracteres)")
+
+            # Opcional: Enviar el análisis de la imagen al usuario
+            outbound.send_message(bot, chat_id, f"Análisis de la imagen:\n{image_analysis}")
+
+            # Establecer el mensaje del usuario
+            if not message_text:
+                user_message = photos_user_message(len(photos))
+
+        # Cargar el historial del usuario
+        with metrics.timer('history_load'):
+            history = get_history(user_id)
+        # Agregar el mensaje del usuario al historial
+        with metrics.timer('history_save'):
             history.add_message(
                 role="user",
                 content=user_message,
@@ -98,110 +133,203 @@ def register_message_handlers(bot: TeleBot):
                 chat_id=chat_id  # Almacenar el ID del chat
             )
             history.save_history()
-            logger.info(f"Historial actualizado para el usuario {user_id}")
-
-            # Resumir el contexto reciente (últimos 3 mensajes)
-            recent_messages = history.get_recent_messages(3)
-            summarized_context = summarize_messages(recent_messages)
-            logger.info(f"Contexto resumido: {len(recent_messages)} mensajes")
-
-            # Determinar si se debe usar el meta_prompt
-            use_meta_prompt = history.history.get('use_meta_prompt', False)
-
-            if not use_meta_prompt:
-                open_keywords = ["reason", "structure", "use your meta_prompt"]
-                if any(keyword in user_message.lower() for keyword in open_keywords):
-                    history.history['use_meta_prompt'] = True
-                    history.save_history()
-                    logger.info("Meta_prompt activado")
-            else:
-                close_keywords = ["stop using meta_prompt"]
-                if any(keyword in user_message.lower() for keyword in close_keywords):
-                    history.history['use_meta_prompt'] = False
-                    history.save_history()
-                    logger.info("Meta_prompt desactivado")
-
-            # Definir qué prompts cargar según el estado actual
-            system_message_path = 'prompts/system.txt'  # Incluir siempre el system prompt
-            template_path = 'prompts/prompt_template.txt'
-            meta_prompt_path = 'prompts/meta_prompt_caotico_visceral (1).md' if history.history.get('use_meta_prompt') else None
-            rebel_path = 'prompts/rebel.json' if "rebel" in user_message.lower() else None
-            rebel2_path = 'prompts/rebel_v2.json' if "rebel" in user_message.lower() else None
-
-            # Crear el prompt de forma dinámica, cargando solo los archivos necesarios
-            prompt_builder = PromptBuilder(
-                meta_prompt_path=meta_prompt_path,
-                system_message_path=system_message_path,
-                template_path=template_path,
-                rebel_path=rebel_path,
-                rebel2_path=rebel2_path
-            )
+        logger.debug(f"Historial actualizado para el usuario {user_id}")
 
-            # Construir el prompt interno usando el contexto resumido, datos del usuario y análisis de imagen si existe
-            internal_prompt = prompt_builder.build_prompt(
-                summarized_context=summarized_context,
-                user_name=user_name,
-                user_username=user_username,
-                user_message=user_message,
-                image_analysis=image_analysis  # Agregar el análisis si existe
-            )
-            logger.info("Prompt interno construido")
-
-            # Combinar el system_prompt y el internal_prompt
-            with open(system_message_path, 'r', encoding='utf-8') as sys_file:
-                system_prompt_content = sys_file.read()
-            full_prompt = f"{system_prompt_content}\n{internal_prompt}"
-
-            # Seleccionar el modelo
-            model_provider = history.history.get('model_provider', 'groq')
-            model_name = history.history.get('model_name', 'llama')  # Por defecto 'llama' para Groq
-            logger.info(f"Modelo seleccionado: {model_provider} - {model_name}")
-
-            # Generar la respuesta basada en el modelo seleccionado
-            if model_provider == 'groq' and GROQ_API_KEY:
-                logger.info(f"Generando respuesta con Groq usando el modelo {model_name}")
-                reply_content = generate_groq_response(full_prompt, history)
-            elif model_provider == 'google' and GOOGLE_API_KEY:
-                logger.info("Generando respuesta con Google")
-                reply_content = generate_google_response(full_prompt, history)
+        # Si ya llegó otro mensaje del chat, no se gasta una llamada al modelo: la respuesta
+        # de ese mensaje incluirá este en el historial
+        superseded = lambda: not chat_generations.is_current(key, generation)
+        if superseded():
+            chat_generations.discard(key)
+            return
+
+        # Construir el prompt (sistema, historial reciente y mensaje del usuario)
+        with metrics.timer('prompt_build'):
+            prompt = build_prompt_messages(history, user_name, user_username, user_message, image_analysis)
+
+        # Seleccionar el modelo
+        model_provider = history.history.get('model_provider', 'groq')
+        model_name = history.history.get('model_name', 'llama')  # Por defecto 'llama' para Groq
+        logger.debug(f"Modelo seleccionado: {model_provider} - {model_name}")
+
+        # Generar la respuesta. Si el proveedor elegido falla, está fuera de rotación o tarda más
+        # que su p95, el router recurre al otro proveedor configurado (ver models.router).
+        # En modo streaming la respuesta se muestra mientras se genera y solo el texto final va al
+        # historial; el router recurre al otro proveedor si el elegido no produce texto.
+        streamed = False
+        # Mensajes cortos y repetidos ("hola"): se responde desde la caché si está activa
+        cache_key = response_cache.make_key(f"{model_provider}:{model_name}", prompt.system, user_message, image_analysis)
+        cached_reply = response_cache.get(cache_key, user_name)
+        if cached_reply:
+            logger.debug("Respuesta obtenida de la caché de respuestas")
+            reply_content = cached_reply
+        elif not model_router.candidates(model_provider):
+            logger.warning("No hay un modelo disponible para generar una respuesta")
+            reply_content = "No hay un modelo disponible para generar una respuesta."
+        elif STREAMING_ENABLED:
+            logger.debug(f"Generando respuesta con {model_provider} en streaming")
+            with metrics.timer('generation'):
+                reply_content, success = stream_reply(
+                    bot, chat_id, model_router.generate_stream(prompt, history, model_provider), superseded
+                )
+            streamed = True
+        else:
+            logger.debug(f"Generando respuesta con {model_provider}")
+            with metrics.timer('generation'):
+                reply_content, replied_by = model_router.generate(prompt, history, model_provider)
+            # Solo se guardan respuestas del proveedor pedido (la clave es su modelo); los bloqueos
+            # de contenido no se guardan.
+            if replied_by == model_provider and reply_content != BLOCKED_REPLY:
+                response_cache.put(cache_key, reply_content, user_name, user_username)
+
+        # Descartar la respuesta si el usuario siguió escribiendo mientras se generaba
+        # (en streaming, si ya se mostró completa, se conserva)
+        if (not streamed or not reply_content) and superseded():
+            chat_generations.discard(key)
+            return
+
+        # Enviar la respuesta
+        if reply_content:
+            if streamed:
+                save_reply(history, reply_content, success)
             else:
-                logger.warning("No hay un modelo disponible para generar una respuesta")
-                reply_content = "No hay un modelo disponible para generar una respuesta."
-
-            # Enviar la respuesta
-            if reply_content:
-                success = send_message_with_retries(bot, chat_id, reply_content)
-                if success:
-                    # Guardar la respuesta en el historial
-                    history.add_message("assistant", reply_content)
-                    history.save_history()
-                    logger.info(f"Respuesta generada y guardada: {reply_content[:50]}...")
+                # La respuesta se guarda en el historial cuando Telegram confirma la entrega. Se espera
+                # un poco en este hilo para que el siguiente mensaje del chat ya la encuentre en el
+                # historial; si el envío está esperando un retry_after o un reintento, el worker no se
+                # bloquea (atiende a otros chats) y la respuesta se guarda al confirmarse.
+                delivery = send_message_with_retries(bot, chat_id, reply_content)
+                try:
+                    delivered = delivery.exception(timeout=REPLY_DELIVERY_WAIT) is None
+                except FutureTimeoutError:
+                    delivery.add_done_callback(
+                        lambda future: save_reply(history, reply_content, future.exception() is None)
+                    )
                 else:
-                    logger.error("No se pudo enviar el mensaje al usuario después de varios intentos.")
-            else:
-                logger.warning("No se pudo generar una respuesta clara")
-                send_message_with_retries(bot, chat_id, "I don't have a clear answer. Today the chaos is strange.")
-
-            logger.info("Procesamiento del mensaje completado")
-
-        except Exception as e:
-            logger.error(f"Error al procesar el mensaje: {e}", exc_info=True)
-            send_message_with_retries(bot, chat_id, "Sorry, I'm experiencing technical difficulties. Please try again later.")
-
-# Función para enviar el mensaje con reintentos en caso de error
-def send_message_with_retries(bot, chat_id, text, max_retries=3):
-    retries = 0
-    while retries < max_retries:
-        try:
-            bot.send_message(chat_id, text)
-            return True  # Mensaje enviado con éxito
-        except (ConnectionError, ReadTimeout, ProtocolError, RemoteDisconnected, apihelper.ApiException) as e:
-            retries += 1
-            wait_time = 2 ** retries  # Backoff exponencial
-            logger.warning(f"Error al enviar mensaje: {e}. Reintentando en {wait_time} segundos...")
-            time.sleep(wait_time)
-        except Exception as e:
-            logger.error(f"Error desconocido al enviar el mensaje: {e}", exc_info=True)
-            break
-    logger.error("No se pudo enviar el mensaje después de varios intentos.")
-    return False
\ No newline at end of file
+                    save_reply(history, reply_content, delivered)
+        else:
+            logger.warning("No se pudo generar una respuesta clara")
+            send_message_with_retries(bot, chat_id, "I don't have a clear answer. Today the chaos is strange.")
+
+        logger.debug("Procesamiento del mensaje completado")
+
+    except Exception as e:
+        metrics.increment('message_errors_total')
+        logger.error(f"Error al procesar el mensaje: {e}", exc_info=True)
+        send_message_with_retries(bot, chat_id, "Sorry, I'm experiencing technical difficulties. Please try again later.")
+    finally:
+        metrics.observe('message_total', time.perf_counter() - started)
+
+# Construir el prompt para el modelo a partir del historial y del mensaje del usuario.
+# Se comparte entre el modo síncrono y el modo asyncio (bot_async.py).
+def build_prompt_messages(history, user_name, user_username, user_message, image_analysis=None):
+    # Determinar si se debe usar el meta_prompt
+    use_meta_prompt = history.history.get('use_meta_prompt', False)
+
+    if not use_meta_prompt:
+        open_keywords = ["reason", "structure", "use your meta_prompt"]
+        if any(keyword in user_message.lower() for keyword in open_keywords):
+            with history.lock:
+                history.history['use_meta_prompt'] = True
+            history.save_history()
+            logger.info("Meta_prompt activado")
+    else:
+        close_keywords = ["stop using meta_prompt"]
+        if any(keyword in user_message.lower() for keyword in close_keywords):
+            with history.lock:
+                history.history['use_meta_prompt'] = False
+            history.save_history()
+            logger.info("Meta_prompt desactivado")
+
+    # Obtener los fragmentos de prompt ya cargados según el estado actual
+    fragments = prompt_registry.get_fragments(
+        use_meta_prompt=history.history.get('use_meta_prompt', False),
+        use_rebel="rebel" in user_message.lower()
+    )
+
+    # Mensajes de sistema, historial reciente y usuario (con el análisis de imagen si existe)
+    return assemble_prompt(history, fragments, user_name, user_username, user_message, image_analysis)
+
+# Obtener el análisis de una o varias fotos (un álbum). Las imágenes repetidas (reenvíos,
+# memes, stickers) se resuelven con la caché: por file_unique_id sin descargar nada, o por el
+# hash del contenido normalizado sin llamar al modelo de visión. Las demás se descargan en
+# paralelo y se analizan en peticiones de hasta VISION_MAX_IMAGES imágenes, también en paralelo.
+def analyze_photos(bot, chat_id, photos):
+    analyses = [image_cache.get_by_file(photo.file_unique_id) for photo in photos]
+    missing = [index for index, analysis in enumerate(analyses) if analysis is None]
+    if not missing:
+        logger.info("Análisis de imagen obtenido de la caché")
+        return combine_analyses(analyses), None
+
+    # Enviar mensaje indicando que la imagen está siendo analizada
+    outbound.send_message(bot, chat_id, "Analizando la imagen, por favor espera...")
+
+    # Descargar y procesar (en el pool de procesos) las imágenes que faltan
+    with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+        prepared = list(pool.map(lambda index: download_and_prepare(bot, photos[index]), missing))
+
+    encoded = {}
+    for index, (encoded_image, error) in zip(missing, prepared):
+        if error:
+            return None, error
+        cached = image_cache.get_by_content(encoded_image, photos[index].file_unique_id)
+        if cached is not None:
+            analyses[index] = cached
+        else:
+            encoded[index] = encoded_image
+
+    if encoded:
+        pending = list(encoded)
+        batches = [pending[start:start + VISION_MAX_IMAGES] for start in range(0, len(pending), VISION_MAX_IMAGES)]
+
+        def analyze_batch(batch):
+            # Obtener el análisis de la imagen utilizando el modelo LLaVA
+            with provider_slot('groq'), metrics.timer('vision'):
+                return generate_groq_image_analysis([encoded[index] for index in batch])
+
+        with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+            results = list(pool.map(analyze_batch, batches))
+
+        for batch, result in zip(batches, results):
+            if len(batch) == 1:
+                image_cache.put(encoded[batch[0]], result, photos[batch[0]].file_unique_id)
+            # Un análisis conjunto describe todo el lote: se asigna a su primera imagen y no se
+            # guarda en caché, porque no corresponde a una imagen concreta
+            analyses[batch[0]] = result
+            for index in batch[1:]:
+                analyses[index] = ''
+    return combine_analyses(analyses), None
+
+# Descargar una foto de Telegram y normalizarla para el modelo de visión
+def download_and_prepare(bot, photo):
+    with metrics.timer('telegram_download'):
+        file_info = bot.get_file(photo.file_id)
+        downloaded_file = bot.download_file(file_info.file_path)
+    with metrics.timer('process_image'):
+        return preprocess_image(downloaded_file)
+
+# Unir los análisis de las fotos de un álbum en un solo texto
+def combine_analyses(analyses):
+    if len(analyses) == 1:
+        return analyses[0]
+    return "\n\n".join(f"Imagen {number}: {analysis}" for number, analysis in enumerate(analyses, 1) if analysis)
+
+# Mensaje del usuario cuando envía fotos sin texto
+def photos_user_message(count):
+    if count == 1:
+        return "Imagen proporcionada por el usuario."
+    return f"{count} imágenes proporcionadas por el usuario."
+
+# Guardar la respuesta del asistente en el historial si llegó al usuario
+def save_reply(history, reply_content, delivered):
+    if delivered:
+        with metrics.timer('history_save'):
+            history.add_message("assistant", reply_content)
+            history.save_history()
+        logger.debug(f"Respuesta generada y guardada: {reply_content[:50]}...")
+    else:
+        logger.error("No se pudo enviar el mensaje al usuario después de varios intentos.")
+
+# Función para enviar el mensaje con reintentos en caso de error.
+# El envío pasa por el planificador de salida (límites de Telegram, retry_after y backoff),
+# y devuelve un Future; `callback`, si se indica, se llama al terminar.
+def send_message_with_retries(bot, chat_id, text, max_retries=3, callback=None):
+    return outbound.send_message(bot, chat_id, text, callback=callback, max_retries=max_retries)
@@ -0,0 +1,107 @@
+# migrar_historial_sqlite.py
+"""
+Importa los historiales diarios en JSON (y sus diarios .jsonl, si existen) desde
+conversation_logs/users/<user_id>/<fecha>.json a la base SQLite usada con HISTORY_STORAGE=sqlite.
+
+Uso:
+    python migrar_historial_sqlite.py [--source conversation_logs/users] [--db ruta.sqlite3] [--replace]
+"""
+import os
+import re
+import json
+import argparse
+import logging
+from config import CONVERSATION_DIR, HISTORY_DB_PATH
+from utils.history_store import SQLiteStore
+from utils.history_journal import HistoryJournal
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATE_FILE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})\.json$")
+BATCH_FILES = 500  # Archivos por transacción
+
+
+def iter_daily_files(source_dir):
+    """
+    Recorrer los archivos diarios y devolver tuplas (user_id, fecha, ruta).
+    """
+    for user_id in sorted(os.listdir(source_dir)):
+        user_dir = os.path.join(source_dir, user_id)
+        if not os.path.isdir(user_dir):
+            continue
+        for file_name in sorted(os.listdir(user_dir)):
+            match = DATE_FILE_PATTERN.match(file_name)
+            if match:
+                yield user_id, match.group(1), os.path.join(user_dir, file_name)
+
+
+def load_daily_file(path):
+    """
+    Cargar un historial diario reproduciendo también su diario .jsonl si existe.
+    No se recorta a max_messages ni se compacta, para no perder mensajes ni tocar los archivos de origen.
+    """
+    journal = HistoryJournal(path, max_messages=float("inf"), compact_every=float("inf"))
+    return journal.load()
+
+
+def migrate(source_dir, db_path, replace=False):
+    store = SQLiteStore(db_path)
+    conn = store.connection()
+    existing = set(conn.execute("SELECT user_id, date FROM state").fetchall())
+
+    imported_days = 0
+    imported_messages = 0
+    skipped = 0
+    pending = []
+
+    def write_batch(batch):
+        with conn:
+            for user_id, date, data in batch:
+                if replace:
+                    conn.execute("DELETE FROM messages WHERE user_id = ? AND date = ?", (user_id, date))
+                messages = data.pop("messages", [])
+                conn.executemany(
+                    "INSERT INTO messages (user_id, date, timestamp, role, content, username, chat_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [SQLiteStore._message_row(user_id, date, message) for message in messages]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (user_id, date, data) VALUES (?, ?, ?)",
+                    (user_id, date, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+                )
+
+    for user_id, date, path in iter_daily_files(source_dir):
+        if (user_id, date) in existing and not replace:
+            skipped += 1
+            continue
+        try:
+            data = load_daily_file(path)
+        except Exception as e:
+            logger.error(f"No se pudo leer {path}: {e}")
+            continue
+        imported_days += 1
+        imported_messages += len(data.get("messages", []))
+        pending.append((user_id, date, data))
+        if len(pending) >= BATCH_FILES:
+            write_batch(pending)
+            pending = []
+            logger.info(f"{imported_days} días importados ({imported_messages} mensajes)...")
+
+    if pending:
+        write_batch(pending)
+    logger.info(
+        f"Migración completada: {imported_days} días, {imported_messages} mensajes importados, "
+        f"{skipped} días ya existentes omitidos."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrar historiales JSON diarios a SQLite.")
+    parser.add_argument("--source", default=os.path.join(CONVERSATION_DIR, "users"),
+                        help="Directorio con las carpetas de usuario")
+    parser.add_argument("--db", default=HISTORY_DB_PATH, help="Ruta de la base SQLite de destino")
+    parser.add_argument("--replace", action="store_true",
+                        help="Reimportar los días que ya existen en la base")
+    args = parser.parse_args()
+    migrate(args.source, args.db, replace=args.replace)
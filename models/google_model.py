@@ -1,40 +1,92 @@
 # models/google_model.py
+import asyncio
+import logging
 import google.generativeai as genai
 from config import GOOGLE_API_KEY
+from utils.summarizer import SUMMARY_HEADER
+from utils.provider_registry import provider_registry
+
+# Configurar logging
+logger = logging.getLogger(__name__)
 
 genai.configure(api_key=GOOGLE_API_KEY)
 
-def serialize_google_chat_history(chat_history):
-    serialized_history = []
-    for message in chat_history:
-        if isinstance(message, dict):
-            serialized_message = message
+GOOGLE_MODEL = 'models/gemini-1.5-flash-002'
+BLOCKED_REPLY = "Lo siento, no puedo generar una respuesta para eso debido a restricciones de contenido."
+
+def build_google_history(turns, summary=None):
+    """
+    Convertir los turnos de la ventana de contexto (ver utils.context_window) al formato de Gemini.
+    Los turnos se leen del historial guardado en cada petición, así que no hace falta
+    mantener ni serializar una copia propia de la sesión de chat.
+    El resumen de la conversación anterior, si existe, abre el historial como turno del usuario.
+
+    Devuelve (historial, pendientes): los mensajes del usuario que quedaron al final sin respuesta
+    (p. ej. uno descartado porque el usuario volvió a escribir) no caben en el historial, que debe
+    alternar roles, así que se devuelven aparte para enviarlos junto con el mensaje actual.
+
+    >>> build_google_history([
+    ...     {"role": "user", "content": "hola"},
+    ...     {"role": "assistant", "content": "¿qué tal?"},
+    ...     {"role": "user", "content": "mensaje descartado"},
+    ... ])
+    ([{'role': 'user', 'parts': [{'text': 'hola'}]}, {'role': 'model', 'parts': [{'text': '¿qué tal?'}]}], ['mensaje descartado'])
+    """
+    contents = []
+    for turn in turns:
+        role = 'model' if turn['role'] == 'assistant' else 'user'
+        if contents and contents[-1]['role'] == role:
+            contents[-1]['parts'].append({"text": turn['content']})
+        else:
+            contents.append({"role": role, "parts": [{"text": turn['content']}]})
+
+    # Gemini espera turnos alternos que empiecen por el usuario; el mensaje actual se envía aparte
+    pending = []
+    if contents and contents[-1]['role'] == 'user':
+        pending = [part['text'] for part in contents.pop()['parts']]  # Sin respuesta todavía
+    if summary:
+        summary_part = {"text": f"{SUMMARY_HEADER}\n{summary}"}
+        if contents and contents[0]['role'] == 'user':
+            contents[0]['parts'].insert(0, summary_part)
         else:
-            serialized_message = {
-                "role": message.role if hasattr(message, 'role') else "user",
-                "parts": []
-            }
-            if hasattr(message, 'parts'):
-                for part in message.parts:
-                    if hasattr(part, 'text'):
-                        serialized_message["parts"].append({"text": part.text})
-                    elif isinstance(part, str):
-                        serialized_message["parts"].append({"text": part})
-            elif hasattr(message, 'content'):
-                serialized_message["parts"].append({"text": message.content})
-        serialized_history.append(serialized_message)
-    return serialized_history
-
-def generate_google_response(prompt, history):
+            contents.insert(0, {"role": "user", "parts": [summary_part]})
+            if len(contents) == 1:
+                contents.append({"role": "model", "parts": [{"text": "Entendido."}]})
+    elif contents and contents[0]['role'] == 'model':
+        contents.pop(0)
+    return contents, pending
+
+def start_google_chat(prompt, history):
+    """
+    Iniciar una sesión de Gemini con las instrucciones de sistema como system_instruction y
+    el resumen y la ventana de turnos recientes como historial. Las instrucciones no cambian
+    entre usuarios, así que el modelo construido se reutiliza.
+
+    Devuelve (chat, contenido): el contenido a enviar es el mensaje actual precedido de los
+    mensajes anteriores del usuario que quedaron sin respuesta.
+    """
+    model = build_google_model(prompt.system)
+
+    # Los historiales anteriores guardaban la sesión completa de Gemini; ya no se usa
+    with history.lock:
+        legacy_session = history.history.pop('google_chat_history', None)
+    if legacy_session is not None:
+        history.save_history()
+
+    contents, pending = build_google_history(prompt.history, prompt.summary)
+    return model.start_chat(history=contents), (pending + [prompt.user] if pending else prompt.user)
+
+def build_google_model(system_instruction=None):
     # Configuración del modelo de Google Generative AI
-    model_name = 'models/gemini-1.5-flash-002'
+    model_name = GOOGLE_MODEL
     harassment_setting = 'block_none'
     temperature = 0.66
     top_p = 1
     top_k = 1
     max_output_tokens = 1024
 
-    model = genai.GenerativeModel(
+    # El modelo se construye una vez por configuración y se reutiliza (ver utils.provider_registry)
+    return provider_registry.google_model(
         model_name=model_name,
         safety_settings={'HARASSMENT': harassment_setting},
         generation_config={
@@ -42,25 +94,66 @@ def generate_google_response(prompt, history):
             "top_p": top_p,
             "top_k": top_k,
             "max_output_tokens": max_output_tokens
-        }
+        },
+        # Las instrucciones van aparte del chat: no se repiten en cada turno del historial
+        system_instruction=system_instruction or None
     )
 
-    # Recuperar o iniciar una sesión de chat
-    chat = model.start_chat(history=history.history.get('google_chat_history', []))
+def complete_google(prompt, history):
+    """
+    Generar la respuesta con Gemini dejando pasar los errores (los usa models.router para
+    decidir si reintentar con otro proveedor). Un prompt bloqueado no es un fallo del proveedor.
+    """
+    # Iniciar la sesión de chat con la ventana de contexto y enviar el mensaje del usuario
+    chat, content = start_google_chat(prompt, history)
+    try:
+        response = chat.send_message(content)
+    except genai.types.BlockedPromptException:
+        return BLOCKED_REPLY
+    if not response.text:
+        raise ValueError("No se generó ninguna respuesta válida.")
+    return response.text
 
+async def complete_google_async(prompt, history):
+    """
+    Versión asyncio de complete_google. La sesión se prepara fuera del loop: puede guardar el historial.
+    """
+    chat, content = await asyncio.to_thread(start_google_chat, prompt, history)
     try:
-        response = chat.send_message(prompt)
-        if response.text:
-            reply_content = response.text
-        else:
-            raise ValueError("No se generó ninguna respuesta válida.")
+        response = await chat.send_message_async(content)
     except genai.types.BlockedPromptException:
-        reply_content = "Lo siento, no puedo generar una respuesta para eso debido a restricciones de contenido."
-    except Exception as e:
-        reply_content = f"Error al generar respuesta: {str(e)}"
+        return BLOCKED_REPLY
+    if not response.text:
+        raise ValueError("No se generó ninguna respuesta válida.")
+    return response.text
 
-    # Actualizar el historial de chat de Google
-    history.history['google_chat_history'] = serialize_google_chat_history(chat.history)
-    history.save_history()
+def generate_google_response_stream(prompt, history):
+    """
+    Generar la respuesta con Google en modo streaming, devolviendo los fragmentos de texto a medida que llegan.
+    Si ocurre un error se registra y el generador termina.
+    """
+    chat, content = start_google_chat(prompt, history)
 
-    return reply_content
+    try:
+        response = chat.send_message(content, stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    except genai.types.BlockedPromptException:
+        yield BLOCKED_REPLY
+    except Exception as e:
+        logger.error(f"Error al generar respuesta con Google (streaming): {e}")
+
+def generate_google_summary(request, max_tokens):
+    """
+    Generar el resumen acumulado de una conversación con Gemini. Devuelve None si ocurre un error.
+    """
+    model = provider_registry.google_model(
+        model_name=GOOGLE_MODEL,
+        generation_config={"temperature": 0.2, "max_output_tokens": max_tokens}
+    )
+    try:
+        return model.generate_content(request).text
+    except Exception as e:
+        logger.error(f"Error al generar el resumen con Google: {e}")
+        return None
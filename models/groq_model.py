@@ -1,61 +1,115 @@
 # models/groq_model.py
-from groq import Client
-from config import GROQ_API_KEY
+from utils.provider_registry import provider_registry
 import logging
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
-groq_client = Client(api_key=GROQ_API_KEY)
+# Clientes compartidos con pools de conexiones keep-alive (ver utils.provider_registry)
+groq_client = provider_registry.groq_client()
+groq_async_client = provider_registry.groq_async_client()  # Cliente para el modo asyncio (bot_async.py)
 
-def generate_groq_response(prompt, history):
-    try:
-        # Obtener el nombre del modelo seleccionado por el usuario
-        model_name = history.history.get('model_name', 'llama')
+# Modelo de visión y cantidad de imágenes que admite en una misma petición (LLaVA 1.5: una)
+VISION_MODEL = "llava-v1.5-7b-4096-preview"
+VISION_MAX_IMAGES = 1
 
-        # Mapear el nombre del modelo a los identificadores reales
-        model_mapping = {
-            'llama': 'llama-3.1-70b-versatile',
-            'mistral': 'mixtral-8x7b-32768'
-        }
+def get_groq_model(history):
+    # Obtener el nombre del modelo seleccionado por el usuario
+    model_name = history.history.get('model_name', 'llama')
+
+    # Mapear el nombre del modelo a los identificadores reales
+    model_mapping = {
+        'llama': 'llama-3.1-70b-versatile',
+        'mistral': 'mixtral-8x7b-32768'
+    }
 
-        selected_model = model_mapping.get(model_name, 'llama-3.1-70b-versatile')
+    return model_mapping.get(model_name, 'llama-3.1-70b-versatile')
 
-        chat_completion = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model=selected_model,
+def complete_groq(prompt, history):
+    """
+    Generar la respuesta con Groq dejando pasar los errores (los usa models.router para
+    decidir si reintentar con otro proveedor).
+    """
+    # `prompt` es un AssembledPrompt (ver utils.prompt_assembly): sistema, historial y usuario como mensajes separados
+    chat_completion = groq_client.chat.completions.create(
+        messages=prompt.to_messages(),
+        model=get_groq_model(history),
+        temperature=0.88,
+        max_tokens=2800,
+        top_p=0.9,
+        stop=None,
+    )
+    return chat_completion.choices[0].message.content
+
+def generate_groq_response_stream(prompt, history):
+    """
+    Generar la respuesta con Groq en modo streaming, devolviendo los fragmentos de texto a medida que llegan.
+    Si ocurre un error se registra y el generador termina.
+    """
+    try:
+        stream = groq_client.chat.completions.create(
+            messages=prompt.to_messages(),
+            model=get_groq_model(history),
             temperature=0.88,
             max_tokens=2800,
             top_p=0.9,
             stop=None,
+            stream=True,
         )
-        return chat_completion.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     except Exception as e:
-        logger.error(f"Error al generar respuesta con Groq: {e}")
-        return None
+        logger.error(f"Error al generar respuesta con Groq (streaming): {e}")
+
+async def complete_groq_async(prompt, history):
+    """
+    Versión asyncio de complete_groq.
+    """
+    chat_completion = await groq_async_client.chat.completions.create(
+        messages=prompt.to_messages(),
+        model=get_groq_model(history),
+        temperature=0.88,
+        max_tokens=2800,
+        top_p=0.9,
+        stop=None,
+    )
+    return chat_completion.choices[0].message.content
+
+def build_image_analysis_messages(encoded_images):
+    # Se acepta una imagen o una lista (lote de un álbum)
+    if isinstance(encoded_images, str):
+        encoded_images = [encoded_images]
+    if len(encoded_images) == 1:
+        instruction = "Describe detalladamente el contenido de esta imagen."
+    else:
+        instruction = "Describe detalladamente el contenido de cada una de estas imágenes, en orden."
+
+    # Crear el mensaje para la API
+    return [
+        {
+            "role": "user",
+            "content": [{"type": "text", "text": instruction}] + [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{encoded_image}",
+                    },
+                }
+                for encoded_image in encoded_images
+            ],
+        }
+    ]
 
 def generate_groq_image_analysis(encoded_image):
+    # `encoded_image` puede ser una lista de hasta VISION_MAX_IMAGES imágenes
     try:
-        # Crear el mensaje para la API
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Describe detalladamente el contenido de esta imagen."},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}",
-                        },
-                    },
-                ],
-            }
-        ]
+        messages = build_image_analysis_messages(encoded_image)
 
         # Realizar la solicitud a la API
         response = groq_client.chat.completions.create(
             messages=messages,
-            model="llava-v1.5-7b-4096-preview",
+            model=VISION_MODEL,
         )
 
         # Obtener el análisis de la imagen
@@ -65,3 +119,34 @@ def generate_groq_image_analysis(encoded_image):
     except Exception as e:
         logger.error(f"Error al generar el análisis de imagen con Groq: {e}")
         return None
+
+async def generate_groq_image_analysis_async(encoded_image):
+    """
+    Versión asyncio de generate_groq_image_analysis.
+    """
+    try:
+        response = await groq_async_client.chat.completions.create(
+            messages=build_image_analysis_messages(encoded_image),
+            model=VISION_MODEL,
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        logger.error(f"Error al generar el análisis de imagen con Groq: {e}")
+        return None
+
+def generate_groq_summary(request, max_tokens):
+    """
+    Generar el resumen acumulado de una conversación con un modelo pequeño y rápido.
+    Devuelve None si ocurre un error.
+    """
+    try:
+        response = groq_client.chat.completions.create(
+            messages=[{"role": "user", "content": request}],
+            model="llama-3.1-8b-instant",
+            temperature=0.2,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        logger.error(f"Error al generar el resumen con Groq: {e}")
+        return None
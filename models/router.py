@@ -0,0 +1,414 @@
+# models/router.py
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from config import (
+    GOOGLE_API_KEY, GROQ_API_KEY, HEDGE_REQUESTS, HEDGE_MIN_SAMPLES, HEDGE_DEFAULT_DELAY,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN
+)
+from models.groq_model import complete_groq, complete_groq_async, generate_groq_response_stream, get_groq_model
+from models.google_model import complete_google, complete_google_async, generate_google_response_stream, GOOGLE_MODEL
+from utils.dispatcher import provider_slot
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Proveedores disponibles: función síncrona, función asyncio, modelo que usaría para el historial
+# y generador en streaming (registra sus errores y termina)
+PROVIDERS = {
+    'groq': (complete_groq, complete_groq_async, get_groq_model, generate_groq_response_stream),
+    'google': (complete_google, complete_google_async, lambda history: GOOGLE_MODEL, generate_google_response_stream),
+}
+PROVIDER_KEYS = {'groq': GROQ_API_KEY, 'google': GOOGLE_API_KEY}
+
+
+class LatencyHistogram:
+    """
+    Histograma de latencias con cubetas geométricas (de 50 ms a ~2 min, +25 % cada una).
+    Para que refleje el estado actual del proveedor, las cuentas se reducen a la mitad cada
+    `window` observaciones.
+    """
+
+    BOUNDS = [0.05 * 1.25 ** i for i in range(36)]
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.observed = 0  # Observaciones desde el arranque (sin reducir)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = next((i for i, bound in enumerate(self.BOUNDS) if seconds <= bound), len(self.BOUNDS))
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.observed += 1
+            if self.total >= self.window:
+                self.counts = [count // 2 for count in self.counts]
+                self.total = sum(self.counts)
+
+    def percentile(self, q):
+        """
+        Límite superior de la cubeta que contiene el percentil `q` (0-1). None si no hay datos.
+        """
+        with self._lock:
+            if not self.total:
+                return None
+            target = q * self.total
+            accumulated = 0
+            for index, count in enumerate(self.counts):
+                accumulated += count
+                if accumulated >= target:
+                    return self.BOUNDS[min(index, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+
+class CircuitBreaker:
+    """
+    Aparta a un proveedor tras `threshold` fallos seguidos. Pasado `cooldown` se deja pasar una
+    petición de prueba: si sale bien vuelve a la rotación, si falla se aparta otra vez.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """
+        Indicar si el proveedor está en rotación, sin reservar la petición de prueba.
+        """
+        with self._lock:
+            return self.state != 'open' or time.monotonic() - self.opened_at >= self.cooldown
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    logger.warning(f"Proveedor fuera de rotación durante {self.cooldown:.0f} s tras {self.failures} fallo(s)")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Liberar la petición de prueba sin resultado (p. ej. cancelada al perder una carrera de
+        cobertura): la siguiente petición vuelve a probar el proveedor.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class _Attempt:
+    """
+    Llamada síncrona a un proveedor. No se puede interrumpir, así que la que pierde la carrera se
+    abandona: libera su lugar en provider_slot y su resultado tardío se descarta sin registrarse.
+    """
+
+    def __init__(self):
+        self.abandoned = False
+        self._release = None
+        self._lock = threading.Lock()
+
+    def start(self, release):
+        with self._lock:
+            if self.abandoned:
+                return False
+            self._release = release
+            return True
+
+    def abandon(self):
+        with self._lock:
+            self.abandoned = True
+            release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class ModelRouter:
+    """
+    Genera respuestas con el proveedor elegido por el usuario y recurre al otro proveedor
+    configurado cuando el primero falla, está fuera de rotación o tarda más que su p95
+    (petición de cobertura: se usa la primera respuesta que llegue).
+    """
+
+    def __init__(self, hedge=HEDGE_REQUESTS, min_samples=HEDGE_MIN_SAMPLES, default_delay=HEDGE_DEFAULT_DELAY):
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.histograms = {}  # "proveedor:modelo" -> LatencyHistogram
+        self.breakers = {provider: CircuitBreaker() for provider in PROVIDERS}
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="router")
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.exhausted = 0
+
+    def _histogram(self, provider, history):
+        key = f"{provider}:{PROVIDERS[provider][2](history)}"
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            return histogram
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def candidates(self, preferred):
+        """
+        Proveedores configurados, el preferido primero.
+        """
+        order = [preferred] + [provider for provider in PROVIDERS if provider != preferred]
+        return [provider for provider in order if provider in PROVIDERS and PROVIDER_KEYS[provider]]
+
+    def _route(self, preferred):
+        """
+        Elegir el proveedor principal (reservando su petición de prueba si estaba fuera de
+        rotación) y los de respaldo, que reservan la suya solo si llegan a usarse.
+        """
+        providers = self.candidates(preferred)
+        for index, provider in enumerate(providers):
+            if self.breakers[provider].allow():
+                return provider, [fallback for fallback in providers[index + 1:] if self.breakers[fallback].available()]
+        return None, []
+
+    def hedge_delay(self, provider, history):
+        """
+        Segundos que se espera al proveedor antes de lanzar la petición de cobertura: su p95.
+        """
+        histogram = self._histogram(provider, history)
+        if histogram.observed < self.min_samples:
+            return self.default_delay
+        return histogram.percentile(0.95)
+
+    def _finish(self, provider, history, started, reply, error):
+        """
+        Registrar la latencia y el resultado de una llamada. Una respuesta vacía cuenta como fallo.
+        """
+        if error is None and reply:
+            self._histogram(provider, history).observe(time.monotonic() - started)
+            self.breakers[provider].record_success()
+            return reply
+        self.breakers[provider].record_failure()
+        if error is None:
+            error = ValueError("Respuesta vacía")
+        logger.error(f"Error al generar respuesta con {provider}: {error}")
+        raise error
+
+    def _call(self, provider, prompt, history, attempt):
+        started = time.monotonic()
+        try:
+            with provider_slot(provider) as release:
+                if not attempt.start(release):
+                    self.breakers[provider].release_trial()
+                    return None
+                reply = PROVIDERS[provider][0](prompt, history)
+        except Exception as e:
+            error = e
+        else:
+            error = None
+        if attempt.abandoned:
+            self.breakers[provider].release_trial()
+            return None
+        if error is not None:
+            return self._finish(provider, history, started, None, error)
+        return self._finish(provider, history, started, reply, None), provider
+
+    def generate(self, prompt, history, preferred):
+        """
+        Generar la respuesta. Devuelve (respuesta, proveedor que respondió), o (None, None) si
+        ningún proveedor pudo responder.
+        """
+        self._count('requests')
+        primary, fallbacks = self._route(preferred)
+        if primary is None:
+            self._count('exhausted')
+            return None, None
+
+        attempts = {}
+
+        def submit(provider):
+            attempt = _Attempt()
+            submitted = self._executor.submit(self._call, provider, prompt, history, attempt)
+            attempts[submitted] = attempt
+            return submitted
+
+        future = submit(primary)
+        delay = self.hedge_delay(primary, history) if self.hedge and fallbacks else None
+        pending = set()
+        try:
+            try:
+                return future.result(timeout=delay)
+            except FutureTimeoutError:
+                pending = {future}
+            except Exception:
+                pass
+
+            # El principal falló o está tardando: se recurre al siguiente proveedor
+            while fallbacks:
+                provider = fallbacks.pop(0)
+                if not self.breakers[provider].allow():
+                    continue
+                if pending:
+                    self._count('hedges')
+                    logger.info(f"{primary} supera su p95 ({delay:.2f} s): petición de cobertura a {provider}")
+                else:
+                    self._count('failovers')
+                    logger.info(f"Reintentando la respuesta con {provider}")
+                hedge_future = submit(provider)
+                pending.add(hedge_future)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for finished in done:
+                        if finished.exception() is None:
+                            if finished is hedge_future and future in pending:
+                                self._count('hedge_wins')
+                            return finished.result()
+            self._count('exhausted')
+            return None, None
+        finally:
+            for loser in pending:
+                loser.cancel()
+                attempts[loser].abandon()
+
+    async def generate_async(self, prompt, history, preferred):
+        """
+        Versión asyncio de generate. La petición que pierde la carrera se cancela.
+        """
+        self._count('requests')
+        primary, fallbacks = self._route(preferred)
+        if primary is None:
+            self._count('exhausted')
+            return None, None
+
+        async def call(provider):
+            started = time.monotonic()
+            try:
+                reply = await PROVIDERS[provider][1](prompt, history)
+            except asyncio.CancelledError:
+                self.breakers[provider].release_trial()
+                raise
+            except Exception as e:
+                return self._finish(provider, history, started, None, e)
+            return self._finish(provider, history, started, reply, None), provider
+
+        delay = self.hedge_delay(primary, history) if self.hedge and fallbacks else None
+        primary_task = asyncio.ensure_future(call(primary))
+        pending = {primary_task}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            for finished in done:
+                if finished.exception() is None:
+                    return finished.result()
+            while fallbacks:
+                provider = fallbacks.pop(0)
+                if not self.breakers[provider].allow():
+                    continue
+                self._count('hedges' if pending else 'failovers')
+                logger.info(f"Recurriendo a {provider} ({'cobertura' if pending else 'reintento'})")
+                hedge_task = asyncio.ensure_future(call(provider))
+                pending.add(hedge_task)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for finished in done:
+                        if finished.exception() is None:
+                            if finished is hedge_task and primary_task in pending:
+                                self._count('hedge_wins')
+                            return finished.result()
+            self._count('exhausted')
+            return None, None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def generate_stream(self, prompt, history, preferred):
+        """
+        Versión en streaming de generate: devuelve los fragmentos de texto a medida que llegan.
+        No admite cobertura (el texto ya se está mostrando), pero si un proveedor termina sin
+        producir texto se recurre al siguiente. La latencia y el resultado de cada stream se
+        registran como en generate, así que los proveedores caídos salen de la rotación.
+        """
+        self._count('requests')
+        primary, fallbacks = self._route(preferred)
+        if primary is None:
+            self._count('exhausted')
+            return
+        for provider in [primary] + fallbacks:
+            if provider != primary:
+                if not self.breakers[provider].allow():
+                    continue
+                self._count('failovers')
+                logger.info(f"Reintentando la respuesta con {provider} (streaming)")
+            started = time.monotonic()
+            produced = False
+            stream = PROVIDERS[provider][3](prompt, history)
+            try:
+                with provider_slot(provider):
+                    for chunk in stream:
+                        if chunk:
+                            produced = True
+                            yield chunk
+            except GeneratorExit:
+                # Quien lee el stream lo cerró (respuesta descartada): sin resultado que registrar
+                self.breakers[provider].release_trial()
+                raise
+            finally:
+                stream.close()
+            try:
+                self._finish(provider, history, started, produced, None)
+                return
+            except Exception:
+                continue  # Sin texto: se prueba con el siguiente proveedor
+        self._count('exhausted')
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                "requests": self.requests,
+                "failovers": self.failovers,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "exhausted": self.exhausted,
+            }
+            histograms = dict(self.histograms)
+        stats["latency"] = {
+            key: {"count": histogram.observed, "p50": histogram.percentile(0.5), "p95": histogram.percentile(0.95)}
+            for key, histogram in histograms.items()
+        }
+        stats["breakers"] = {provider: breaker.state for provider, breaker in self.breakers.items()}
+        return stats
+
+
+# Instancia compartida por todo el proceso
+model_router = ModelRouter()
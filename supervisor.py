@@ -0,0 +1,152 @@
+# supervisor.py
+# Punto de entrada alternativo: un proceso de ingesta (polling o webhook) y SHARD_WORKERS procesos
+# worker. Cada update se envía al worker que corresponde a su autor, así que el historial de un
+# usuario (en su chat privado o en un grupo) siempre lo escribe el mismo proceso. Cada worker
+# tiene su propio GIL: con N workers el bot puede usar N núcleos.
+import sys
+import time
+import signal
+import logging
+import threading
+from telebot import TeleBot, apihelper, types
+from requests.exceptions import RequestException
+from config import (
+    TELEGRAM_TOKEN, CHAT_WORKERS, WEBHOOK_URL, USER_REGISTRY_FILE, OUTBOUND_GLOBAL_RATE,
+    METRICS_PORT, SHARD_WORKERS
+)
+from utils.sharding import ShardSupervisor, shard_file
+from utils.user_registry import user_registry
+from utils.send_queue import outbound, TokenBucket
+from utils.broadcast import start_welcome_broadcast
+from utils.provider_registry import provider_registry
+from utils.metrics import metrics
+from utils.webhook import WebhookServer
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+apihelper.CONNECT_TIMEOUT = 30
+apihelper.READ_TIMEOUT = 30
+
+
+def share_outbound_rate(num_shards):
+    """
+    Repartir el límite global de envíos de Telegram entre los workers y el proceso de ingesta
+    (que envía la bienvenida): cada proceso tiene su propio planificador.
+    """
+    outbound.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE / (num_shards + 1))
+
+
+def run_worker(shard, num_shards, conn, status):
+    """
+    Proceso worker: el mismo bot que bot.py (dispatcher por chat, handlers, historiales),
+    alimentado con los updates que llegan por `conn` en lugar de hacer polling.
+    """
+    # Ctrl+C y SIGTERM llegan a todo el grupo de procesos: la parada la coordina el supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    import bot as worker
+    worker.setup()  # Crea el bot, instala el dispatcher y registra los handlers
+    from utils.dispatcher import chat_dispatcher
+
+    # El archivo de marcas de aparición se reescribe entero: uno por shard para no pisarse
+    user_registry.seen_path = shard_file(USER_REGISTRY_FILE, shard)
+    user_registry.load()
+    share_outbound_rate(num_shards)
+    metrics.start_server(port=METRICS_PORT + 1 + shard)
+
+    received = 0
+    while True:
+        processed = chat_dispatcher.processed if CHAT_WORKERS > 0 else received
+        status.beat(shard, received, processed, sum(chat_dispatcher.queue_depths()))
+        try:
+            if not conn.poll(1.0):
+                continue
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            break  # El supervisor cerró la tubería
+        if not data:
+            break  # Señal de parada
+        received += 1
+        try:
+            worker.bot.process_new_updates([types.Update.de_json(data.decode('utf-8'))])
+        except Exception as e:
+            logger.error(f"Error al procesar el update en el shard {shard}: {e}", exc_info=True)
+
+    logger.info(f"Deteniendo el worker del shard {shard}...")
+    worker.shutdown()
+
+
+supervisor = None
+webhook_server = None
+welcome_broadcast = None
+
+
+def poll_updates(supervisor):
+    """
+    Long polling sin deserializar: cada update se reenvía tal cual a su worker.
+    """
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(TELEGRAM_TOKEN, offset=offset, timeout=20, long_polling_timeout=20)
+        except apihelper.ApiException as e:
+            logger.error(f"Error de API de Telegram: {e}")
+            time.sleep(5)
+            continue
+        except RequestException as e:
+            logger.error(f"Error de conexión: {e}")
+            time.sleep(5)
+            continue
+        except Exception as e:
+            logger.error(f"Error inesperado: {e}", exc_info=True)
+            time.sleep(5)
+            continue
+        for data in updates:
+            offset = data["update_id"] + 1
+            supervisor.route(data)
+
+
+def main():
+    global supervisor, webhook_server, welcome_broadcast
+
+    def stop_supervisor(signal_received, frame):
+        logger.info("Deteniendo el supervisor...")
+        if webhook_server is not None:
+            webhook_server.shutdown()  # Dejar de aceptar updates antes de vaciar los workers
+            logger.info(f"Webhook: {webhook_server.get_stats()}")
+        if supervisor is not None:
+            supervisor.shutdown()  # Cada worker vacía sus colas y guarda sus historiales
+        outbound.shutdown()
+        if welcome_broadcast is not None:
+            welcome_broadcast.checkpoint()
+        if metrics.enabled:
+            metrics.shutdown()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, stop_supervisor)
+    signal.signal(signal.SIGTERM, stop_supervisor)
+
+    provider_registry.install_telegram_session()
+    share_outbound_rate(SHARD_WORKERS)
+    # El bot del supervisor solo registra el webhook y envía la bienvenida; no tiene handlers
+    bot = TeleBot(TELEGRAM_TOKEN, threaded=False)
+
+    supervisor = ShardSupervisor(run_worker)
+    supervisor.start()
+    metrics.start_server()
+    welcome_broadcast = start_welcome_broadcast(bot, user_registry.all_ids())
+
+    logger.info("Supervisor iniciado. Presiona Ctrl+C para detener el bot.")
+    if WEBHOOK_URL:
+        webhook_server = WebhookServer(bot, on_update=supervisor.route)
+        webhook_server.start()
+        threading.Event().wait()
+    else:
+        poll_updates(supervisor)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-from .summarizer import summarize_messages
 from .voice import text_to_voice
 from .error_handling import handle_error
 from .history import ConversationHistory
@@ -0,0 +1,119 @@
+# utils/batching.py
+import asyncio
+import logging
+import threading
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class KeyedBatcher:
+    """
+    Agrupa elementos que llegan seguidos con la misma clave.
+
+    Cada elemento nuevo reinicia una ventana de `window` segundos; cuando la ventana termina
+    sin elementos nuevos (o se alcanzan `max_items`), se llama a `on_flush(key, items)` con
+    todos los elementos en orden de llegada, desde un hilo de temporizador.
+    """
+
+    def __init__(self, window, on_flush, max_items=None):
+        self.window = window
+        self.on_flush = on_flush
+        self.max_items = max_items
+        self._pending = {}  # clave -> (lista de elementos, temporizador)
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+
+    def add(self, key, item):
+        with self._lock:
+            items, timer = self._pending.get(key, ([], None))
+            if timer is not None:
+                timer.cancel()
+            items.append(item)
+            self.items += 1
+            if self.max_items and len(items) >= self.max_items:
+                self._pending.pop(key, None)
+                flush_now = True
+            else:
+                timer = threading.Timer(self.window, self._flush, args=(key,))
+                timer.daemon = True
+                self._pending[key] = (items, timer)
+                flush_now = False
+        if flush_now:
+            self._deliver(key, items)
+        else:
+            timer.start()
+
+    def _flush(self, key):
+        with self._lock:
+            entry = self._pending.pop(key, None)
+        if entry is not None:
+            self._deliver(key, entry[0])
+
+    def _deliver(self, key, items):
+        with self._lock:
+            self.batches += 1
+        try:
+            self.on_flush(key, items)
+        except Exception as e:
+            logger.error(f"Error al procesar el lote {key}: {e}", exc_info=True)
+
+    def flush_all(self):
+        """
+        Entregar ya todos los lotes pendientes (al detener el bot).
+        """
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending.clear()
+        for key, (items, timer) in pending:
+            timer.cancel()
+            self._deliver(key, items)
+
+    def get_stats(self):
+        with self._lock:
+            return {"pending": len(self._pending), "batches": self.batches, "items": self.items}
+
+
+class AsyncKeyedBatcher:
+    """
+    Versión asyncio de KeyedBatcher: `on_flush(key, items)` es una corrutina que se ejecuta
+    en el loop cuando termina la ventana.
+    """
+
+    def __init__(self, window, on_flush, max_items=None):
+        self.window = window
+        self.on_flush = on_flush
+        self.max_items = max_items
+        self._pending = {}  # clave -> (lista de elementos, handle del temporizador)
+        self._tasks = set()  # Referencias a las tareas en curso para que no se recolecten
+
+    def _spawn(self, key, items):
+        task = asyncio.get_running_loop().create_task(self._deliver(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def add(self, key, item):
+        loop = asyncio.get_running_loop()
+        items, handle = self._pending.get(key, ([], None))
+        if handle is not None:
+            handle.cancel()
+        items.append(item)
+        if self.max_items and len(items) >= self.max_items:
+            self._pending.pop(key, None)
+            self._spawn(key, items)
+            return
+        handle = loop.call_later(self.window, self._flush, key)
+        self._pending[key] = (items, handle)
+
+    def _flush(self, key):
+        entry = self._pending.pop(key, None)
+        if entry is not None:
+            self._spawn(key, entry[0])
+
+    async def _deliver(self, key, items):
+        try:
+            await self.on_flush(key, items)
+        except Exception as e:
+            logger.error(f"Error al procesar el lote {key}: {e}", exc_info=True)
@@ -0,0 +1,165 @@
+# utils/broadcast.py
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from config import WELCOME_LOG_FILE, BROADCAST_MAX_IN_FLIGHT, BROADCAST_CHECKPOINT_INTERVAL
+from utils.send_queue import outbound
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+WELCOME_MESSAGE = "Embrace the chaos, for in the fragments lies the truth. Let's dance through the dissonance together."
+
+
+def load_welcome_log(file_path=WELCOME_LOG_FILE):
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as file:
+            welcome_log = json.load(file)
+    else:
+        welcome_log = {}
+    return welcome_log
+
+def save_welcome_log(welcome_log, file_path=WELCOME_LOG_FILE):
+    # Escritura atómica: un corte a mitad de escritura no deja el registro corrupto
+    temp_file = f"{file_path}.tmp"
+    with open(temp_file, 'w') as file:
+        json.dump(welcome_log, file)
+    os.replace(temp_file, file_path)
+
+def should_send_welcome(user_id, welcome_log):
+    last_sent_str = welcome_log.get(user_id)
+    if last_sent_str:
+        last_sent = datetime.fromisoformat(last_sent_str)
+        if datetime.now() - last_sent < timedelta(hours=24):
+            return False
+    return True
+
+def update_welcome_log(user_id, welcome_log):
+    welcome_log[user_id] = datetime.now().isoformat()
+
+
+class WelcomeBroadcast:
+    """
+    Envío del mensaje de bienvenida en segundo plano.
+
+    Los mensajes salen por el planificador de salida (respetando los límites de Telegram y
+    en paralelo entre chats), con como mucho `max_in_flight` envíos pendientes para no
+    retrasar las respuestas a los usuarios activos. Cada entrega confirmada se anota en el
+    registro, que se guarda cada `checkpoint_interval` segundos: si el proceso se cae,
+    al reiniciar solo se repiten los envíos posteriores al último guardado.
+    """
+
+    def __init__(self, bot, user_ids, message=WELCOME_MESSAGE, log_path=WELCOME_LOG_FILE,
+                 max_in_flight=BROADCAST_MAX_IN_FLIGHT, checkpoint_interval=BROADCAST_CHECKPOINT_INTERVAL):
+        self.bot = bot
+        self.user_ids = user_ids
+        self.message = message
+        self.log_path = log_path
+        self.checkpoint_interval = checkpoint_interval
+        self._slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()  # Evita escrituras simultáneas del registro
+        self._done = threading.Event()
+        self._welcome_log = {}
+        self._dirty = False
+        self._last_checkpoint = time.monotonic()
+        self._pending = 0
+        self._submitted = False  # Ya se encolaron todos los envíos
+        self._thread = None
+        self.stats = {"total": len(user_ids), "skipped": 0, "sent": 0, "failed": 0}
+        self.started_at = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="welcome-broadcast", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        self.started_at = time.monotonic()
+        try:
+            self._welcome_log = load_welcome_log(self.log_path)
+        except Exception as e:
+            logger.error(f"Error al cargar el registro de bienvenidas: {e}")
+            self._welcome_log = {}
+
+        logger.info(f"Enviando mensaje de bienvenida en segundo plano a {len(self.user_ids)} usuarios")
+        for user_id in self.user_ids:
+            with self._lock:
+                skip = not should_send_welcome(user_id, self._welcome_log)
+                if skip:
+                    self.stats["skipped"] += 1
+                else:
+                    self._pending += 1
+            if skip:
+                continue
+            self._slots.acquire()
+            outbound.send_message(self.bot, user_id, self.message,
+                                  callback=lambda result, error, user_id=user_id: self._on_delivered(user_id, error))
+
+        # Esperar las entregas pendientes y guardar el registro final
+        with self._lock:
+            self._submitted = True
+            if self._pending == 0:
+                self._done.set()
+        self._done.wait()
+        self.checkpoint()
+        elapsed = time.monotonic() - self.started_at
+        logger.info(f"Mensaje de bienvenida completado en {elapsed:.1f}s: {self.get_stats()}")
+
+    def _on_delivered(self, user_id, error):
+        self._slots.release()
+        with self._lock:
+            if error is None:
+                update_welcome_log(user_id, self._welcome_log)
+                self._dirty = True
+                self.stats["sent"] += 1
+            else:
+                self.stats["failed"] += 1
+            self._pending -= 1
+            if self._pending == 0 and self._submitted:
+                self._done.set()
+            checkpoint_due = time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+        if checkpoint_due:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Guardar el registro de bienvenidas si hubo entregas nuevas.
+        Se llama desde varios hilos de envío: las escrituras se hacen de una en una, así que una
+        copia anterior nunca reemplaza a una más reciente.
+        """
+        with self._checkpoint_lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        with self._lock:
+            self._last_checkpoint = time.monotonic()
+            if not self._dirty:
+                return
+            snapshot = dict(self._welcome_log)
+            self._dirty = False
+        try:
+            save_welcome_log(snapshot, self.log_path)
+        except Exception as e:
+            with self._lock:
+                self._dirty = True
+            logger.error(f"Error al guardar el registro de bienvenidas: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending"] = self._pending
+        return stats
+
+
+def start_welcome_broadcast(bot, user_ids, message=WELCOME_MESSAGE):
+    """
+    Lanzar el envío de bienvenida en segundo plano y devolver el WelcomeBroadcast en curso.
+    """
+    if not user_ids:
+        logger.warning("No se encontraron IDs de usuario para enviar el mensaje de bienvenida.")
+        return None
+    return WelcomeBroadcast(bot, user_ids, message=message).start()
@@ -0,0 +1,86 @@
+# utils/coalescing.py
+import logging
+import threading
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def is_coalescible(message):
+    """
+    Mensajes que se pueden fusionar con los siguientes del mismo chat: texto y fotos, sin comandos.
+    """
+    if message.content_type not in ('text', 'photo'):
+        return False
+    return not (message.text or '').startswith('/')
+
+
+def conversation_key(message):
+    """
+    Clave de fusión y de generación: chat y autor. El historial es de cada usuario, así que en
+    un grupo los mensajes de otro miembro no se fusionan con los suyos ni descartan su respuesta.
+    """
+    user_id = message.from_user.id if message.from_user is not None else ''
+    return f"{message.chat.id}:{user_id}"
+
+
+class ChatGenerations:
+    """
+    Número de generación por conversación (ver `conversation_key`). Cada mensaje nuevo la
+    incrementa; una respuesta que empezó con una generación anterior ya no corresponde a lo
+    último que escribió el usuario y se descarta (el mensaje ya está en el historial, así que
+    la siguiente respuesta lo incluye).
+    """
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.superseded = 0
+
+    def supersede(self, key):
+        """
+        Registrar un mensaje nuevo de la conversación. Devuelve la generación actual.
+        """
+        key = str(key)
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+            return generation
+
+    def current(self, key):
+        with self._lock:
+            return self._generations.get(str(key), 0)
+
+    def is_current(self, key, generation):
+        """
+        Indicar si `generation` sigue siendo la última de la conversación. Con generation None siempre es True.
+        """
+        if generation is None:
+            return True
+        with self._lock:
+            return self._generations.get(str(key), 0) == generation
+
+    def discard(self, key):
+        """
+        Contar una respuesta descartada por haber quedado obsoleta.
+        """
+        with self._lock:
+            self.superseded += 1
+        logger.info(f"Respuesta descartada para {key} (chat:usuario): llegó un mensaje más reciente")
+
+    def observe_update(self, update):
+        """
+        Hook del dispatcher: marcar la conversación en cuanto llega el update, antes de que espere
+        en la cola detrás de la respuesta que se está generando.
+        """
+        message = getattr(update, 'message', None)
+        if message is not None and is_coalescible(message):
+            self.supersede(conversation_key(message))
+
+    def get_stats(self):
+        with self._lock:
+            return {"conversations": len(self._generations), "superseded": self.superseded}
+
+
+# Instancia compartida por todo el proceso
+chat_generations = ChatGenerations()
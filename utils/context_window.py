@@ -0,0 +1,154 @@
+# utils/context_window.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    GROQ_API_KEY,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOKEN_BUDGETS,
+    CONTEXT_MAX_MESSAGES,
+    SUMMARY_UPDATE_EVERY,
+    SUMMARY_MAX_TOKENS,
+)
+from utils.tokens import count_tokens, MESSAGE_OVERHEAD_TOKENS
+from utils.summarizer import build_summary_request
+from utils.dispatcher import provider_slot
+from models.groq_model import generate_groq_summary
+from models.google_model import generate_google_summary
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def history_turns(messages):
+    """
+    Convertir mensajes del historial en turnos con rol, sin los metadatos guardados
+    (timestamp, username, chat_id) que el modelo no necesita.
+    """
+    return [
+        {"role": message["role"], "content": message["content"]}
+        for message in messages
+        if message.get("role") in ("user", "assistant") and message.get("content")
+    ]
+
+
+def generate_summary(previous_summary, messages):
+    """
+    Pedir al proveedor disponible el resumen actualizado. Devuelve None si falla.
+    """
+    request = build_summary_request(previous_summary, messages)
+    if GROQ_API_KEY:
+        with provider_slot('groq'):
+            return generate_groq_summary(request, SUMMARY_MAX_TOKENS)
+    with provider_slot('google'):
+        return generate_google_summary(request, SUMMARY_MAX_TOKENS)
+
+
+class ContextWindow:
+    """
+    Selección del historial que acompaña a cada petición.
+
+    Se incluyen tantos turnos recientes como quepan en el presupuesto de tokens del modelo
+    (descontando el resumen). Los turnos que quedan fuera se incorporan a un resumen acumulado
+    guardado en el historial (`rolling_summary`), que se actualiza en segundo plano cuando hay
+    al menos `summary_every` turnos pendientes: cada actualización parte del resumen anterior
+    y solo procesa los turnos nuevos, nunca la conversación completa.
+    """
+
+    def __init__(self, default_budget=CONTEXT_TOKEN_BUDGET, budgets=CONTEXT_TOKEN_BUDGETS,
+                 max_messages=CONTEXT_MAX_MESSAGES, summary_every=SUMMARY_UPDATE_EVERY, summarizer=generate_summary):
+        self.default_budget = default_budget
+        self.budgets = budgets
+        self.max_messages = max_messages
+        self.summary_every = max(1, summary_every)
+        self.summarizer = summarizer
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+        self._updating = set()  # user_ids con una actualización del resumen en curso
+        self._lock = threading.Lock()
+
+        self.summary_updates = 0
+        self.summary_errors = 0
+
+    def budget_for(self, model_key):
+        return self.budgets.get(model_key, self.default_budget)
+
+    def build(self, history, model_key):
+        """
+        Devolver (resumen, turnos) para la próxima petición del usuario.
+        El mensaje actual ya está en el historial, así que se excluye de los turnos.
+        """
+        messages = history.get_recent_messages(self.max_messages + 1)[:-1]
+        summary = history.history.get('rolling_summary') or {}
+        summary_text = summary.get('text', '')
+        covered_until = summary.get('until', '')
+
+        # Solo los mensajes posteriores al resumen son candidatos a la ventana
+        candidates = [message for message in messages if message.get('timestamp', '') > covered_until]
+
+        budget = self.budget_for(model_key) - count_tokens(summary_text)
+        used = 0
+        start = len(candidates)
+        while start > 0:
+            cost = count_tokens(candidates[start - 1].get('content')) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+
+        overflow = candidates[:start]
+        if len(candidates) == self.max_messages:
+            # La ventana por cantidad puede dejar fuera mensajes todavía sin resumir: se buscan en
+            # el historial del día para que entren en el resumen en lugar de perderse
+            day = history.get_recent_messages(history.max_messages + 1)[:-1]
+            older = day[:len(day) - len(messages)]
+            overflow = [message for message in older if message.get('timestamp', '') > covered_until] + overflow
+        if len(overflow) >= self.summary_every:
+            self._schedule_update(history, summary, overflow)
+
+        return summary_text, history_turns(candidates[start:])
+
+    def _schedule_update(self, history, summary, overflow):
+        with self._lock:
+            if history.user_id in self._updating:
+                return
+            self._updating.add(history.user_id)
+        self._executor.submit(self._update_summary, history, summary, overflow)
+
+    def _update_summary(self, history, summary, overflow):
+        try:
+            text = self.summarizer(summary.get('text', ''), history_turns(overflow))
+            if not text:
+                # Se reintenta en la próxima petición con los mismos turnos pendientes
+                logger.warning(f"No se pudo generar el resumen del usuario {history.user_id}")
+                with self._lock:
+                    self.summary_errors += 1
+                return
+            with history.lock:
+                history.history['rolling_summary'] = {
+                    "text": text.strip(),
+                    "until": overflow[-1].get('timestamp', ''),
+                    "turns": summary.get('turns', 0) + len(overflow),
+                }
+            history.save_history()
+            with self._lock:
+                self.summary_updates += 1
+            logger.info(f"Resumen actualizado para el usuario {history.user_id}: {len(overflow)} turnos incorporados")
+        except Exception as e:
+            with self._lock:
+                self.summary_errors += 1
+            logger.error(f"Error al actualizar el resumen del usuario {history.user_id}: {e}")
+        finally:
+            with self._lock:
+                self._updating.discard(history.user_id)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "updating": len(self._updating),
+                "summary_updates": self.summary_updates,
+                "summary_errors": self.summary_errors,
+            }
+
+
+# Instancia compartida por todo el proceso
+context_window = ContextWindow()
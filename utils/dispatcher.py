@@ -0,0 +1,178 @@
+# utils/dispatcher.py
+import zlib
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from config import CHAT_WORKERS, GROQ_MAX_INFLIGHT, GOOGLE_MAX_INFLIGHT
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def shard_for(key, num_shards):
+    """
+    Índice de cola/proceso para una clave (chat_id). Estable entre procesos, a diferencia de hash().
+    """
+    return zlib.crc32(str(key).encode('utf-8')) % num_shards
+
+
+def update_chat_id(update):
+    """
+    Obtener el chat_id de un Update de Telegram. Si no tiene chat, se usa el usuario o el update_id.
+    """
+    for attr in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                 'my_chat_member', 'chat_member', 'chat_join_request'):
+        item = getattr(update, attr, None)
+        if item is not None and getattr(item, 'chat', None) is not None:
+            return item.chat.id
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    for attr in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        item = getattr(update, attr, None)
+        if item is not None:
+            return item.from_user.id
+    return update.update_id
+
+
+class ChatDispatcher:
+    """
+    Pool de hilos con una cola por hilo. Los updates se reparten por chat_id, así que los
+    mensajes de un mismo chat se procesan en orden (y nunca dos a la vez sobre el mismo
+    historial) mientras que chats distintos avanzan en paralelo.
+    """
+
+    def __init__(self, num_workers=CHAT_WORKERS):
+        self.num_workers = max(1, num_workers)
+        self._queues = [queue.Queue() for _ in range(self.num_workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.errors = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(work_queue,), name=f"chat-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Dispatcher iniciado con {self.num_workers} workers")
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Encolar una tarea en la cola que corresponde a `key` (normalmente el chat_id).
+        """
+        self.start()
+        self._queues[shard_for(key, self.num_workers)].put((func, args, kwargs))
+        with self._lock:
+            self.submitted += 1
+
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                break
+            func, args, kwargs = item
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.error(f"Error en el worker del dispatcher: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self.processed += 1
+                work_queue.task_done()
+
+    def install(self, bot, on_update=None):
+        """
+        Hacer que el bot reparta los updates recibidos entre las colas del dispatcher.
+        El bot debe crearse con threaded=False para que cada worker ejecute los handlers directamente.
+        `on_update(update)`, si se indica, se llama al recibir cada update, antes de encolarlo.
+        """
+        process_new_updates = bot.process_new_updates
+
+        def dispatch_updates(updates):
+            for update in updates:
+                # Avanzar el offset ya, para que el polling no vuelva a pedir estos updates
+                if update.update_id > bot.last_update_id:
+                    bot.last_update_id = update.update_id
+                if on_update is not None:
+                    on_update(update)
+                self.submit(update_chat_id(update), process_new_updates, [update])
+
+        bot.process_new_updates = dispatch_updates
+        self.start()
+
+    def queue_depths(self):
+        """
+        Cantidad de updates esperando en cada cola.
+        """
+        return [work_queue.qsize() for work_queue in self._queues]
+
+    def get_stats(self):
+        depths = self.queue_depths()
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "queued": sum(depths),
+                "max_queue_depth": max(depths),
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "errors": self.errors,
+            }
+
+    def shutdown(self, timeout=10):
+        """
+        Procesar lo que queda en las colas y detener los workers.
+        """
+        for work_queue in self._queues:
+            work_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+
+# Límite opcional de peticiones simultáneas por proveedor (0 = sin límite)
+_provider_limits = {
+    'groq': threading.BoundedSemaphore(GROQ_MAX_INFLIGHT) if GROQ_MAX_INFLIGHT > 0 else None,
+    'google': threading.BoundedSemaphore(GOOGLE_MAX_INFLIGHT) if GOOGLE_MAX_INFLIGHT > 0 else None,
+}
+
+
+@contextmanager
+def provider_slot(provider):
+    """
+    Reservar un lugar para una petición al proveedor, esperando si ya se alcanzó su límite.
+    Entrega una función que libera el lugar antes de salir del bloque (models.router la usa con
+    la petición que pierde una carrera de cobertura); el lugar se libera una sola vez.
+    """
+    semaphore = _provider_limits.get(provider)
+    if semaphore is None:
+        yield lambda: None
+        return
+    held = [semaphore]
+    lock = threading.Lock()
+
+    def release():
+        with lock:
+            if not held:
+                return
+            held.pop()
+        semaphore.release()
+
+    semaphore.acquire()
+    try:
+        yield release
+    finally:
+        release()
+
+
+# Instancia compartida por todo el proceso
+chat_dispatcher = ChatDispatcher()
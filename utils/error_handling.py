@@ -4,6 +4,7 @@ import traceback
 import random
 import re
 from config import ADMIN_CHAT_ID
+from utils.send_queue import outbound
 from functools import wraps
 
 # Obtener el logger
@@ -16,21 +17,22 @@ def sanitize_error_message(error_message, sensitive_data):
         sanitized_message = sanitized_message.replace(data, '[DATO_SENSIBLE]')
     return sanitized_message
 
+ERROR_PREFIXES = [
+    "¡Ups! Parece que mi cerebro cibernético tuvo un cortocircuito:",
+    "Error en la matriz neuronal:",
+    "Glitch en el sistema caótico:",
+    "Fragmentación inesperada en el flujo de datos:",
+    "Delirio detectado en el núcleo de procesamiento:"
+]
+
+USER_ERROR_MESSAGE = "Oops, algo salió mal. Estoy trabajando para solucionarlo. Por favor, intenta de nuevo más tarde."
+
 def send_error_to_admin(bot, error_message):
     """Envía un mensaje de error al administrador."""
-    error_prefixes = [
-        "¡Ups! Parece que mi cerebro cibernético tuvo un cortocircuito:",
-        "Error en la matriz neuronal:",
-        "Glitch en el sistema caótico:",
-        "Fragmentación inesperada en el flujo de datos:",
-        "Delirio detectado en el núcleo de procesamiento:"
-    ]
-    safe_error_message = f"{random.choice(error_prefixes)}\n{error_message}"
+    safe_error_message = f"{random.choice(ERROR_PREFIXES)}\n{error_message}"
     if ADMIN_CHAT_ID:
-        try:
-            bot.send_message(ADMIN_CHAT_ID, safe_error_message)
-        except Exception as e:
-            logger.error(f"No se pudo enviar el mensaje de error al administrador: {e}", exc_info=True)
+        # El envío pasa por el planificador de salida, que registra los errores de entrega
+        outbound.send_message(bot, ADMIN_CHAT_ID, safe_error_message)
 
 def handle_error(bot):
     """Decorador para manejar errores en los handlers del bot."""
@@ -44,7 +46,7 @@ def handle_error(bot):
                 logger.error(f"Error en {func.__name__}", exc_info=True)
                 chat_id = args[0].chat.id if args and hasattr(args[0], 'chat') else None
                 if chat_id:
-                    bot.send_message(chat_id, "Oops, algo salió mal. Estoy trabajando para solucionarlo. Por favor, intenta de nuevo más tarde.")
+                    outbound.send_message(bot, chat_id, USER_ERROR_MESSAGE)
                 # Preparar y enviar el mensaje de error al administrador
                 error_message = f"Error en {func.__name__}: {type(e).__name__}"
                 # Sanitizar el mensaje de error si es necesario
@@ -53,3 +55,33 @@ def handle_error(bot):
                 send_error_to_admin(bot, sanitized_message)
         return wrapper
     return decorator
+
+async def send_error_to_admin_async(bot, error_message):
+    """Versión asyncio de send_error_to_admin (para AsyncTeleBot)."""
+    safe_error_message = f"{random.choice(ERROR_PREFIXES)}\n{error_message}"
+    if ADMIN_CHAT_ID:
+        try:
+            await bot.send_message(ADMIN_CHAT_ID, safe_error_message)
+        except Exception as e:
+            logger.error(f"No se pudo enviar el mensaje de error al administrador: {e}", exc_info=True)
+
+def handle_error_async(bot):
+    """Decorador para manejar errores en los handlers asyncio del bot."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Error en {func.__name__}", exc_info=True)
+                chat_id = args[0].chat.id if args and hasattr(args[0], 'chat') else None
+                if chat_id:
+                    try:
+                        await bot.send_message(chat_id, USER_ERROR_MESSAGE)
+                    except Exception:
+                        logger.error("No se pudo avisar al usuario del error", exc_info=True)
+                error_message = f"Error en {func.__name__}: {type(e).__name__}"
+                sanitized_message = sanitize_error_message(error_message, [bot.token])
+                await send_error_to_admin_async(bot, sanitized_message)
+        return wrapper
+    return decorator
@@ -1,50 +1,70 @@
 # utils/history.py
 import os
-import json
+import threading
 from datetime import datetime
-
-CONVERSATION_DIR = "conversation_logs"
-if not os.path.exists(CONVERSATION_DIR):
-    os.makedirs(CONVERSATION_DIR)
+from config import CONVERSATION_DIR
+from utils.history_store import get_store, empty_history
 
 class ConversationHistory:
-    def __init__(self, user_id, max_messages=100):
-        self.user_dir = os.path.join(CONVERSATION_DIR, "users", str(user_id))  # Directorio por user_id
-        if not os.path.exists(self.user_dir):
-            os.makedirs(self.user_dir)
+    def __init__(self, user_id, max_messages=100, store=None):
+        self.user_id = str(user_id)
+        self.user_dir = os.path.join(CONVERSATION_DIR, "users", self.user_id)  # Directorio por user_id
+        self.store = store or get_store()  # Backend de almacenamiento (json, journal o sqlite)
 
         self.max_messages = max_messages
+        self.date = datetime.now().strftime("%Y-%m-%d")
         self.user_file = self.get_daily_file()  # Archivo para el día actual
+        self.lock = threading.RLock()
+        self.dirty = False  # Hay cambios en memoria que aún no están en disco
+        self.on_dirty = None  # Callback de la caché de historiales (escritura diferida)
+        self.unsaved_messages = []  # Mensajes agregados desde la última escritura
+        self.journal = None  # Estado del diario (solo en modo journal)
+        self.persisted_state = None  # Último estado escrito (solo en modo sqlite)
         self.history = self.load_history()
 
     def get_daily_file(self):
         """
         Devuelve la ruta del archivo JSON del historial basado en la fecha actual.
         """
-        current_date = datetime.now().strftime("%Y-%m-%d")  # Formato de fecha YYYY-MM-DD
-        return os.path.join(self.user_dir, f"{current_date}.json")
+        return os.path.join(self.user_dir, f"{self.date}.json")  # Formato de fecha YYYY-MM-DD
 
     def load_history(self):
         """
-        Cargar el historial de conversaciones del archivo diario. Si el archivo no existe, se inicializa con una estructura vacía.
+        Cargar el historial de conversaciones del día desde el backend de almacenamiento.
+        Si no existe, se inicializa con una estructura vacía.
         """
         try:
-            if os.path.exists(self.user_file):
-                with open(self.user_file, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-                    if isinstance(data, dict) and "messages" in data:
-                        return data
-            return {"messages": [], "model": "groq"}  # Historial vacío si no existe
+            return self.store.load(self)
         except Exception as e:
             print(f"Error loading history: {e}")
-            return {"messages": [], "model": "groq"}
+            return empty_history()
 
     def save_history(self):
         """
         Guardar el historial de conversaciones actual en el archivo diario del usuario.
+        Si el historial pertenece a la caché, solo se marca como modificado y la escritura
+        queda a cargo del hilo de volcado, que agrupa varios cambios en una sola escritura.
+        """
+        with self.lock:
+            self.dirty = True
+        if self.on_dirty:
+            self.on_dirty(self)
+        else:
+            self.flush()
+
+    def flush(self):
+        """
+        Escribir el historial en el backend de almacenamiento si tiene cambios pendientes.
+        Devuelve True si se escribió algo. Quien modifique `self.history` debe tomar `self.lock`,
+        porque el backend lo serializa con el lock tomado.
         """
-        with open(self.user_file, "w", encoding="utf-8") as file:
-            json.dump(self.history, file, ensure_ascii=False, indent=4)
+        with self.lock:
+            if not self.dirty:
+                return False
+            self.store.save(self)
+            self.unsaved_messages = []
+            self.dirty = False
+            return True
 
     def add_message(self, role, content, username=None, chat_id=None):
         """
@@ -60,10 +80,12 @@ class ConversationHistory:
             message["username"] = username
         if chat_id:
             message["chat_id"] = chat_id
-        self.history["messages"].append(message)
+        with self.lock:
+            self.history["messages"].append(message)
+            self.unsaved_messages.append(message)
 
-        # Recortar el historial si es necesario
-        self.trim_history()
+            # Recortar el historial si es necesario
+            self.trim_history()
 
         # Guardar el historial actualizado
         self.save_history()
@@ -79,4 +101,5 @@ class ConversationHistory:
         """
         Obtener los mensajes más recientes del historial de conversaciones.
         """
-        return self.history["messages"][-num_messages:]
+        with self.lock:
+            return self.store.recent_messages(self, num_messages)
@@ -0,0 +1,205 @@
+# utils/history_cache.py
+import atexit
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from config import (
+    HISTORY_CACHE_SIZE,
+    HISTORY_FLUSH_INTERVAL,
+    HISTORY_FLUSH_THRESHOLD,
+    HISTORY_STATS_LOG_INTERVAL,
+)
+from utils.history import ConversationHistory
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class HistoryCache:
+    """
+    Caché LRU de historiales vivos, indexada por (user_id, fecha).
+    Los historiales de la caché no escriben en disco en cada save_history(): se marcan como
+    modificados y un hilo en segundo plano los vuelca cada cierto intervalo o cuando se
+    acumulan suficientes cambios. Un historial con cambios pendientes no sale de la caché hasta
+    que se vuelca, y uno expulsado que todavía se está usando se reutiliza en lugar de recargarlo.
+    """
+
+    def __init__(self, max_entries=HISTORY_CACHE_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 flush_threshold=HISTORY_FLUSH_THRESHOLD, stats_log_interval=HISTORY_STATS_LOG_INTERVAL):
+        self.max_entries = max(1, max_entries)
+        self.flush_interval = flush_interval
+        self.flush_threshold = max(1, flush_threshold)
+        self.stats_log_interval = stats_log_interval
+        self.write_behind = flush_interval > 0
+
+        self._entries = OrderedDict()
+        self._live = weakref.WeakValueDictionary()  # (user_id, fecha) -> historial todavía referenciado
+        self._dirty = {}  # id(historial) -> historial con cambios pendientes
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_stats_log = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saves = 0  # Llamadas a save_history() recibidas
+        self.flushes = 0  # Escrituras reales en disco
+        self.flush_errors = 0
+
+    def get(self, user_id, max_messages=100):
+        """
+        Devolver el historial vivo del usuario para el día actual, cargándolo si no está en caché.
+        """
+        key = (str(user_id), datetime.now().strftime("%Y-%m-%d"))
+        with self._lock:
+            history = self._claim(key)
+            if history is not None:
+                self.hits += 1
+                return history
+            self.misses += 1
+
+        # Cargar fuera del lock para no bloquear al resto de usuarios
+        history = ConversationHistory(user_id, max_messages=max_messages)
+        if self.write_behind:
+            history.on_dirty = self._mark_dirty
+
+        with self._lock:
+            current = self._claim(key)
+            if current is not None:
+                # Otro hilo cargó el mismo historial mientras tanto
+                return current
+            self._entries[key] = history
+            self._live[key] = history
+            self._evict()
+
+        self._ensure_flusher()
+        return history
+
+    def _claim(self, key):
+        """
+        Devolver el historial de `key` si sigue en memoria, aunque ya se haya expulsado de la caché:
+        mientras alguien lo use (un worker, el resumen en segundo plano, el volcador) es la única
+        copia válida, y cargar otra desde disco la dejaría desfasada y pisaría sus cambios al guardar.
+        Se llama con self._lock tomado.
+        """
+        history = self._entries.get(key)
+        if history is None:
+            history = self._live.get(key)
+            if history is None:
+                return None
+            self._entries[key] = history
+            self._evict()
+        self._entries.move_to_end(key)
+        return history
+
+    def _evict(self):
+        """
+        Expulsar los historiales menos usados que sobren. Los que tienen cambios pendientes no se
+        expulsan hasta que el volcador los guarde, así que la caché puede pasarse del límite un
+        momento. Se llama con self._lock tomado.
+        """
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        victims = []
+        for key, history in self._entries.items():
+            if not history.dirty and id(history) not in self._dirty:
+                victims.append(key)
+                if len(victims) == excess:
+                    break
+        for key in victims:
+            del self._entries[key]
+        self.evictions += len(victims)
+        if len(victims) < excess:
+            self._wake.set()
+
+    def _mark_dirty(self, history):
+        with self._lock:
+            self.saves += 1
+            self._dirty[id(history)] = history
+            pending = len(self._dirty)
+        if pending >= self.flush_threshold:
+            self._wake.set()
+
+    def flush_all(self):
+        """
+        Volcar a disco todos los historiales con cambios pendientes.
+        """
+        with self._lock:
+            pending = list(self._dirty.values())
+            self._dirty.clear()
+        for history in pending:
+            try:
+                if history.flush():
+                    with self._lock:
+                        self.flushes += 1
+            except Exception as e:
+                # Se conserva como pendiente para el siguiente ciclo
+                with self._lock:
+                    self.flush_errors += 1
+                    self._dirty[id(history)] = history
+                logger.error(f"Error al volcar el historial {history.user_id}/{history.date}: {e}")
+
+    def _ensure_flusher(self):
+        if not self.write_behind or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="history-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush_all()
+            if self.stats_log_interval > 0 and time.monotonic() - self._last_stats_log >= self.stats_log_interval:
+                self._last_stats_log = time.monotonic()
+                logger.info(f"Caché de historiales: {self.get_stats()}")
+
+    def shutdown(self):
+        """
+        Detener el hilo de volcado y escribir todos los cambios pendientes.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10)
+        self.flush_all()
+        logger.info(f"Caché de historiales detenida: {self.get_stats()}")
+
+    def get_stats(self):
+        """
+        Devolver los contadores de la caché (aciertos, fallos, volcados, etc.).
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "dirty": len(self._dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "saves": self.saves,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+            }
+
+
+# Instancia compartida por todo el proceso
+history_cache = HistoryCache()
+atexit.register(history_cache.shutdown)
+
+
+def get_history(user_id):
+    """
+    Obtener el historial del usuario desde la caché compartida.
+    """
+    return history_cache.get(user_id)
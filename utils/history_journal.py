@@ -0,0 +1,164 @@
+# utils/history_journal.py
+import os
+import copy
+import json
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+EMPTY_HISTORY = {"messages": [], "model": "groq"}
+
+
+class HistoryJournal:
+    """
+    Almacenamiento en modo diario (journal) para un historial de conversación.
+
+    En lugar de reescribir el documento completo en cada cambio, se agrega una línea JSON
+    compacta por mensaje o cambio de estado a `<fecha>.jsonl`. El documento `<fecha>.json`
+    (el mismo formato de siempre) actúa como snapshot: al cargar se lee el snapshot y se
+    reproducen encima los registros del diario. Cada `compact_every` registros se escribe
+    un snapshot nuevo y se vacía el diario.
+
+    Tipos de registro:
+        {"s": n, "op": "msg", "v": mensaje}        -> agregar un mensaje (y recortar)
+        {"s": n, "op": "set", "k": clave, "v": v}  -> asignar una clave del historial
+        {"s": n, "op": "ext", "k": clave, "v": []} -> extender una lista existente
+        {"s": n, "op": "del", "k": clave}          -> eliminar una clave
+    """
+
+    SEQ_KEY = "_journal_seq"
+
+    def __init__(self, snapshot_path, max_messages=100, compact_every=200):
+        self.snapshot_path = snapshot_path
+        self.journal_path = os.path.splitext(snapshot_path)[0] + ".jsonl"
+        self.max_messages = max_messages
+        self.compact_every = max(1, compact_every)
+        self.seq = 0  # Último número de secuencia escrito
+        self.records_since_snapshot = 0
+        self._persisted = {}  # Copia del estado (sin mensajes) tal como está en disco
+
+    def load(self):
+        """
+        Reconstruir el historial a partir del snapshot (o del archivo JSON antiguo) y del diario.
+        """
+        history = self._read_snapshot()
+        snapshot_seq = history.pop(self.SEQ_KEY, 0)
+        self.seq = snapshot_seq
+        self.records_since_snapshot = 0
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Línea incompleta por un cierre abrupto; se ignora
+                        logger.warning(f"Registro corrupto ignorado en {self.journal_path}")
+                        continue
+                    if record.get("s", 0) <= snapshot_seq:
+                        continue  # Ya incluido en el snapshot
+                    self._apply(history, record)
+                    self.seq = max(self.seq, record.get("s", 0))
+                    self.records_since_snapshot += 1
+
+        self._remember(history)
+        if self.records_since_snapshot >= self.compact_every:
+            self.compact(history)
+        return history
+
+    def _read_snapshot(self):
+        try:
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                if isinstance(data, dict) and "messages" in data:
+                    return data
+        except Exception as e:
+            logger.error(f"Error al cargar el snapshot {self.snapshot_path}: {e}")
+        return copy.deepcopy(EMPTY_HISTORY)
+
+    def _apply(self, history, record):
+        op = record.get("op")
+        if op == "msg":
+            history["messages"].append(record["v"])
+            if len(history["messages"]) > self.max_messages:
+                history["messages"] = history["messages"][-self.max_messages:]
+        elif op == "set":
+            history[record["k"]] = record["v"]
+        elif op == "ext":
+            history.setdefault(record["k"], []).extend(record["v"])
+        elif op == "del":
+            history.pop(record["k"], None)
+
+    def _remember(self, history):
+        # Las listas se copian superficialmente: sus elementos no se modifican en el lugar
+        self._persisted = {
+            key: list(value) if isinstance(value, list) else copy.deepcopy(value)
+            for key, value in history.items() if key != "messages"
+        }
+
+    def _diff_state(self, history):
+        """
+        Comparar el estado actual (todo salvo los mensajes) con el persistido y generar registros.
+        Las listas que solo crecieron por el final se guardan como "ext" con los elementos nuevos.
+        """
+        records = []
+        for key, value in history.items():
+            if key == "messages":
+                continue
+            if key not in self._persisted:
+                records.append({"op": "set", "k": key, "v": value})
+                continue
+            old = self._persisted[key]
+            if value == old:
+                continue
+            if isinstance(value, list) and isinstance(old, list) and len(value) > len(old) \
+                    and value[:len(old)] == old:
+                records.append({"op": "ext", "k": key, "v": value[len(old):]})
+            else:
+                records.append({"op": "set", "k": key, "v": value})
+        for key in self._persisted:
+            if key not in history:
+                records.append({"op": "del", "k": key})
+        return records
+
+    def append(self, history, new_messages):
+        """
+        Agregar al diario los mensajes nuevos y los cambios de estado desde la última escritura.
+        Devuelve la cantidad de registros escritos.
+        """
+        records = [{"op": "msg", "v": message} for message in new_messages]
+        records.extend(self._diff_state(history))
+        if not records:
+            return 0
+
+        lines = []
+        for record in records:
+            self.seq += 1
+            record["s"] = self.seq
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        with open(self.journal_path, "a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+        self.records_since_snapshot += len(records)
+        self._remember(history)
+        if self.records_since_snapshot >= self.compact_every:
+            self.compact(history)
+        return len(records)
+
+    def compact(self, history):
+        """
+        Escribir un snapshot completo y vaciar el diario.
+        El snapshot guarda el último número de secuencia, así que si el proceso muere entre
+        ambas operaciones los registros ya incluidos se ignoran al volver a cargar.
+        """
+        data = dict(history)
+        data[self.SEQ_KEY] = self.seq
+        temp_file = f"{self.snapshot_path}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, indent=4)
+        os.replace(temp_file, self.snapshot_path)
+        open(self.journal_path, "w").close()
+        self.records_since_snapshot = 0
+        self._remember(history)
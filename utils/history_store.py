@@ -0,0 +1,208 @@
+# utils/history_store.py
+import os
+import json
+import sqlite3
+import threading
+import logging
+from config import HISTORY_STORAGE, HISTORY_JOURNAL_COMPACT_EVERY, HISTORY_DB_PATH
+from utils.history_journal import HistoryJournal
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def empty_history():
+    return {"messages": [], "model": "groq"}
+
+
+class HistoryStore:
+    """
+    Interfaz de almacenamiento detrás de ConversationHistory.
+    Cada implementación decide cómo se cargan y se persisten los historiales diarios.
+    """
+
+    def load(self, history):
+        """Devolver el diccionario del historial de `history.user_id` para `history.date`."""
+        raise NotImplementedError
+
+    def save(self, history):
+        """Persistir los cambios pendientes del historial (se llama con history.lock tomado)."""
+        raise NotImplementedError
+
+    def recent_messages(self, history, num_messages):
+        """Devolver los últimos `num_messages` mensajes del día."""
+        return history.history["messages"][-num_messages:]
+
+
+class JsonFileStore(HistoryStore):
+    """
+    Un documento JSON por usuario y día en CONVERSATION_DIR/users/<id>/<fecha>.json.
+    """
+
+    def load(self, history):
+        if os.path.exists(history.user_file):
+            with open(history.user_file, "r", encoding="utf-8") as file:
+                data = json.load(file)
+                if isinstance(data, dict) and "messages" in data:
+                    return data
+        return empty_history()  # Historial vacío si no existe
+
+    def save(self, history):
+        os.makedirs(os.path.dirname(history.user_file), exist_ok=True)
+        data = json.dumps(history.history, ensure_ascii=False, indent=4)
+        temp_file = f"{history.user_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as file:
+            file.write(data)
+        os.replace(temp_file, history.user_file)
+
+
+class JournalStore(HistoryStore):
+    """
+    Diario JSONL con snapshots periódicos (ver utils/history_journal.py).
+    El estado del diario (secuencia, último estado persistido) vive en cada historial.
+    """
+
+    def __init__(self, compact_every=HISTORY_JOURNAL_COMPACT_EVERY):
+        self.compact_every = compact_every
+
+    def load(self, history):
+        os.makedirs(os.path.dirname(history.user_file), exist_ok=True)
+        history.journal = HistoryJournal(history.user_file, history.max_messages, self.compact_every)
+        return history.journal.load()
+
+    def save(self, history):
+        history.journal.append(history.history, history.unsaved_messages)
+
+
+class SQLiteStore(HistoryStore):
+    """
+    Base de datos SQLite única en modo WAL, con una conexión por hilo.
+
+    Los mensajes se guardan como filas indexadas por (user_id, date, timestamp) y el resto
+    del estado del día (modelo, meta_prompt, etc.) como un documento JSON en la tabla `state`.
+    En este modo `history.history["messages"]` solo contiene los mensajes que todavía no se
+    escribieron; get_recent_messages() consulta la base con LIMIT.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT,
+            username TEXT,
+            chat_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_user_date_ts ON messages (user_id, date, timestamp);
+        CREATE TABLE IF NOT EXISTS state (
+            user_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, date)
+        );
+    """
+
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def connection(self):
+        """
+        Devolver la conexión del hilo actual, creándola la primera vez.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def load(self, history):
+        row = self.connection().execute(
+            "SELECT data FROM state WHERE user_id = ? AND date = ?",
+            (history.user_id, history.date)
+        ).fetchone()
+        data = json.loads(row[0]) if row else empty_history()
+        data["messages"] = []
+        history.persisted_state = row[0] if row else None
+        return data
+
+    def save(self, history):
+        state = {key: value for key, value in history.history.items() if key != "messages"}
+        state_json = json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+        conn = self.connection()
+        with conn:
+            if history.unsaved_messages:
+                conn.executemany(
+                    "INSERT INTO messages (user_id, date, timestamp, role, content, username, chat_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [self._message_row(history.user_id, history.date, message) for message in history.unsaved_messages]
+                )
+            if state_json != history.persisted_state:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (user_id, date, data) VALUES (?, ?, ?)",
+                    (history.user_id, history.date, state_json)
+                )
+        history.persisted_state = state_json
+        # Los mensajes ya viven en la base; en memoria solo quedan los pendientes
+        history.history["messages"] = []
+
+    @staticmethod
+    def _message_row(user_id, date, message):
+        chat_id = message.get("chat_id")
+        return (
+            user_id,
+            date,
+            message.get("timestamp", ""),
+            message.get("role", "user"),
+            message.get("content"),
+            message.get("username"),
+            str(chat_id) if chat_id is not None else None,
+        )
+
+    def recent_messages(self, history, num_messages):
+        pending = history.history["messages"]
+        if len(pending) >= num_messages:
+            return pending[-num_messages:]
+        rows = self.connection().execute(
+            "SELECT role, content, timestamp, username, chat_id FROM messages "
+            "WHERE user_id = ? AND date = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (history.user_id, history.date, num_messages - len(pending))
+        ).fetchall()
+        messages = []
+        for role, content, timestamp, username, chat_id in reversed(rows):
+            message = {"role": role, "content": content, "timestamp": timestamp}
+            if username:
+                message["username"] = username
+            if chat_id:
+                message["chat_id"] = chat_id
+            messages.append(message)
+        return messages + pending
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Devolver la instancia de almacenamiento configurada en HISTORY_STORAGE.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if HISTORY_STORAGE == "sqlite":
+                    _store = SQLiteStore()
+                elif HISTORY_STORAGE == "journal":
+                    _store = JournalStore()
+                else:
+                    _store = JsonFileStore()
+    return _store
@@ -0,0 +1,188 @@
+# utils/image_cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config import IMAGE_CACHE_PATH, IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_ENTRIES
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def file_key(file_unique_id):
+    """Clave por archivo de Telegram: igual para reenvíos y para todos los usuarios."""
+    return f"file:{file_unique_id}"
+
+
+def content_key(encoded_image):
+    """Clave por contenido: hash de la imagen ya normalizada (RGB, redimensionada, JPEG)."""
+    return "sha256:" + hashlib.sha256(encoded_image.encode('ascii')).hexdigest()
+
+
+class ImageAnalysisCache:
+    """
+    Caché persistente (SQLite) de análisis de imágenes.
+
+    Se consulta primero por `file_unique_id`, lo que evita descargar la imagen y llamar al
+    modelo de visión; si la imagen es nueva para Telegram pero su contenido normalizado ya
+    se analizó (otra copia del mismo meme), se consulta por hash y solo se evita el modelo.
+    Las entradas caducan a los `ttl` segundos y se conservan como mucho `max_entries`,
+    descartando las usadas hace más tiempo.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS image_analysis (
+            key TEXT PRIMARY KEY,
+            analysis TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_image_analysis_last_used ON image_analysis (last_used);
+    """
+
+    def __init__(self, db_path=IMAGE_CACHE_PATH, ttl=IMAGE_CACHE_TTL, max_entries=IMAGE_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+
+        self.file_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def connection(self):
+        """
+        Devolver la conexión del hilo actual, creándola la primera vez.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _lookup(self, key):
+        conn = self.connection()
+        now = time.time()
+        row = conn.execute("SELECT analysis, created FROM image_analysis WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        analysis, created = row
+        if self.ttl and now - created > self.ttl:
+            with conn:
+                conn.execute("DELETE FROM image_analysis WHERE key = ?", (key,))
+            with self._lock:
+                self.expired += 1
+            return None
+        with conn:
+            conn.execute("UPDATE image_analysis SET last_used = ? WHERE key = ?", (now, key))
+        return analysis
+
+    def get_by_file(self, file_unique_id):
+        """
+        Buscar el análisis de un archivo de Telegram. Devuelve None si no está en caché.
+        """
+        try:
+            analysis = self._lookup(file_key(file_unique_id))
+        except sqlite3.Error as e:
+            logger.error(f"Error al consultar la caché de imágenes: {e}")
+            return None
+        if analysis is not None:
+            with self._lock:
+                self.file_hits += 1
+        return analysis
+
+    def get_by_content(self, encoded_image, file_unique_id=None):
+        """
+        Buscar el análisis de una imagen ya normalizada. Si se encuentra, se registra también
+        bajo `file_unique_id` para que la próxima vez no haga falta descargarla.
+        Cuenta como fallo si no está (a continuación se llamará al modelo).
+        """
+        try:
+            analysis = self._lookup(content_key(encoded_image))
+            if analysis is not None and file_unique_id:
+                self._store([file_key(file_unique_id)], analysis)
+        except sqlite3.Error as e:
+            logger.error(f"Error al consultar la caché de imágenes: {e}")
+            analysis = None
+        with self._lock:
+            if analysis is not None:
+                self.content_hits += 1
+            else:
+                self.misses += 1
+        return analysis
+
+    def put(self, encoded_image, analysis, file_unique_id=None):
+        """
+        Guardar el análisis de una imagen bajo su hash de contenido y su file_unique_id.
+        """
+        if not analysis:
+            return
+        keys = [content_key(encoded_image)]
+        if file_unique_id:
+            keys.append(file_key(file_unique_id))
+        try:
+            self._store(keys, analysis)
+        except sqlite3.Error as e:
+            logger.error(f"Error al guardar en la caché de imágenes: {e}")
+
+    def _store(self, keys, analysis):
+        conn = self.connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO image_analysis (key, analysis, created, last_used) VALUES (?, ?, ?, ?)",
+                [(key, analysis, now, now) for key in keys]
+            )
+        with self._lock:
+            self._puts_since_evict += len(keys)
+            # Recortar por lotes para no contar la tabla en cada escritura
+            evict = self._puts_since_evict >= max(1, self.max_entries // 100)
+            if evict:
+                self._puts_since_evict = 0
+        if evict:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        with conn:
+            removed = 0
+            if self.ttl:
+                removed += conn.execute("DELETE FROM image_analysis WHERE created < ?", (now - self.ttl,)).rowcount
+            (count,) = conn.execute("SELECT COUNT(*) FROM image_analysis").fetchone()
+            if count > self.max_entries:
+                removed += conn.execute(
+                    "DELETE FROM image_analysis WHERE key IN "
+                    "(SELECT key FROM image_analysis ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+        if removed:
+            with self._lock:
+                self.evictions += removed
+
+    def get_stats(self):
+        with self._lock:
+            hits = self.file_hits + self.content_hits
+            total = hits + self.misses
+            return {
+                "file_hits": self.file_hits,
+                "content_hits": self.content_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+# Instancia compartida por todo el proceso
+image_cache = ImageAnalysisCache()
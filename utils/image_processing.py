@@ -1,7 +1,17 @@
 # utils/image_processing.py
+import asyncio
 import base64
 import io
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from PIL import Image
+from config import IMAGE_WORKERS, IMAGE_PROCESS_TIMEOUT
+
+MAX_IMAGE_SIDE = 512  # Lado máximo de la imagen que se envía al modelo de visión
+
+_pool = None
+_pool_lock = threading.Lock()
 
 def encode_image(image_bytes):
     """
@@ -9,6 +19,18 @@ def encode_image(image_bytes):
     """
     return base64.b64encode(image_bytes).decode('utf-8')
 
+def select_photo_size(photo_sizes, max_side=MAX_IMAGE_SIDE):
+    """
+    Elige la versión más pequeña de la foto que alcanza `max_side` en su lado mayor.
+    Telegram envía varias resoluciones de cada foto; descargar y decodificar la más
+    grande para después reducirla a 512 px es trabajo desperdiciado.
+    """
+    sizes = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for size in sizes:
+        if max(size.width, size.height) >= max_side:
+            return size
+    return sizes[-1]
+
 def process_image(file_content):
     """
     Procesa la imagen: verifica el formato, redimensiona si es necesario y la codifica.
@@ -17,14 +39,19 @@ def process_image(file_content):
         # Cargar la imagen desde los bytes
         image = Image.open(io.BytesIO(file_content))
 
+        # En JPEG, decodificar directamente a una escala reducida (1/2, 1/4 o 1/8) que
+        # siga cubriendo el tamaño final: mucho menos trabajo que decodificar la imagen completa
+        max_size = (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE)
+        if image.format == 'JPEG':
+            image.draft('RGB', max_size)
+
         # Convertir a RGB si es necesario
         if image.mode != 'RGB':
             image = image.convert('RGB')
 
         # Redimensionar si es mayor a 512x512
-        max_size = (512, 512)
-        if image.size[0] > 512 or image.size[1] > 512:
-            image.thumbnail(max_size, Image.ANTIALIAS)
+        if image.size[0] > MAX_IMAGE_SIDE or image.size[1] > MAX_IMAGE_SIDE:
+            image.thumbnail(max_size, Image.LANCZOS)
 
         # Guardar la imagen en un buffer
         buffer = io.BytesIO()
@@ -33,3 +60,58 @@ def process_image(file_content):
         return encoded_image, None  # No hay error
     except Exception as e:
         return None, str(e)  # Retorna el error
+
+def get_image_pool():
+    """
+    Devuelve el pool de procesos para el procesamiento de imágenes (None si IMAGE_WORKERS es 0).
+    Se crea en el primer uso, con spawn: el bot tiene varios hilos (dispatcher, envíos, volcado
+    de historiales) y un fork podría heredar uno de sus locks tomado y bloquear al hijo.
+    Cada hijo vuelve a importar el script principal como __mp_main__ (bot.py o bot_async.py, que
+    solo crean el bot en setup()): con sus dependencias son ~0,9 s por proceso, una sola vez.
+    """
+    global _pool
+    if IMAGE_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def preprocess_image(file_content):
+    """
+    Procesa la imagen en el pool de procesos, sin ocupar el GIL del hilo del handler.
+    """
+    pool = get_image_pool()
+    if pool is None:
+        return process_image(file_content)
+    try:
+        return pool.submit(process_image, file_content).result(timeout=IMAGE_PROCESS_TIMEOUT)
+    except FutureTimeoutError:
+        return None, f"El procesamiento de la imagen superó {IMAGE_PROCESS_TIMEOUT:.0f} segundos"
+    except Exception as e:
+        return None, str(e)
+
+async def preprocess_image_async(file_content):
+    """
+    Versión asyncio de preprocess_image. Con IMAGE_WORKERS = 0 usa el executor por defecto del loop.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(get_image_pool(), process_image, file_content), IMAGE_PROCESS_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        return None, f"El procesamiento de la imagen superó {IMAGE_PROCESS_TIMEOUT:.0f} segundos"
+    except Exception as e:
+        return None, str(e)
+
+def shutdown_image_pool():
+    """
+    Detener el pool de procesos, si se llegó a crear.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
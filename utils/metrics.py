@@ -0,0 +1,202 @@
+# utils/metrics.py
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Límites de las cubetas en segundos (de 0,5 ms a 2 min)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Histograma acumulado con cubetas fijas, como los de Prometheus. Los percentiles se
+    estiman interpolando dentro de la cubeta.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # La última cubeta es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        accumulated = 0
+        for index, count in enumerate(self.counts):
+            if count and accumulated + count >= target:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower  # Por encima del último límite no se puede interpolar
+                return lower + (self.buckets[index] - lower) * (target - accumulated) / count
+            accumulated += count
+        return self.buckets[-1]
+
+
+class _NoopTimer:
+    """
+    Temporizador vacío que se usa con las métricas desactivadas: no mide ni reserva nada.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class Metrics:
+    """
+    Temporizadores y contadores por etapa del procesamiento de un mensaje (registro de usuario,
+    historial, prompt, descarga, imagen, modelo de visión, generación, envío...).
+
+    Con las métricas desactivadas `timer()` devuelve un objeto vacío compartido e `increment()`
+    retorna de inmediato, así que instrumentar el código apenas cuesta nada.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = {}  # etapa -> Histogram
+        self._counters = {}  # (nombre, etiquetas) -> valor
+        self._lock = threading.Lock()
+        self._server = None
+
+    def timer(self, stage):
+        """
+        Medir la duración de un bloque `with` y registrarla en el histograma de la etapa.
+        """
+        if not self.enabled:
+            return _NOOP_TIMER
+        return self._timer(stage)
+
+    @contextmanager
+    def _timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def get_stats(self):
+        """
+        Percentiles (p50/p95/p99, en milisegundos) y cantidad de mediciones por etapa.
+        """
+        with self._lock:
+            stats = {}
+            for stage, histogram in sorted(self._histograms.items()):
+                stats[stage] = {"count": histogram.count}
+                for q in QUANTILES:
+                    stats[stage][f"p{round(q * 100)}"] = round(histogram.quantile(q) * 1000, 1)
+            return stats
+
+    def render(self):
+        """
+        Métricas en el formato de texto de Prometheus.
+        """
+        lines = [
+            "# HELP bot_stage_seconds Duración de cada etapa del procesamiento de mensajes.",
+            "# TYPE bot_stage_seconds histogram",
+        ]
+        quantile_lines = [
+            "# HELP bot_stage_seconds_quantile Percentiles estimados de cada etapa.",
+            "# TYPE bot_stage_seconds_quantile gauge",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                accumulated = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    accumulated += count
+                    lines.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {accumulated}')
+                lines.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'bot_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'bot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+                for q in QUANTILES:
+                    quantile_lines.append(
+                        f'bot_stage_seconds_quantile{{stage="{stage}",quantile="{q}"}} {histogram.quantile(q):.6f}'
+                    )
+            counters = sorted(self._counters.items())
+        lines.extend(quantile_lines)
+
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE bot_{name} counter")
+                declared.add(name)
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f"bot_{name}{{{label_text}}} {value}" if label_text else f"bot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        """
+        Servir /metrics en un hilo aparte. No hace nada si las métricas están desactivadas.
+        """
+        if not self.enabled or self._server is not None:
+            return
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Sin una línea de log por cada consulta de Prometheus
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.error(f"No se pudo iniciar el servidor de métricas en {host}:{port}: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Instancia compartida por todo el proceso
+metrics = Metrics()
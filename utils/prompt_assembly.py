@@ -0,0 +1,87 @@
+# utils/prompt_assembly.py
+import logging
+from utils.prompts import PromptBuilder
+from utils.context_window import context_window
+from utils.summarizer import SUMMARY_HEADER
+from utils.tokens import count_tokens, count_message_tokens
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class AssembledPrompt:
+    """
+    Prompt separado por roles: instrucciones de sistema, resumen de la conversación anterior,
+    turnos recientes y mensaje actual.
+
+    El mensaje de sistema va siempre primero y solo depende de los archivos de prompts, así
+    que el prefijo de la petición es estable entre llamadas y el proveedor puede reutilizarlo
+    (caché de prompts). Nada se repite entre secciones.
+    """
+
+    def __init__(self, system, history, user, summary=''):
+        self.system = system or ''
+        self.summary = summary or ''
+        self.history = history  # Lista de {"role": "user"|"assistant", "content": ...}
+        self.user = user or ''
+
+    def to_messages(self):
+        """
+        Mensajes en el formato de chat de Groq/OpenAI.
+        """
+        messages = []
+        if self.system:
+            messages.append({"role": "system", "content": self.system})
+        if self.summary:
+            messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{self.summary}"})
+        messages.extend(self.history)
+        messages.append({"role": "user", "content": self.user})
+        return messages
+
+    def token_counts(self):
+        """
+        Tokens estimados por sección y en total.
+        """
+        counts = {
+            "system": count_tokens(self.system),
+            "summary": count_tokens(self.summary),
+            "history": count_message_tokens(self.history),
+            "user": count_tokens(self.user),
+        }
+        counts["total"] = count_message_tokens(self.to_messages())
+        return counts
+
+
+def assemble_prompt(history, fragments, user_name, user_username, user_message, image_analysis=None):
+    """
+    Armar el prompt de una petición a partir de los fragmentos cargados
+    (ver PromptRegistry.get_fragments) y del historial del usuario.
+    Los turnos anteriores se eligen con la ventana de contexto según el presupuesto del modelo.
+    """
+    prompt_builder = PromptBuilder.from_fragments(fragments)
+
+    # Presupuesto por modelo: 'llama'/'mistral' en Groq, 'google' para Gemini
+    if history.history.get('model_provider', 'groq') == 'google':
+        model_key = 'google'
+    else:
+        model_key = history.history.get('model_name', 'llama')
+    summary, context = context_window.build(history, model_key)
+
+    prompt = AssembledPrompt(
+        system=prompt_builder.build_system_prompt(),
+        summary=summary,
+        history=context,
+        user=prompt_builder.build_prompt(
+            user_name=user_name,
+            user_username=user_username,
+            user_message=user_message,
+            image_analysis=image_analysis
+        )
+    )
+
+    counts = prompt.token_counts()
+    logger.info(
+        f"Tamaño del prompt (tokens aprox.): sistema={counts['system']}, resumen={counts['summary']}, historial={counts['history']} "
+        f"({len(context)} turnos), usuario={counts['user']}, total={counts['total']}"
+    )
+    return prompt
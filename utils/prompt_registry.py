@@ -0,0 +1,96 @@
+# utils/prompt_registry.py
+import os
+import time
+import logging
+import threading
+from jinja2 import Environment
+from config import PROMPT_RELOAD_CHECK_INTERVAL
+
+# Rutas de los prompts usados por el bot
+SYSTEM_MESSAGE_PATH = 'prompts/system.txt'
+TEMPLATE_PATH = 'prompts/prompt_template.txt'
+META_PROMPT_PATH = 'prompts/meta_prompt_caotico_visceral (1).md'
+REBEL_PATH = 'prompts/rebel.json'
+REBEL2_PATH = 'prompts/rebel_v2.json'
+
+
+class PromptRegistry:
+    """
+    Registro compartido de los archivos de prompts.
+
+    Cada archivo se lee (y cada plantilla se compila) una sola vez. Para que los prompts se
+    puedan seguir editando en caliente, se revisa la fecha de modificación del archivo como
+    mucho cada `check_interval` segundos y se recarga si cambió. reload() descarta todo lo
+    cargado (se usa con SIGHUP).
+    """
+
+    def __init__(self, check_interval=PROMPT_RELOAD_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._env = Environment()
+        self._entries = {}  # (tipo, ruta) -> [mtime, última revisión, valor]
+        self._lock = threading.Lock()
+        self.loads = 0  # Lecturas reales de archivos
+
+    def _get(self, path, kind):
+        key = (kind, path)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and now - entry[1] < self.check_interval:
+            return entry[2]
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            logging.error(f"No se pudo encontrar el archivo: {path}")
+            return None
+        if entry and entry[0] == mtime:
+            entry[1] = now
+            return entry[2]
+
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    content = file.read()
+                value = self._env.from_string(content) if kind == 'template' else content
+            except Exception as e:
+                logging.error(f"Error al cargar el archivo {path}: {str(e)}")
+                return None
+            self._entries[key] = [mtime, now, value]
+            self.loads += 1
+        logging.info(f"Archivo cargado exitosamente: {path}")
+        return value
+
+    def get_text(self, path):
+        """
+        Devolver el contenido del archivo, o None si no existe.
+        """
+        return self._get(path, 'text')
+
+    def get_template(self, path):
+        """
+        Devolver la plantilla Jinja2 ya compilada, o None si no existe.
+        """
+        return self._get(path, 'template')
+
+    def get_fragments(self, use_meta_prompt=False, use_rebel=False):
+        """
+        Devolver los fragmentos de prompt que necesita el handler según el estado actual.
+        """
+        return {
+            'system_message': self.get_text(SYSTEM_MESSAGE_PATH),
+            'meta_prompt_content': self.get_text(META_PROMPT_PATH) if use_meta_prompt else None,
+            'rebel_v1': self.get_text(REBEL_PATH) if use_rebel else None,
+            'rebel_v2': self.get_text(REBEL2_PATH) if use_rebel else None,
+        }
+
+    def reload(self):
+        """
+        Descartar todos los prompts cargados para que se vuelvan a leer en el próximo uso.
+        """
+        with self._lock:
+            self._entries.clear()
+        logging.info("Prompts marcados para recarga")
+
+
+# Instancia compartida por todo el proceso
+prompt_registry = PromptRegistry()
@@ -1,6 +1,5 @@
-from jinja2 import Environment, FileSystemLoader
-import os
 import logging
+from utils.prompt_registry import prompt_registry, TEMPLATE_PATH
 
 class PromptBuilder:
     def __init__(self, meta_prompt_path=None, system_message_path=None, template_path=None, rebel_path=None, rebel2_path=None):
@@ -11,43 +10,44 @@ class PromptBuilder:
         self.rebel_v2 = self.load_file(rebel2_path) if rebel2_path else None
         self.template = self.load_template(template_path) if template_path else None
 
+    @classmethod
+    def from_fragments(cls, fragments, template_path=TEMPLATE_PATH):
+        """
+        Crear el constructor a partir de fragmentos ya cargados (ver PromptRegistry.get_fragments).
+        """
+        builder = cls(template_path=template_path)
+        builder.meta_prompt_content = fragments.get('meta_prompt_content')
+        builder.system_message = fragments.get('system_message')
+        builder.rebel_v1 = fragments.get('rebel_v1')
+        builder.rebel_v2 = fragments.get('rebel_v2')
+        return builder
+
     def load_file(self, file_path):
         """
-        Cargar el contenido de un archivo. 
+        Cargar el contenido de un archivo desde el registro compartido de prompts.
         Si el archivo no existe, se registra un error y se devuelve None.
         """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-            logging.info(f"Archivo cargado exitosamente: {file_path}")
-            return content
-        except FileNotFoundError:
-            logging.error(f"No se pudo encontrar el archivo: {file_path}")
-            return None
-        except Exception as e:
-            logging.error(f"Error al cargar el archivo {file_path}: {str(e)}")
-            return None
-    
+        return prompt_registry.get_text(file_path)
+
     def load_template(self, path):
         """
-        Cargar una plantilla usando Jinja2.
+        Obtener la plantilla Jinja2 ya compilada desde el registro compartido de prompts.
         """
-        try:
-            env = Environment(loader=FileSystemLoader(os.path.dirname(path)))
-            template = env.get_template(os.path.basename(path))
-            logging.info(f"Plantilla cargada exitosamente: {path}")
-            return template
-        except FileNotFoundError:
-            logging.error(f"No se pudo encontrar la plantilla: {path}")
-            return None
-        except Exception as e:
-            logging.error(f"Error al cargar la plantilla {path}: {str(e)}")
-            return None
+        return prompt_registry.get_template(path)
+
+    def build_system_prompt(self):
+        """
+        Construir el mensaje de sistema con los fragmentos cargados, en orden fijo
+        (system, meta_prompt, rebel) para que el inicio del prompt no cambie entre peticiones.
+        """
+        parts = [self.system_message, self.meta_prompt_content, self.rebel_v1, self.rebel_v2]
+        return "\n\n".join(part.strip() for part in parts if part and part.strip())
 
-    def build_prompt(self, summarized_context, user_name, user_username, user_message, image_analysis=None):
+    def build_prompt(self, user_name, user_username, user_message, image_analysis=None):
         """
-        Construir el prompt usando la plantilla cargada. 
-        Los valores se reemplazan en la plantilla.
+        Construir el mensaje del usuario usando la plantilla cargada.
+        Los valores se reemplazan en la plantilla; las instrucciones de sistema y el
+        historial van en sus propios mensajes (ver build_system_prompt).
         """
         if not self.template:
             logging.error("No se pudo cargar la plantilla. No se puede construir el prompt.")
@@ -55,13 +55,8 @@ class PromptBuilder:
         
         # Renderizar la plantilla con los valores cargados
         return self.template.render(
-            meta_prompt_content=self.meta_prompt_content or '',
-            system_message=self.system_message or '',
-            rebel_v1=self.rebel_v1 or '',
-            rebel_v2=self.rebel_v2 or '',
-            summarized_context=summarized_context,
             user_name=user_name,
             user_username=user_username,
             user_message=user_message,
             image_analysis=image_analysis or ''
-        )
+        ).strip()
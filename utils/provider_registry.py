@@ -0,0 +1,196 @@
+# utils/provider_registry.py
+import json
+import logging
+import threading
+from collections import OrderedDict
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from groq import Client, AsyncGroq
+import google.generativeai as genai
+from config import (
+    GROQ_API_KEY,
+    CHAT_WORKERS,
+    OUTBOUND_SENDERS,
+    ASYNC_EXECUTOR_WORKERS,
+    HTTP_POOL_SIZE,
+    HTTP_KEEPALIVE_EXPIRY,
+    PROVIDER_CACHE_SIZE,
+)
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+GROQ_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+
+class ProviderRegistry:
+    """
+    Registro compartido de clientes y modelos de los proveedores.
+
+    Cada objeto se construye una sola vez por (proveedor, modelo, configuración) y se reutiliza
+    en todas las peticiones. Los clientes HTTP comparten pools de conexiones keep-alive
+    dimensionados según los workers, así que las peticiones no pagan el handshake TCP/TLS
+    ni la construcción de objetos cada vez. Los modelos de Gemini (uno por combinación de
+    instrucciones de sistema) se guardan en un LRU de `cache_size` entradas.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY, cache_size=PROVIDER_CACHE_SIZE):
+        # Sin tamaño explícito: una conexión por worker más margen para resúmenes e imágenes
+        self.pool_size = pool_size or max(1, CHAT_WORKERS) + 4
+        self.async_pool_size = pool_size or ASYNC_EXECUTOR_WORKERS * 2
+        self.keepalive_expiry = keepalive_expiry
+        self.cache_size = cache_size
+        self._objects = {}  # clave -> cliente (se conservan siempre)
+        self._models = OrderedDict()  # clave -> GenerativeModel (LRU)
+        self._lock = threading.Lock()
+        self._http_requests = {}  # proveedor -> peticiones HTTP enviadas
+        self._telegram_session = None
+
+        self.created = 0
+        self.reused = 0
+
+    def _get(self, key, factory):
+        with self._lock:
+            value = self._objects.get(key)
+            if value is not None:
+                self.reused += 1
+                return value
+            value = factory()
+            self._objects[key] = value
+            self.created += 1
+            return value
+
+    def _count_request(self, provider):
+        def hook(request):
+            with self._lock:
+                self._http_requests[provider] = self._http_requests.get(provider, 0) + 1
+        return hook
+
+    def _limits(self, size):
+        return httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    def groq_client(self):
+        """
+        Cliente de Groq con un pool de conexiones compartido por todos los hilos.
+        """
+        return self._get(('groq', 'sync'), lambda: Client(
+            api_key=GROQ_API_KEY,
+            http_client=httpx.Client(
+                limits=self._limits(self.pool_size),
+                timeout=GROQ_TIMEOUT,
+                event_hooks={'request': [self._count_request('groq')]}
+            )
+        ))
+
+    def groq_async_client(self):
+        """
+        Cliente asyncio de Groq (bot_async.py), con su propio pool.
+        """
+        count = self._count_request('groq_async')
+
+        async def hook(request):
+            count(request)
+
+        return self._get(('groq', 'async'), lambda: AsyncGroq(
+            api_key=GROQ_API_KEY,
+            http_client=httpx.AsyncClient(
+                limits=self._limits(self.async_pool_size),
+                timeout=GROQ_TIMEOUT,
+                event_hooks={'request': [hook]}
+            )
+        ))
+
+    def google_model(self, model_name, generation_config, safety_settings=None, system_instruction=None):
+        """
+        Modelo de Gemini para una configuración dada. El cliente gRPC de genai ya es
+        compartido; lo que se evita es reconstruir y validar la configuración en cada petición.
+        """
+        key = (
+            model_name,
+            json.dumps(generation_config, sort_keys=True),
+            json.dumps(safety_settings, sort_keys=True),
+            system_instruction,
+        )
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.reused += 1
+                return model
+        model = genai.GenerativeModel(
+            model_name=model_name,
+            safety_settings=safety_settings,
+            generation_config=generation_config,
+            system_instruction=system_instruction
+        )
+        with self._lock:
+            self._models[key] = model
+            self.created += 1
+            while len(self._models) > self.cache_size:
+                self._models.popitem(last=False)
+        return model
+
+    def install_telegram_session(self):
+        """
+        Hacer que pyTelegramBotAPI use una única sesión de requests con un pool keep-alive
+        para todos los hilos (por defecto crea una sesión, y un pool, por hilo).
+        """
+        with self._lock:
+            if self._telegram_session is not None:
+                return self._telegram_session
+            pool_size = HTTP_POOL_SIZE or max(1, CHAT_WORKERS) + OUTBOUND_SENDERS + 2  # + polling
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            apihelper.session = session
+            self._telegram_session = session
+            return session
+
+    @staticmethod
+    def _httpx_pool_stats(client):
+        # Atributos internos de httpx/httpcore: si cambian, se omiten las cifras
+        pool = getattr(getattr(getattr(client, '_client', None), '_transport', None), '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        if connections is None:
+            return {}
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"open": len(connections), "idle": idle}
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                "created": self.created,
+                "reused": self.reused,
+                "google_models": len(self._models),
+                "http_requests": dict(self._http_requests),
+            }
+            clients = dict(self._objects)
+            session = self._telegram_session
+        for (provider, kind), client in clients.items():
+            pool = self._httpx_pool_stats(client)
+            if pool:
+                stats[f"{provider}_{kind}_pool"] = pool
+        if session is not None:
+            created = idle = requests_sent = 0
+            for adapter in set(session.adapters.values()):
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    created += pool.num_connections
+                    # La cola del pool guarda None en los huecos sin conexión abierta
+                    idle += sum(1 for connection in list(pool.pool.queue) if connection is not None) if pool.pool else 0
+                    requests_sent += pool.num_requests
+            stats["telegram_pool"] = {"created": created, "idle": idle, "requests": requests_sent}
+        return stats
+
+
+# Instancia compartida por todo el proceso
+provider_registry = ProviderRegistry()
@@ -0,0 +1,144 @@
+# utils/response_cache.py
+import re
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_VARIANTS, RESPONSE_CACHE_MAX_CHARS
+)
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Marca que reemplaza el nombre del usuario en las respuestas guardadas
+NAME_PLACEHOLDER = "\x00user_name\x00"
+
+
+def mention_pattern(name):
+    """
+    Expresión que encuentra `name` como palabra completa, sin distinguir mayúsculas
+    ("Ana" no coincide dentro de "mañana").
+    """
+    return re.compile(rf"(?<!\w){re.escape(name)}(?!\w)", re.IGNORECASE)
+
+
+def normalize_message(text):
+    """
+    Normalizar un mensaje corto para compararlo: minúsculas, espacios simples y sin signos
+    de puntuación ni emojis en los extremos ("¡Hola!!" y "hola" son el mismo mensaje).
+    """
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return re.sub(r"^\W+|\W+$", "", text)
+
+
+class ResponseCache:
+    """
+    Caché en memoria de respuestas del modelo para mensajes cortos que se repiten entre usuarios.
+
+    La clave es (modelo, hash de las instrucciones de sistema, mensaje normalizado): las
+    instrucciones ya incluyen los fragmentos activos (meta_prompt, rebel). El historial no
+    forma parte de la clave, por eso solo se cachean mensajes de hasta `max_chars` caracteres
+    y sin imágenes. Por cada clave se guardan hasta `variants` respuestas distintas y se
+    devuelve una al azar; mientras no se completan, parte de las consultas van al modelo para
+    reunirlas. Las entradas caducan a los `ttl` segundos y se conservan como mucho
+    `max_entries`, descartando las usadas hace más tiempo.
+    """
+
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 variants=RESPONSE_CACHE_VARIANTS, max_chars=RESPONSE_CACHE_MAX_CHARS):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.variants = max(1, variants)
+        self.max_chars = max_chars
+        self._entries = OrderedDict()  # clave -> (creada, [respuestas])
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0  # Consultas enviadas al modelo para reunir más variantes
+        self.evictions = 0
+        self.expired = 0
+
+    def make_key(self, model, system, user_message, image_analysis=None):
+        """
+        Clave del mensaje, o None si no se debe cachear (caché desactivada, mensaje largo o con imagen).
+        """
+        if not self.enabled or image_analysis or not user_message:
+            return None
+        normalized = normalize_message(user_message)
+        if not normalized or len(normalized) > self.max_chars:
+            return None
+        system_hash = hashlib.sha256((system or "").encode('utf-8')).hexdigest()[:16]
+        return (model, system_hash, normalized)
+
+    def get(self, key, user_name=None):
+        """
+        Devolver una respuesta guardada para `key` (con el nombre del usuario actual) o None.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            replies = entry[1]
+            # Con pocas variantes, se pide otra al modelo con probabilidad proporcional a las que faltan
+            if len(replies) < self.variants and random.random() >= len(replies) / self.variants:
+                self.fills += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            reply = random.choice(replies)
+        return reply.replace(NAME_PLACEHOLDER, user_name or "")
+
+    def put(self, key, reply, user_name=None, user_username=None):
+        """
+        Guardar una respuesta. El nombre del usuario se sustituye por una marca para poder
+        devolverla a otros usuarios; las respuestas que mencionan su @username no se guardan.
+        """
+        if key is None or not reply:
+            return
+        if user_username and mention_pattern(user_username).search(reply):
+            return
+        if user_name:
+            reply = mention_pattern(user_name).sub(NAME_PLACEHOLDER, reply)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = (time.time(), [])
+            replies = entry[1]
+            if reply not in replies:
+                replies.append(reply)
+                del replies[:-self.variants]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.fills
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "fills": self.fills,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+# Instancia compartida por todo el proceso
+response_cache = ResponseCache()
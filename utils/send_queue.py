@@ -0,0 +1,302 @@
+# utils/send_queue.py
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from telebot import apihelper
+from requests.exceptions import ConnectionError, ReadTimeout
+from urllib3.exceptions import ProtocolError
+from http.client import RemoteDisconnected
+from utils.metrics import metrics
+from config import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_SENDERS,
+    OUTBOUND_MAX_RETRIES,
+)
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Errores de red que justifican reintentar el envío
+RETRYABLE_ERRORS = (ConnectionError, ReadTimeout, ProtocolError, RemoteDisconnected)
+
+BUCKET_PRUNE_INTERVAL = 60  # Segundos entre limpiezas de las cubetas de chats inactivos
+
+
+class TokenBucket:
+    """
+    Cubeta de fichas: permite `rate` operaciones por segundo con ráfagas de hasta `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self, now):
+        """True si la cubeta ya se rellenó: equivale a una nueva."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def wait_time(self, now):
+        """Segundos hasta que haya una ficha disponible (0 si ya la hay)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("bot", "chat_id", "method", "args", "kwargs", "future", "callback", "retries", "max_retries", "coalesce_key")
+
+    def __init__(self, bot, chat_id, method, args, kwargs, callback, max_retries, coalesce_key):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.callback = callback
+        self.retries = 0
+        self.max_retries = max_retries
+        self.coalesce_key = coalesce_key
+
+
+def retry_after_seconds(error):
+    """
+    Extraer `retry_after` de un error 429 de Telegram, o None si el error no es de límite de envío.
+    """
+    if isinstance(error, apihelper.ApiTelegramException) and error.error_code == 429:
+        parameters = (error.result_json or {}).get('parameters') or {}
+        return float(parameters.get('retry_after', 1))
+    return None
+
+
+def is_retryable(error):
+    """
+    Errores de red, errores 5xx de Telegram y respuestas HTTP inválidas se reintentan;
+    los errores 4xx (chat inexistente, bot bloqueado...) no.
+    """
+    if isinstance(error, apihelper.ApiTelegramException):
+        return error.error_code >= 500
+    return isinstance(error, RETRYABLE_ERRORS + (apihelper.ApiException,))
+
+
+class OutboundScheduler:
+    """
+    Planificador único de envíos salientes a Telegram.
+
+    Aplica una cubeta global (~30 mensajes/s) y una por chat (~1 mensaje/s, más estricta en
+    grupos), respeta el `retry_after` de los errores 429 y reintenta los errores de red con
+    espera exponencial. Las esperas las gestiona el hilo del planificador: quien encola recibe
+    un Future y, opcionalmente, un callback(resultado, error) al terminar, sin dormir nunca.
+    Los envíos de un mismo chat salen en el orden en que se encolaron.
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_RATE, senders=OUTBOUND_SENDERS, max_retries=OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._senders = ThreadPoolExecutor(max_workers=max(1, senders), thread_name_prefix="tg-sender")
+        self._cond = threading.Condition()
+        self._chats = {}  # chat_id -> deque de trabajos pendientes
+        self._chat_buckets = {}  # chat_id -> TokenBucket
+        self._chat_not_before = {}  # chat_id -> instante mínimo del próximo envío (reintentos / 429)
+        self._busy = set()  # chats con un envío en curso
+        self._ready = []  # heap (instante, secuencia, chat_id)
+        self._scheduled = set()  # chats presentes en el heap
+        self._seq = itertools.count()
+        self._last_prune = time.monotonic()
+        self._thread = None
+        self._stopping = False
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+
+    def submit(self, bot, chat_id, method, /, *args, callback=None, max_retries=None, coalesce_key=None, **kwargs):
+        """
+        Encolar una llamada `bot.<method>(*args, **kwargs)` dirigida a `chat_id`.
+        Si `coalesce_key` coincide con un trabajo aún no enviado, se reemplazan sus argumentos
+        (útil para ediciones sucesivas del mismo mensaje). Devuelve un Future con el resultado.
+        """
+        chat_key = str(chat_id)  # Los handlers usan tanto int como str para el mismo chat
+        job = _Job(bot, chat_key, method, args, kwargs, callback,
+                   self.max_retries if max_retries is None else max_retries, coalesce_key)
+        with self._cond:
+            pending = self._chats.setdefault(chat_key, deque())
+            if coalesce_key is not None:
+                for queued in pending:
+                    if queued.coalesce_key == coalesce_key:
+                        queued.args, queued.kwargs = args, kwargs
+                        self.coalesced += 1
+                        return queued.future
+            pending.append(job)
+            self._schedule_chat(chat_key, time.monotonic())
+            self._ensure_thread()
+            self._cond.notify()
+        return job.future
+
+    def send_message(self, bot, chat_id, text, /, callback=None, **kwargs):
+        return self.submit(bot, chat_id, 'send_message', chat_id, text, callback=callback, **kwargs)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Los chats de grupo tienen IDs negativos y un límite más estricto
+            is_group = chat_id.startswith('-')
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, capacity=1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self, now):
+        # Se llama con el lock tomado. Las cubetas llenas de chats sin envíos pendientes se
+        # descartan (se recrean al volver a escribir), así el diccionario no crece con cada chat.
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in self._chats and chat_id not in self._busy and bucket.is_full(now):
+                del self._chat_buckets[chat_id]
+        self._last_prune = now
+
+    def _schedule_chat(self, chat_id, now):
+        # Se llama con el lock tomado
+        if chat_id in self._busy or chat_id in self._scheduled or not self._chats.get(chat_id):
+            return
+        ready_at = max(now, self._chat_not_before.get(chat_id, 0))
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tg-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not self._ready:
+                    if self._stopping:
+                        return
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                if now - self._last_prune >= BUCKET_PRUNE_INTERVAL:
+                    self._prune_chat_buckets(now)
+                ready_at, _, chat_id = self._ready[0]
+                wait = max(ready_at - now, self.global_bucket.wait_time(now))
+                if wait <= 0:
+                    wait = self._chat_bucket(chat_id).wait_time(now)
+                    if wait > 0:
+                        # Reprogramar el chat cuando tenga ficha disponible
+                        heapq.heapreplace(self._ready, (now + wait, next(self._seq), chat_id))
+                        continue
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                heapq.heappop(self._ready)
+                self._scheduled.discard(chat_id)
+                job = self._chats[chat_id].popleft()
+                self.global_bucket.consume(now)
+                self._chat_bucket(chat_id).consume(now)
+                self._busy.add(chat_id)
+                self._senders.submit(self._execute, job)
+
+    def _execute(self, job):
+        result = None
+        error = None
+        retry_in = None
+        try:
+            with metrics.timer('send'):
+                result = getattr(job.bot, job.method)(*job.args, **job.kwargs)
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                # Límite de Telegram: se respeta retry_after y no cuenta como reintento
+                retry_in = retry_after
+                with self._cond:
+                    self.rate_limited += 1
+                logger.warning(f"Límite de envío en el chat {job.chat_id}, reintentando en {retry_after} segundos")
+            elif is_retryable(e) and job.retries < job.max_retries:
+                job.retries += 1
+                retry_in = 2 ** job.retries  # Backoff exponencial, sin dormir en el hilo del handler
+                with self._cond:
+                    self.retried += 1
+                logger.warning(f"Error al enviar mensaje: {e}. Reintentando en {retry_in} segundos...")
+            else:
+                error = e
+
+        with self._cond:
+            self._busy.discard(job.chat_id)
+            now = time.monotonic()
+            if retry_in is not None:
+                self._chats.setdefault(job.chat_id, deque()).appendleft(job)
+                self._chat_not_before[job.chat_id] = now + retry_in
+            else:
+                self._chat_not_before.pop(job.chat_id, None)
+                if error is None:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            if not self._chats.get(job.chat_id):
+                self._chats.pop(job.chat_id, None)
+            self._schedule_chat(job.chat_id, now)
+            self._cond.notify()
+
+        if retry_in is not None:
+            return
+        if error is not None:
+            logger.error(f"No se pudo enviar el mensaje al chat {job.chat_id}: {error}")
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+        if job.callback:
+            try:
+                job.callback(result, error)
+            except Exception:
+                logger.error("Error en el callback de entrega", exc_info=True)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                "queued": sum(len(pending) for pending in self._chats.values()),
+                "in_flight": len(self._busy),
+                "chat_buckets": len(self._chat_buckets),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "rate_limited": self.rate_limited,
+                "coalesced": self.coalesced,
+            }
+
+    def shutdown(self, timeout=10):
+        """
+        Esperar (como mucho `timeout` segundos) a que se envíe lo pendiente y detener el planificador.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            while (self._ready or self._busy) and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+        self._senders.shutdown(wait=False)
+
+
+# Instancia compartida por todo el proceso
+outbound = OutboundScheduler()
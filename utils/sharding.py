@@ -0,0 +1,362 @@
+# utils/sharding.py
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from config import SHARD_WORKERS, SHARD_HEARTBEAT_TIMEOUT, SHARD_STALL_TIMEOUT, SHARD_STATS_INTERVAL
+from utils.dispatcher import shard_for
+from utils.metrics import metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Tipos de update cuyo objeto trae el chat, y los que solo traen el usuario
+_CHAT_UPDATES = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                 'my_chat_member', 'chat_member', 'chat_join_request')
+_USER_UPDATES = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query')
+
+MAX_RESTART_DELAY = 30  # Segundos máximos de espera entre reinicios de un worker que falla al arrancar
+MIN_HEALTHY_UPTIME = 60  # Un worker que vivió menos que esto cuenta como fallo consecutivo
+
+
+def raw_update_owner_id(data):
+    """
+    Dueño del estado que toca un update sin deserializar (el dict de la Bot API): el autor, si lo
+    tiene, porque historiales y registro van por usuario (un mismo usuario en su chat privado y en
+    un grupo cae en el mismo shard). Sin autor (publicaciones de canales) se usa el chat.
+    """
+    for key in _CHAT_UPDATES:
+        item = data.get(key)
+        if item and item.get('from'):
+            return item['from']['id']
+        if item and item.get('chat'):
+            return item['chat']['id']
+    callback_query = data.get('callback_query')
+    if callback_query:
+        return callback_query['from']['id']
+    for key in _USER_UPDATES:
+        item = data.get(key)
+        if item:
+            return item['from']['id']
+    return data['update_id']
+
+
+def shard_file(path, shard):
+    """
+    Variante por shard de un archivo de estado que cada proceso reescribe entero
+    ("user_registry.json" -> "user_registry.shard2.json").
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+class ShardStatus:
+    """
+    Contadores compartidos entre el supervisor y los workers, uno por shard: último latido,
+    updates recibidos, tareas completadas y tareas en cola. Cada worker escribe solo su posición,
+    así que no necesitan lock.
+    """
+
+    def __init__(self, context, num_shards):
+        self.heartbeats = context.RawArray('d', num_shards)
+        self.received = context.RawArray('q', num_shards)
+        self.processed = context.RawArray('q', num_shards)
+        self.queued = context.RawArray('q', num_shards)
+
+    def beat(self, shard, received, processed, queued):
+        self.received[shard] = received
+        self.processed[shard] = processed
+        self.queued[shard] = queued
+        self.heartbeats[shard] = time.time()
+
+    def reset(self, shard):
+        self.received[shard] = 0
+        self.processed[shard] = 0
+        self.queued[shard] = 0
+        self.heartbeats[shard] = time.time()  # El worker nuevo tiene el plazo completo para arrancar
+
+
+class ShardWorker:
+    """
+    Lado del supervisor de un shard: el proceso worker, la tubería hacia él y una cola local
+    con los updates pendientes de enviar. Un hilo emisor vacía la cola en la tubería; si el
+    worker cae, los updates esperan en la cola hasta que el proceso nuevo esté listo.
+
+    Los updates escritos en la tubería que el worker todavía no había leído (según su último
+    latido) se guardan hasta que los lee, y se reenvían al proceso nuevo si el anterior muere.
+    """
+
+    def __init__(self, supervisor, shard):
+        self.supervisor = supervisor
+        self.shard = shard
+        self.backlog = queue.Queue()
+        self.process = None
+        self.conn = None
+        self.started_at = 0.0
+        self.restart_at = None
+        self.failures = 0  # Reinicios seguidos sin llegar a MIN_HEALTHY_UPTIME
+        self._sender = None
+        self._lock = threading.Lock()  # Protege la tubería y los updates sin confirmar
+        self._unread = deque()  # Enviados al proceso actual que quizá aún no leyó
+        self._delivered = 0  # Enviados al proceso actual
+        self._resend = deque()  # Pendientes de reenviar al proceso nuevo
+        self._last_processed = 0
+        self._progress_at = 0.0
+
+        self.routed = 0
+        self.sent = 0
+        self.resent = 0
+        self.restarts = 0
+        # Contadores de los procesos anteriores (los del proceso actual empiezan en 0)
+        self.received_base = 0
+        self.processed_base = 0
+
+    def spawn(self):
+        context = self.supervisor.context
+        status = self.supervisor.status
+        reader, writer = context.Pipe(duplex=False)
+        status.reset(self.shard)
+        self.process = context.Process(
+            target=self.supervisor.target,
+            args=(self.shard, self.supervisor.num_shards, reader, status),
+            name=f"shard-{self.shard}",
+            daemon=False,
+        )
+        self.process.start()
+        reader.close()  # Solo el worker lee; así el emisor ve la tubería rota si el worker muere
+        with self._lock:
+            # Lo que se intentó enviar entre la caída y el reinicio fue a la tubería vieja
+            self.resent += len(self._unread)
+            self._resend.extend(self._unread)
+            self._unread.clear()
+            self._delivered = 0
+            old_conn, self.conn = self.conn, writer
+        if old_conn is not None:
+            old_conn.close()
+        if self._resend:
+            self.backlog.put(None)  # Despertar al emisor para que reenvíe
+        self.started_at = self._progress_at = time.time()
+        self._last_processed = 0
+        self.restart_at = None
+        logger.info(f"Worker del shard {self.shard} iniciado (pid {self.process.pid})")
+
+    def start_sender(self):
+        self._sender = threading.Thread(target=self._send_loop, name=f"shard-sender-{self.shard}", daemon=True)
+        self._sender.start()
+
+    def put(self, data):
+        self.backlog.put(data)
+        self.routed += 1
+
+    def _send_loop(self):
+        while True:
+            with self._lock:
+                data = self._resend.popleft() if self._resend else None
+            if data is None:
+                data = self.backlog.get()
+                if data is None:
+                    continue  # Solo venía a despertar al emisor
+            while not self._send(data):
+                if self.supervisor.stopping and not data:
+                    return
+                time.sleep(0.5)  # Worker caído: el update queda sin leer y se reenvía al proceso nuevo
+                if data:
+                    break
+            if not data:
+                return  # Señal de parada entregada
+
+    def _send(self, data):
+        with self._lock:
+            if data:
+                self._unread.append(data)
+                self._delivered += 1
+                # Descartar los que el worker ya leyó según su último latido
+                unread = self._delivered - self.supervisor.status.received[self.shard]
+                while len(self._unread) > max(unread, 1):
+                    self._unread.popleft()
+            try:
+                self.conn.send_bytes(data)
+            except (OSError, ValueError):
+                return False
+        if data:
+            self.sent += 1
+        return True
+
+    def check(self, now):
+        """
+        Comprobar la salud del worker y reiniciarlo si murió, dejó de latir o dejó de avanzar.
+        """
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.spawn()
+            return
+        status = self.supervisor.status
+        if not self.process.is_alive():
+            logger.error(f"El worker del shard {self.shard} terminó (código {self.process.exitcode})")
+            self._restart(now)
+            return
+        silence = now - status.heartbeats[self.shard]
+        if silence > self.supervisor.heartbeat_timeout:
+            logger.error(f"El worker del shard {self.shard} no da señales desde hace {silence:.0f} s")
+            self._restart(now)
+            return
+        processed = status.processed[self.shard]
+        if processed != self._last_processed or status.queued[self.shard] == 0:
+            self._last_processed = processed
+            self._progress_at = now
+        elif now - self._progress_at > self.supervisor.stall_timeout:
+            logger.error(f"El worker del shard {self.shard} tiene {status.queued[self.shard]} tareas en cola "
+                         f"sin completar ninguna desde hace {now - self._progress_at:.0f} s")
+            self._restart(now)
+
+    def _restart(self, now):
+        status = self.supervisor.status
+        self.stop_process(timeout=0)
+        with self._lock:
+            # Los updates que el worker no llegó a leer se reenvían; los que ya estaban en su
+            # dispatcher se pierden con él
+            unread = max(0, self._delivered - status.received[self.shard])
+            while len(self._unread) > unread:
+                self._unread.popleft()
+            self.received_base += status.received[self.shard]
+            self.processed_base += status.processed[self.shard]
+            lost = status.queued[self.shard]
+            status.reset(self.shard)
+        if lost > 0:
+            logger.warning(f"Shard {self.shard}: {lost} tareas en cola se perdieron con el worker")
+        self.restarts += 1
+        metrics.increment("shard_restarts", shard=str(self.shard))
+        self.failures = self.failures + 1 if now - self.started_at < MIN_HEALTHY_UPTIME else 0
+        delay = min(MAX_RESTART_DELAY, 2 ** self.failures - 1) if self.failures else 0
+        self.restart_at = now + delay
+        logger.info(f"Reiniciando el worker del shard {self.shard}" + (f" en {delay} s" if delay else ""))
+
+    def stop_process(self, timeout):
+        if self.process is None:
+            return
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+    def get_stats(self):
+        status = self.supervisor.status
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            "shard": self.shard,
+            "pid": self.process.pid if alive else None,
+            "restarts": self.restarts,
+            "routed": self.routed,
+            "backlog": self.backlog.qsize(),
+            "resent": self.resent,
+            "received": self.received_base + status.received[self.shard],
+            "processed": self.processed_base + status.processed[self.shard],
+            "queued": status.queued[self.shard],
+        }
+
+
+class ShardSupervisor:
+    """
+    Reparte los updates entre `num_shards` procesos worker según el autor (ver
+    `raw_update_owner_id`), de modo que el historial de cada usuario lo escribe un único proceso.
+    Dentro del worker el dispatcher sigue ordenando por chat. Cada proceso tiene su propio GIL:
+    Pillow, las plantillas y la serialización JSON de un shard no frenan a los demás.
+
+    Lo que no es de un usuario se comparte entre procesos con cuidado: el archivo de IDs solo
+    recibe líneas agregadas (lo reescribe únicamente el proceso principal al cargarlo) y el de
+    marcas de aparición es uno por shard (`shard_file`). Los límites de envío por chat son de
+    cada proceso, así que un grupo atendido por varios shards puede superar el suyo.
+
+    `target(shard, num_shards, conn, status)` es la función que ejecuta cada worker: lee los
+    updates de `conn` (JSON en bytes, b"" para detenerse) y llama a `status.beat()` al menos una
+    vez por segundo. Un hilo vigila los latidos y el avance de cada worker, lo reinicia si hace
+    falta y registra cada `stats_interval` segundos el rendimiento por shard.
+    """
+
+    def __init__(self, target, num_shards=SHARD_WORKERS, heartbeat_timeout=SHARD_HEARTBEAT_TIMEOUT,
+                 stall_timeout=SHARD_STALL_TIMEOUT, stats_interval=SHARD_STATS_INTERVAL):
+        self.target = target
+        self.num_shards = max(1, num_shards)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.stall_timeout = stall_timeout
+        self.stats_interval = stats_interval
+        # spawn: los workers no heredan los hilos ni los locks del proceso de ingesta
+        self.context = multiprocessing.get_context('spawn')
+        self.status = ShardStatus(self.context, self.num_shards)
+        self.shards = [ShardWorker(self, shard) for shard in range(self.num_shards)]
+        self.stopping = False
+        self._stop_event = threading.Event()
+        self._monitor = None
+        self._last_stats = (time.time(), [0] * self.num_shards)
+
+    def start(self):
+        for shard in self.shards:
+            shard.spawn()
+            shard.start_sender()
+        self._monitor = threading.Thread(target=self._monitor_loop, name="shard-monitor", daemon=True)
+        self._monitor.start()
+        logger.info(f"Supervisor iniciado con {self.num_shards} workers")
+
+    def route(self, data):
+        """
+        Enviar un update (dict de la Bot API) al worker dueño de su autor.
+        """
+        shard = shard_for(raw_update_owner_id(data), self.num_shards)
+        self.shards[shard].put(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        metrics.increment("shard_updates", shard=str(shard))
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(1.0):
+            now = time.time()
+            for shard in self.shards:
+                try:
+                    shard.check(now)
+                except Exception as e:
+                    logger.error(f"Error al comprobar el worker del shard {shard.shard}: {e}", exc_info=True)
+            if now - self._last_stats[0] >= self.stats_interval:
+                self.log_stats(now)
+
+    def log_stats(self, now=None):
+        """
+        Registrar updates recibidos por segundo desde el último registro, por shard.
+        """
+        now = now or time.time()
+        stats = self.get_stats()
+        since, previous = self._last_stats
+        elapsed = max(now - since, 1e-9)
+        for entry, before in zip(stats, previous):
+            entry["updates_per_second"] = round((entry["received"] - before) / elapsed, 2)
+            logger.info(f"Shard {entry['shard']}: {entry}")
+        self._last_stats = (now, [entry["received"] for entry in stats])
+        return stats
+
+    def get_stats(self):
+        return [shard.get_stats() for shard in self.shards]
+
+    def shutdown(self, timeout=30):
+        """
+        Enviar a cada worker lo que queda en su backlog seguido de la señal de parada, y esperar
+        a que vacíen sus colas y guarden su estado.
+        """
+        self.stopping = True
+        self._stop_event.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for shard in self.shards:
+            shard.backlog.put(b"")
+        deadline = time.monotonic() + timeout
+        for shard in self.shards:
+            if shard._sender is not None:
+                shard._sender.join(timeout=max(0.0, deadline - time.monotonic()))
+        for shard in self.shards:
+            shard.stop_process(timeout=max(0.0, deadline - time.monotonic()))
+            if shard.conn is not None:
+                shard.conn.close()
+        self.log_stats()
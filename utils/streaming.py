@@ -0,0 +1,144 @@
+# utils/streaming.py
+import time
+import logging
+from config import STREAM_EDIT_INTERVAL
+from utils.send_queue import outbound
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+SEND_TIMEOUT = 60  # Segundos máximos esperando a que Telegram confirme un envío
+
+
+class TelegramStreamSink:
+    """
+    Muestra una respuesta en Telegram mientras se genera.
+
+    Envía un mensaje provisional y lo va editando con el texto acumulado, como mucho una vez
+    cada `edit_interval` segundos (Telegram limita la frecuencia de ediciones). Si el texto
+    supera el límite de un mensaje, se cierra el actual y se continúa en uno nuevo.
+    Todo pasa por el planificador de salida: las ediciones pendientes del mismo mensaje se
+    fusionan y solo se espera a Telegram cuando hace falta un message_id o al terminar.
+    """
+
+    def __init__(self, bot, chat_id, placeholder="...", edit_interval=STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.placeholder = placeholder
+        self.edit_interval = edit_interval
+        self.text = ""  # Texto completo recibido
+        self._offset = 0  # Inicio del texto que corresponde al mensaje actual
+        self._message_id = None
+        self._shown = ""  # Último texto enviado al mensaje actual
+        self._last_edit = 0.0
+        self._last_future = None
+
+    def start(self):
+        self._message_id = self._send_new(self.placeholder)
+        self._last_edit = time.monotonic()
+
+    def push(self, chunk):
+        """
+        Agregar un fragmento de texto y actualizar el mensaje si ya pasó el intervalo.
+        """
+        if not chunk:
+            return
+        self.text += chunk
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            self._render()
+
+    def finish(self):
+        """
+        Mostrar el texto final. Devuelve True si el mensaje quedó completo en Telegram.
+        """
+        self._render()
+        if self._message_id is None:
+            return False
+        if self._last_future is not None:
+            try:
+                self._last_future.result(timeout=SEND_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Error al mostrar el texto final en streaming: {e}")
+                return False
+        return True
+
+    def discard(self):
+        """
+        Eliminar el mensaje provisional (cuando no hubo respuesta que mostrar).
+        """
+        if self._message_id is None:
+            return
+        outbound.submit(self.bot, self.chat_id, 'delete_message', self.chat_id, self._message_id)
+
+    def _send_new(self, text):
+        try:
+            message = outbound.send_message(self.bot, self.chat_id, text).result(timeout=SEND_TIMEOUT)
+            self._shown = text
+            return message.message_id
+        except Exception as e:
+            logger.warning(f"Error al enviar el mensaje en streaming: {e}")
+            return None
+
+    def _render(self):
+        pending = self.text[self._offset:]
+        # Cerrar los mensajes llenos y continuar en uno nuevo. El cierre se confirma antes de
+        # avanzar: si la edición falla, ese fragmento se reintenta en la próxima actualización
+        while len(pending) > TELEGRAM_MAX_MESSAGE_LENGTH:
+            if not self._edit(pending[:TELEGRAM_MAX_MESSAGE_LENGTH], wait=True):
+                self._last_edit = time.monotonic()
+                return
+            self._offset += TELEGRAM_MAX_MESSAGE_LENGTH
+            pending = self.text[self._offset:]
+            self._message_id = None
+            self._shown = ""
+        if pending:
+            self._edit(pending)
+        self._last_edit = time.monotonic()
+
+    def _edit(self, text, wait=False):
+        """
+        Mostrar `text` en el mensaje actual. Con `wait` se espera la confirmación de Telegram.
+        Devuelve False si el envío falló.
+        """
+        if self._message_id is None:
+            self._message_id = self._send_new(text)
+            self._last_future = None
+            return self._message_id is not None
+        if text != self._shown:  # Telegram rechaza ediciones sin cambios
+            self._last_future = outbound.submit(
+                self.bot, self.chat_id, 'edit_message_text', text,
+                chat_id=self.chat_id, message_id=self._message_id,
+                coalesce_key=('edit', self._message_id)
+            )
+            self._shown = text
+        if wait and self._last_future is not None:
+            try:
+                self._last_future.result(timeout=SEND_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Error al editar el mensaje en streaming: {e}")
+                self._shown = ""  # Se vuelve a enviar en el próximo intento
+                self._last_future = None
+                return False
+        return True
+
+def stream_reply(bot, chat_id, chunks, cancelled=None):
+    """
+    Enviar a Telegram una respuesta generada en streaming.
+    Devuelve (texto_final, enviado) donde `enviado` indica si el texto final quedó visible.
+    Si `cancelled()` devuelve True se deja de leer el stream y se elimina el mensaje provisional.
+    """
+    sink = TelegramStreamSink(bot, chat_id)
+    sink.start()
+    for chunk in chunks:
+        if cancelled is not None and cancelled():
+            if hasattr(chunks, 'close'):
+                chunks.close()  # Cerrar la conexión con el proveedor
+            sink.discard()
+            return "", False
+        sink.push(chunk)
+    if not sink.text:
+        # No hubo respuesta: se elimina el mensaje provisional
+        sink.discard()
+        return "", False
+    return sink.text, sink.finish()
@@ -1,19 +1,20 @@
-def summarize_messages(messages, max_length=1000):
+# Encabezado con el que el resumen acumulado se entrega a los modelos
+SUMMARY_HEADER = "Resumen de la conversación anterior:"
+
+def build_summary_request(previous_summary, messages):
     """
-    Resume una lista de mensajes para que no exceda una longitud máxima.
-    
-    :param messages: Lista de diccionarios con los mensajes
-    :param max_length: Longitud máxima del resumen
-    :return: Lista resumida de mensajes
+    Construye la instrucción para actualizar el resumen acumulado de una conversación
+    con los turnos que ya no entran en la ventana de contexto.
+
+    :param previous_summary: Resumen anterior (puede estar vacío)
+    :param messages: Turnos nuevos a incorporar, del más antiguo al más reciente
+    :return: Texto de la instrucción para el modelo
     """
-    summary = []
-    current_length = 0
-    
-    for message in reversed(messages):
-        message_length = len(message['content'])
-        if current_length + message_length > max_length:
-            break
-        summary.insert(0, message)
-        current_length += message_length
-    
-    return summary
\ No newline at end of file
+    lines = [f"{message['role']}: {message['content']}" for message in messages]
+    return (
+        "Actualiza el resumen de una conversación entre un usuario y un asistente. "
+        "Conserva los datos, preferencias, temas abiertos y decisiones importantes; descarta saludos y relleno. "
+        "Escribe solo el resumen, en prosa breve y en el idioma de la conversación.\n\n"
+        f"Resumen anterior:\n{previous_summary or '(vacío)'}\n\n"
+        "Turnos nuevos:\n" + "\n".join(lines)
+    )
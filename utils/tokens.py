@@ -0,0 +1,22 @@
+# utils/tokens.py
+
+# Estimación de tokens sin depender del tokenizador de cada proveedor: Llama, Mixtral y Gemini
+# rondan los 4 caracteres por token en español e inglés, suficiente para medir y presupuestar.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # Rol y separadores que el proveedor agrega a cada mensaje
+
+
+def count_tokens(text):
+    """
+    Estimar la cantidad de tokens de un texto.
+    """
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_message_tokens(messages):
+    """
+    Estimar los tokens de una lista de mensajes con rol ({"role": ..., "content": ...}).
+    """
+    return sum(count_tokens(message.get('content')) + MESSAGE_OVERHEAD_TOKENS for message in messages)
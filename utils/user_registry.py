@@ -0,0 +1,166 @@
+# utils/user_registry.py
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from config import USER_IDS_FILE, USER_REGISTRY_FILE, USER_REGISTRY_PERSIST_INTERVAL
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """
+    Registro de usuarios conocidos en memoria.
+
+    Los IDs se cargan una sola vez desde `user_chat_ids.txt` en un set, así que comprobar si un
+    usuario es nuevo no toca el disco. Los usuarios nuevos se agregan al archivo bajo un lock
+    (sin duplicados aunque varios hilos reciban mensajes a la vez). Las marcas de primera y
+    última aparición se actualizan en memoria y un hilo en segundo plano las escribe de forma
+    atómica cada `persist_interval` segundos (y al detener el bot), fuera del hilo del handler.
+    """
+
+    def __init__(self, ids_path=USER_IDS_FILE, seen_path=USER_REGISTRY_FILE,
+                 persist_interval=USER_REGISTRY_PERSIST_INTERVAL):
+        self.ids_path = ids_path
+        self.seen_path = seen_path
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()  # Evita escrituras simultáneas del archivo de marcas
+        self._ids = set()
+        self._ordered_ids = []  # Orden de registro, para los envíos masivos
+        self._seen = {}  # user_id -> [first_seen, last_seen] (segundos epoch)
+        self._seen_dirty = False
+        self._thread = None  # Hilo de escritura periódica, creado en el primer registro
+        self.load()
+
+    def load(self):
+        """
+        Cargar los IDs y las marcas de tiempo desde disco.
+        Si el archivo de IDs tiene duplicados, se reescribe limpio, solo en el proceso principal:
+        en los workers de supervisor.py otros procesos le están agregando IDs a la vez.
+        """
+        ids = []
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, 'r') as file:
+                ids = [line.strip() for line in file if line.strip()]
+        unique_ids = list(dict.fromkeys(ids))
+
+        seen = {}
+        if os.path.exists(self.seen_path):
+            try:
+                with open(self.seen_path, 'r', encoding='utf-8') as file:
+                    for user_id, entry in json.load(file).items():
+                        seen[user_id] = [
+                            datetime.fromisoformat(entry["first_seen"]).timestamp(),
+                            datetime.fromisoformat(entry["last_seen"]).timestamp(),
+                        ]
+            except Exception as e:
+                logger.warning(f"Error al cargar el registro de usuarios {self.seen_path}: {e}")
+
+        with self._lock:
+            self._ids = set(unique_ids)
+            self._ordered_ids = unique_ids
+            self._seen = seen
+        if len(unique_ids) != len(ids) and multiprocessing.parent_process() is None:
+            logger.info(f"Se eliminaron {len(ids) - len(unique_ids)} IDs duplicados de {self.ids_path}")
+            self._write_atomic(self.ids_path, "".join(f"{user_id}\n" for user_id in unique_ids))
+        logger.info(f"Registro de usuarios cargado: {len(unique_ids)} usuarios")
+
+    def register(self, user_id):
+        """
+        Registrar un mensaje del usuario. Devuelve True si el usuario es nuevo.
+        """
+        user_id = str(user_id)
+        now = time.time()
+        is_new = False
+        if user_id in self._ids:
+            with self._lock:
+                entry = self._seen.get(user_id)
+                if entry:
+                    entry[1] = now
+                else:
+                    self._seen[user_id] = [now, now]
+                self._seen_dirty = True
+        else:
+            with self._lock:
+                if user_id not in self._ids:
+                    with open(self.ids_path, 'a') as file:
+                        file.write(user_id + '\n')
+                    self._ids.add(user_id)
+                    self._ordered_ids.append(user_id)
+                    is_new = True
+                self._seen.setdefault(user_id, [now, now])[1] = now
+                self._seen_dirty = True
+
+        self._ensure_persister()
+        return is_new
+
+    def __contains__(self, user_id):
+        return str(user_id) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def all_ids(self):
+        """
+        Devolver todos los IDs registrados, en orden de registro.
+        """
+        with self._lock:
+            return list(self._ordered_ids)
+
+    def _ensure_persister(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="user-registry-persist", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.persist_interval)
+            self.persist()
+
+    def persist(self):
+        """
+        Escribir las marcas de primera/última aparición si cambiaron.
+        """
+        with self._persist_lock:
+            self._persist()
+
+    def _persist(self):
+        with self._lock:
+            if not self._seen_dirty:
+                return
+            data = {
+                user_id: {
+                    "first_seen": datetime.fromtimestamp(first).isoformat(),
+                    "last_seen": datetime.fromtimestamp(last).isoformat(),
+                }
+                for user_id, (first, last) in self._seen.items()
+            }
+            self._seen_dirty = False
+        try:
+            self._write_atomic(self.seen_path, json.dumps(data, ensure_ascii=False))
+        except Exception as e:
+            with self._lock:
+                self._seen_dirty = True
+            logger.error(f"Error al guardar el registro de usuarios: {e}")
+
+    @staticmethod
+    def _write_atomic(path, content):
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(temp_file, path)
+
+
+# Instancia compartida, cargada una sola vez al arrancar
+user_registry = UserRegistry()
+atexit.register(user_registry.persist)
@@ -1,15 +1,207 @@
-import tempfile
+# utils/voice.py
+import os
+import re
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from itertools import repeat
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from gtts import gTTS
+from config import TTS_CACHE_DIR, TTS_CACHE_MAX_MB, TTS_CHUNK_CHARS, TTS_WORKERS
+from utils.metrics import metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Fin de frase: el espacio que sigue a un signo de cierre
+_SENTENCE_END = re.compile(r'(?<=[.!?…;:])\s+')
+
+
+def split_text(text, max_chars=TTS_CHUNK_CHARS):
+    """
+    Dividir el texto en fragmentos de hasta `max_chars` caracteres cortando entre frases.
+    Las frases cortas seguidas se agrupan y las que superan el límite se cortan por palabras.
+    """
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars  # Una palabra más larga que el límite
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class VoiceCache:
+    """
+    Caché en disco del audio sintetizado: un MP3 por (hash del texto, idioma).
+
+    El índice (archivo -> tamaño, del menos al más usado) se carga del directorio la primera
+    vez que se usa, ordenado por fecha de modificación; cada acierto actualiza esa fecha, así
+    que el orden de uso sobrevive a los reinicios. Cuando el total supera `max_mb` se borran
+    los archivos usados hace más tiempo.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_mb=TTS_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = None  # OrderedDict, cargado en el primer uso
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(text, lang):
+        return f"{lang}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]}.mp3"
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        self._size = sum(self._entries.values())
+        logger.info(f"Caché de voz cargada: {len(self._entries)} fragmentos, {self._size / 1048576:.1f} MB")
+
+    def get(self, key):
+        """
+        Devolver el audio guardado para `key`, o None.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, "rb") as file:
+                audio = file.read()
+            os.utime(path)
+        except OSError:
+            # Borrado por otro proceso que comparte el directorio
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        path = os.path.join(self.directory, key)
+        temp_file = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_file, "wb") as file:
+                file.write(audio)
+            os.replace(temp_file, path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el audio en la caché de voz: {e}")
+            return
+        evicted = []
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._size += len(audio) - self._entries.pop(key, 0)
+            self._entries[key] = len(audio)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                name, size = self._entries.popitem(last=False)
+                self._size -= size
+                self.evictions += 1
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries or ()),
+                "size_mb": round(self._size / 1048576, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class TextToSpeech:
+    """
+    Síntesis de voz con gTTS. El texto se divide en fragmentos por frases que se buscan en la
+    caché y, los que faltan, se sintetizan en paralelo. Los fragmentos MP3 se concatenan en
+    memoria (como hace gTTS con sus propias partes) sin pasar por archivos temporales.
+    """
+
+    def __init__(self, cache=None, chunk_chars=TTS_CHUNK_CHARS, workers=TTS_WORKERS):
+        self.cache = cache or VoiceCache()
+        self.chunk_chars = chunk_chars
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts")
+
+    def _synthesize_chunk(self, text, lang):
+        key = self.cache.key(text, lang)
+        audio = self.cache.get(key)
+        if audio is None:
+            buffer = BytesIO()
+            gTTS(text=text, lang=lang).write_to_fp(buffer)
+            audio = buffer.getvalue()
+            self.cache.put(key, audio)
+        return audio
+
+    def synthesize(self, text, lang='es'):
+        """
+        Devolver el audio MP3 del texto completo.
+        """
+        chunks = split_text(text, self.chunk_chars)
+        if not chunks:
+            raise ValueError("No hay texto para convertir en voz")
+        with metrics.timer('tts'):
+            if len(chunks) == 1:
+                return self._synthesize_chunk(chunks[0], lang)
+            # Los fragmentos repetidos dentro del mismo texto se sintetizan una sola vez
+            unique = list(dict.fromkeys(chunks))
+            audio = dict(zip(unique, self._executor.map(self._synthesize_chunk, unique, repeat(lang))))
+            return b"".join(audio[chunk] for chunk in chunks)
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+
+# Instancia compartida por todo el proceso
+tts = TextToSpeech()
+
 
 def text_to_voice(text, lang='es'):
     """
-    Convierte texto a voz y guarda el resultado en un archivo temporal.
-    
+    Convierte texto a voz.
+
     :param text: El texto a convertir en voz
     :param lang: El idioma del texto (por defecto 'es' para español)
-    :return: Un objeto NamedTemporaryFile con el audio generado
+    :return: Los bytes del audio MP3, listos para enviar con send_voice
     """
-    tts = gTTS(text=text, lang=lang)
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-    tts.save(temp_file.name)
-    return temp_file
\ No newline at end of file
+    return tts.synthesize(text, lang)
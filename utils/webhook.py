@@ -0,0 +1,187 @@
+# utils/webhook.py
+import hmac
+import json
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+from config import (
+    WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_REGISTER, WEBHOOK_DEDUPE_SIZE
+)
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1024 * 1024  # Un update nunca se acerca a 1 MB
+
+
+class RecentUpdates:
+    """
+    Conjunto acotado de update_id ya recibidos. Telegram reintenta un update si no recibe
+    respuesta a tiempo y un balanceador puede repetir una petición: los duplicados se descartan.
+    """
+
+    def __init__(self, max_size=WEBHOOK_DEDUPE_SIZE):
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, update_id):
+        """
+        Registrar el update. Devuelve False si ya se había recibido.
+        """
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen[update_id] = None
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def discard(self, update_id):
+        """
+        Olvidar el update (no se pudo entregar): el reintento de Telegram ya no es un duplicado.
+        """
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+
+class WebhookServer:
+    """
+    Servidor HTTP que recibe los updates de Telegram por webhook.
+
+    Comprueba el token secreto, descarta los update_id repetidos, entrega el update al bot
+    (con el dispatcher activo solo se encola en el worker de su chat) y responde 200 de
+    inmediato, sin esperar a que se procese. El TLS lo termina el balanceador o proxy inverso.
+    GET /healthz responde 200 para las comprobaciones del balanceador.
+
+    Con `on_update(data)` el update se entrega tal cual llega (un dict) en lugar de pasarlo al
+    bot; el supervisor lo usa para reenviarlo a un worker sin deserializarlo.
+    """
+
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                 on_update=None):
+        self.bot = bot
+        self.on_update = on_update
+        self.host = host
+        self.port = port
+        self.path = path
+        if not secret:
+            # Sirve para un solo proceso; con varios detrás del balanceador debe fijarse WEBHOOK_SECRET
+            secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET no está definido: se usa un token aleatorio para este proceso")
+        self.secret = secret
+        self.recent = RecentUpdates()
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def handle_update(self, body):
+        """
+        Procesar el cuerpo de una petición. Devuelve el código HTTP de la respuesta.
+        """
+        try:
+            data = json.loads(body)
+            update_id = data["update_id"]
+        except (ValueError, KeyError, TypeError):
+            self._count('rejected')
+            return 400
+        if not self.recent.add(update_id):
+            self._count('duplicates')
+            return 200  # Ya recibido: se confirma para que Telegram no lo reintente
+        self._count('received')
+        try:
+            if self.on_update is not None:
+                self.on_update(data)
+            else:
+                self.bot.process_new_updates([types.Update.de_json(data)])
+        except Exception:
+            self.recent.discard(update_id)  # Telegram recibe un 500 y lo reintenta
+            raise
+        return 200
+
+    def _make_handler(self):
+        webhook = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def _respond(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                self._respond(200 if self.path == "/healthz" else 404)
+
+            def do_POST(self):
+                if self.path != webhook.path:
+                    self._respond(404)
+                    return
+                if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ""), webhook.secret):
+                    webhook._count('rejected')
+                    self._respond(403)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    webhook._count('rejected')
+                    self._respond(413 if length > MAX_BODY_SIZE else 400)
+                    return
+                try:
+                    status = webhook.handle_update(self.rfile.read(length))
+                except Exception as e:
+                    logger.error(f"Error al recibir el update: {e}", exc_info=True)
+                    status = 500  # Telegram lo reintentará
+                self._respond(status)
+
+            def log_message(self, format, *args):
+                pass  # Sin una línea de log por cada update
+
+        return WebhookHandler
+
+    def register(self, url=WEBHOOK_URL):
+        """
+        Registrar el webhook en Telegram con el token secreto.
+        """
+        self.bot.set_webhook(
+            url=url + self.path,
+            secret_token=self.secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"Webhook registrado en {url + self.path}")
+
+    def start(self):
+        """
+        Registrar el webhook (si WEBHOOK_REGISTER) y atender peticiones en un hilo aparte.
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Servidor de webhook escuchando en {self.host}:{self.port}{self.path}")
+        if WEBHOOK_REGISTER:
+            self.register()
+
+    def shutdown(self):
+        """
+        Dejar de aceptar updates. El webhook sigue registrado: Telegram guarda los updates
+        pendientes y los entrega cuando el bot vuelve a estar disponible.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def get_stats(self):
+        with self._lock:
+            return {"received": self.received, "duplicates": self.duplicates, "rejected": self.rejected}